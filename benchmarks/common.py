@@ -0,0 +1,163 @@
+"""Shared helpers for the Buena Vista benchmark scripts.
+
+Every benchmark writes a JSON document shaped like:
+
+    {"meta": {...}, "results": {"<workload>": {"ops_per_sec": ..., "p50_ms": ...}}}
+
+so that `python -m benchmarks.compare old.json new.json` can diff any two runs.
+"""
+import datetime
+import json
+import platform
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def summarize(latencies_s: List[float], elapsed_s: float, **extra) -> dict:
+    """Turns a list of per-operation latencies (in seconds) into a result entry."""
+    ms = [x * 1000 for x in latencies_s]
+    ret = {
+        "ops": len(ms),
+        "elapsed_s": elapsed_s,
+        "ops_per_sec": len(ms) / elapsed_s if elapsed_s else 0.0,
+        "mean_ms": sum(ms) / len(ms) if ms else 0.0,
+        "p50_ms": percentile(ms, 0.50),
+        "p95_ms": percentile(ms, 0.95),
+        "p99_ms": percentile(ms, 0.99),
+        "max_ms": max(ms) if ms else 0.0,
+    }
+    ret.update(extra)
+    return ret
+
+
+def timed(op: Callable[[int], None], iterations: int, warmup: int = 0) -> dict:
+    """Runs `op(i)` serially and summarizes its latency."""
+    for i in range(warmup):
+        op(i)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        op(i)
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def concurrent(
+    make_op: Callable[[int], Callable[[int], None]],
+    workers: int,
+    iterations: int,
+) -> dict:
+    """Runs `iterations` operations on each of `workers` threads.
+
+    `make_op(worker)` is called on the worker thread to build its operation, so each
+    worker can open its own connection.
+    """
+    latencies: List[float] = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(workers + 1)
+    errors: List[BaseException] = []
+
+    def _run(worker: int):
+        try:
+            op = make_op(worker)
+        except BaseException as e:
+            errors.append(e)
+            barrier.abort()
+            return
+        mine = []
+        try:
+            barrier.wait()
+            for i in range(iterations):
+                t = time.perf_counter()
+                op(i)
+                mine.append(time.perf_counter() - t)
+        except BaseException as e:
+            errors.append(e)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=_run, args=(w,)) for w in range(workers)]
+    for t in threads:
+        t.start()
+    try:
+        barrier.wait()
+    except threading.BrokenBarrierError:
+        pass
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return summarize(latencies, elapsed, workers=workers)
+
+
+def setup_data(db, rows: int, wide_columns: int):
+    """Creates the bench_points and bench_wide tables shared by the end-to-end benchmarks."""
+    db.execute(
+        f"""
+        CREATE OR REPLACE TABLE bench_points AS
+        SELECT i AS id
+        , 'name_' || i AS name
+        , CAST(i * 1.5 AS DOUBLE) AS value
+        , TIMESTAMP '2020-01-01' + to_seconds(i) AS ts
+        , DATE '2020-01-01' + CAST(i % 1000 AS INTEGER) AS day
+        , i % 2 = 0 AS flag
+        FROM range({rows}) t(i)
+        """
+    )
+    cols = ", ".join(f"i + {c} AS c{c}" for c in range(wide_columns))
+    db.execute(
+        f"CREATE OR REPLACE TABLE bench_wide AS SELECT {cols} FROM range(1000) t(i)"
+    )
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except Exception:
+        return None
+
+
+def write_results(path: str, benchmark: str, params: dict, results: Dict[str, dict]):
+    doc = {
+        "meta": {
+            "benchmark": benchmark,
+            "revision": _git_revision(),
+            "timestamp": datetime.datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "params": params,
+        },
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2, sort_keys=True)
+    print(f"Wrote {len(results)} results to {path}")
+
+
+def print_results(results: Dict[str, dict]):
+    width = max((len(k) for k in results), default=10)
+    print(f"{'workload':<{width}}  {'ops/s':>10}  {'p50 ms':>8}  {'p95 ms':>8}  {'p99 ms':>8}")
+    for name, r in results.items():
+        print(
+            f"{name:<{width}}  {r['ops_per_sec']:>10.1f}  {r['p50_ms']:>8.4g}  "
+            f"{r['p95_ms']:>8.4g}  {r['p99_ms']:>8.4g}"
+        )
@@ -0,0 +1,63 @@
+"""Compares two benchmark result files written by the scripts in this directory.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 10
+
+Exits non-zero when any workload's p50 latency regressed by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(base: dict, current: dict, metric: str, threshold: float):
+    regressions = []
+    rows = []
+    for name, cur in current["results"].items():
+        old = base["results"].get(name)
+        if not old or metric not in old or metric not in cur:
+            rows.append((name, None, cur.get(metric), None))
+            continue
+        before, after = old[metric], cur[metric]
+        delta = ((after - before) / before * 100) if before else 0.0
+        rows.append((name, before, after, delta))
+        if delta > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--metric", default="p50_ms")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=10.0,
+        help="percent increase in the metric that counts as a regression",
+    )
+    args = parser.parse_args()
+
+    base, current = load(args.baseline), load(args.current)
+    print(
+        f"{base['meta'].get('revision')} -> {current['meta'].get('revision')}"
+        f" ({args.metric})"
+    )
+    rows, regressions = compare(base, current, args.metric, args.threshold)
+    width = max((len(r[0]) for r in rows), default=10)
+    for name, before, after, delta in rows:
+        if before is None:
+            print(f"{name:<{width}}  {'(new)':>12}  {after:>12.4g}")
+        else:
+            flag = "  REGRESSION" if name in regressions else ""
+            print(f"{name:<{width}}  {before:>12.4g}  {after:>12.4g}  {delta:+7.1f}%{flag}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
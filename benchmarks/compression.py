@@ -0,0 +1,129 @@
+"""CPU versus bandwidth tradeoff of compressing /v1/statement result pages.
+
+    python -m benchmarks.compression --bandwidth-mbps 10 100 1000
+
+Renders a page of each result shape exactly as the endpoint would, then times every
+codec and level on it. Each result records the compression ratio and the modeled time
+to deliver the page (compress + transfer + decompress) at each bandwidth, so the
+levels and `compress_min_bytes` threshold can be picked for a given link.
+"""
+import argparse
+import gzip
+import time
+import zlib
+
+import duckdb
+
+from buenavista.backends.duckdb import DuckDBConnection
+from buenavista.examples.duckdb_http import rewriter
+from buenavista.http import compression, encoding, schemas, type_mapping
+from buenavista.http.main import _convert_columns, _encode_rows
+
+from .common import print_results, setup_data, timed, write_results
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def shapes(args):
+    return {
+        "point": "SELECT * FROM bench_points WHERE id = 42",
+        "scan": f"SELECT * FROM bench_points LIMIT {args.result_rows}",
+        "wide": f"SELECT * FROM bench_wide LIMIT {args.result_rows}",
+        "agg": "SELECT day, count(*), sum(value) FROM bench_points GROUP BY day",
+    }
+
+
+def render_page(sess, sql: str) -> bytes:
+    qr = sess.execute_sql(rewriter.rewrite(sql))
+    cols, encoders = _convert_columns(qr, type_mapping.json_encoder)
+    result = schemas.QueryResult(
+        id="bench",
+        info_uri="http://127.0.0.1/info",
+        stats=schemas.StatementStats(state="FINISHED", elapsed_time_millis=0),
+    )
+    rows = list(_encode_rows(qr, cols, encoders))
+    return encoding.encode_query_result(result, encoding.render_columns(cols), rows)
+
+
+def codecs(args):
+    ret = {}
+    for level in args.gzip_levels:
+        ret[f"gzip{level}"] = (
+            lambda data, level=level: compression._Gzip(level).compress(data, True),
+            gzip.decompress,
+        )
+    if zstandard is not None:
+        for level in args.zstd_levels:
+            ret[f"zstd{level}"] = (
+                lambda data, level=level: compression._Zstd(level).compress(data, True),
+                lambda data: zstandard.ZstdDecompressor().decompressobj().decompress(data),
+            )
+    return ret
+
+
+def run(args) -> dict:
+    db = duckdb.connect()
+    setup_data(db, args.rows, args.wide_columns)
+    conn = DuckDBConnection(db)
+    sess = conn.create_session()
+    results = {}
+    try:
+        for shape, sql in shapes(args).items():
+            page = render_page(sess, sql)
+            for name, (compress, decompress) in codecs(args).items():
+                compressed = compress(page)
+                assert decompress(compressed) == page
+                r = timed(lambda i: compress(page), args.iterations, warmup=2)
+                d = timed(lambda i: decompress(compressed), args.iterations, warmup=2)
+                r["bytes"] = len(page)
+                r["compressed_bytes"] = len(compressed)
+                r["ratio"] = len(page) / len(compressed)
+                r["decompress_p50_ms"] = d["p50_ms"]
+                for mbps in args.bandwidth_mbps:
+                    plain = len(page) * 8 / (mbps * 1000)
+                    packed = len(compressed) * 8 / (mbps * 1000)
+                    r[f"plain_{mbps}mbps_ms"] = plain
+                    r[f"delivered_{mbps}mbps_ms"] = r["p50_ms"] + packed + d["p50_ms"]
+                results[f"{shape}_{name}"] = r
+    finally:
+        conn.close_session(sess)
+    return results
+
+
+def print_tradeoffs(results: dict, bandwidths):
+    print()
+    header = "".join(f"  {f'{b} Mb/s':>16}" for b in bandwidths)
+    print(f"{'workload':<16}  {'bytes':>9}  {'ratio':>6}{header}")
+    for name, r in results.items():
+        cells = "".join(
+            f"  {r[f'plain_{b}mbps_ms']:>7.3g}->{r[f'delivered_{b}mbps_ms']:<7.3g}"
+            for b in bandwidths
+        )
+        print(f"{name:<16}  {r['bytes']:>9}  {r['ratio']:>6.2f}{cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--wide-columns", type=int, default=50)
+    parser.add_argument("--result-rows", type=int, default=10_000)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--gzip-levels", type=int, nargs="+", default=[1, 6])
+    parser.add_argument("--zstd-levels", type=int, nargs="+", default=[1, 3])
+    parser.add_argument(
+        "--bandwidth-mbps", type=int, nargs="+", default=[10, 100, 1000]
+    )
+    parser.add_argument("--output", default="compression.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    print_tradeoffs(results, args.bandwidth_mbps)
+    write_results(args.output, "compression", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Load generator for the Trino-compatible /v1/statement endpoint.
+
+    python -m benchmarks.http_statement --concurrency 1 8 --mix point=6,scan=3,agg=1
+
+Starts `http.main.quacko` on a local uvicorn instance over a DuckDB dataset, drives it
+with a weighted mix of queries, and records request latency, the time spent turning
+each result shape into JSON, and the server's resident memory.
+"""
+import argparse
+import random
+import resource
+import threading
+import time
+
+import duckdb
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from buenavista.backends.duckdb import DuckDBConnection
+from buenavista.examples.duckdb_http import rewriter
+from buenavista.http import encoding, schemas, type_mapping
+from buenavista.http.main import (
+    _convert_columns,
+    _convert_query_result,
+    _encode_rows,
+    quacko,
+)
+
+from .common import concurrent, print_results, setup_data, summarize, write_results
+
+
+def queries(args):
+    return {
+        "point": lambda r: f"SELECT * FROM bench_points WHERE id = {r.randrange(args.rows)}",
+        "scan": lambda r: f"SELECT * FROM bench_points LIMIT {args.result_rows}",
+        "wide": lambda r: f"SELECT * FROM bench_wide LIMIT {args.result_rows}",
+        "agg": lambda r: "SELECT day, count(*), sum(value) FROM bench_points GROUP BY day",
+    }
+
+
+def parse_mix(spec: str):
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix.append((name.strip(), float(weight or 1)))
+    return mix
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+class RSSSampler(threading.Thread):
+    def __init__(self, interval: float = 0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            self.peak = max(self.peak, rss_bytes())
+            time.sleep(self.interval)
+
+    def stop(self) -> int:
+        self.running = False
+        self.join()
+        return self.peak
+
+
+def start_server(conn: DuckDBConnection, port: int) -> uvicorn.Server:
+    app = FastAPI()
+    quacko(app, conn, rewriter)
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def run_statement(client: httpx.Client, sql: str) -> int:
+    """Submits a statement and follows nextUri until the query finishes."""
+    resp = client.post("/v1/statement", content=sql)
+    resp.raise_for_status()
+    body = resp.json()
+    rows = len(body.get("data") or [])
+    while body.get("nextUri"):
+        resp = client.get(body["nextUri"])
+        resp.raise_for_status()
+        body = resp.json()
+        rows += len(body.get("data") or [])
+    if body.get("error"):
+        raise Exception(body["error"].get("message"))
+    return rows
+
+
+def serialization_times(conn: DuckDBConnection, args) -> dict:
+    """Times the conversion and JSON encoding of each query shape in isolation.
+
+    `convert_*` + `encode_*` is the generic jsonable_encoder path, `fast_encode_*` the
+    column-at-a-time encoding the endpoint uses, each measured end to end from the result.
+    """
+    rng = random.Random(0)
+    ret = {}
+    sess = conn.create_session()
+    try:
+        for name, make in queries(args).items():
+            convert, encode, fast, rows = [], [], [], 0
+            for _ in range(args.serialization_iterations):
+                qr = sess.execute_sql(rewriter.rewrite(make(rng)))
+                t = time.perf_counter()
+                cols, data, update_type = _convert_query_result(qr)
+                convert.append(time.perf_counter() - t)
+                result = schemas.QueryResult(
+                    id="bench",
+                    info_uri="http://127.0.0.1/info",
+                    columns=cols,
+                    data=data,
+                    update_type=update_type,
+                    stats=schemas.StatementStats(state="FINISHED", elapsed_time_millis=0),
+                )
+                t = time.perf_counter()
+                JSONResponse(content=jsonable_encoder(result))
+                encode.append(time.perf_counter() - t)
+                rows = len(data)
+
+                qr = sess.execute_sql(rewriter.rewrite(make(rng)))
+                t = time.perf_counter()
+                cols, encoders = _convert_columns(qr, type_mapping.json_encoder)
+                encoded = list(_encode_rows(qr, cols, encoders))
+                result.data = None
+                encoding.encode_query_result(
+                    result, encoding.render_columns(cols), encoded
+                )
+                fast.append(time.perf_counter() - t)
+            ret[f"convert_{name}"] = summarize(convert, sum(convert), rows=rows)
+            ret[f"encode_{name}"] = summarize(encode, sum(encode), rows=rows)
+            ret[f"fast_encode_{name}"] = summarize(fast, sum(fast), rows=rows)
+    finally:
+        conn.close_session(sess)
+    return ret
+
+
+def run(args) -> dict:
+    db = duckdb.connect()
+    setup_data(db, args.rows, args.wide_columns)
+    conn = DuckDBConnection(db)
+    results = serialization_times(conn, args)
+
+    server = start_server(conn, args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    mix = parse_mix(args.mix)
+    makers = queries(args)
+    names, weights = [m[0] for m in mix], [m[1] for m in mix]
+    try:
+        for workers in args.concurrency:
+
+            def make_worker(worker: int):
+                rng = random.Random(worker)
+                client = httpx.Client(
+                    base_url=base_url,
+                    headers={"X-Trino-User": f"bench{worker}"},
+                    timeout=60,
+                )
+
+                def op(i):
+                    name = rng.choices(names, weights)[0]
+                    run_statement(client, makers[name](rng))
+
+                return op
+
+            rss_before = rss_bytes()
+            sampler = RSSSampler()
+            sampler.start()
+            r = concurrent(make_worker, workers, args.iterations)
+            r["rss_before_bytes"] = rss_before
+            r["rss_peak_bytes"] = sampler.stop()
+            r["rss_after_bytes"] = rss_bytes()
+            r["max_rss_bytes"] = (
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+            )
+            results[f"statement_mix_x{workers}"] = r
+    finally:
+        server.should_exit = True
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--wide-columns", type=int, default=50)
+    parser.add_argument("--result-rows", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--serialization-iterations", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8])
+    parser.add_argument(
+        "--mix",
+        default="point=6,scan=3,agg=1",
+        help="comma-separated name=weight pairs from: point, scan, wide, agg",
+    )
+    parser.add_argument("--output", default="http_statement.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    write_results(args.output, "http_statement", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Microbenchmarks for the hot paths between the wire and the backend.
+
+    python -m benchmarks.micro --output micro.json
+    python -m benchmarks.compare benchmarks/baselines/micro.json micro.json
+
+Covers Rewriter.rewrite on BI-style queries, the bv_dialects SHOW/PREPARE handling,
+the BVTYPE_TO_PGTYPE text and binary converters, BVBuffer reads and writes,
+BuenaVistaHandler.handle_bind parameter decoding and RecordBatchIterator.
+"""
+import argparse
+import datetime
+import decimal
+import io
+import logging
+import re
+import struct
+import timeit
+from typing import Callable, Dict
+
+import pyarrow as pa
+
+from buenavista.backends.duckdb import RecordBatchIterator
+from buenavista.core import BVType
+from buenavista.examples.duckdb_http import rewriter as trino_rewriter
+from buenavista.examples.duckdb_postgres import rewriter as pg_rewriter
+from buenavista.postgres import BVTYPE_TO_PGTYPE, BuenaVistaHandler, BVBuffer, BVContext
+
+from .common import percentile, print_results, write_results
+
+BI_QUERIES = {
+    "point": "SELECT * FROM orders WHERE id = 42",
+    "dashboard": """
+        SELECT c.region, date_trunc('month', o.created_at) AS month
+        , count(*) AS orders, sum(o.amount) AS revenue
+        FROM orders o JOIN customers c ON o.customer_id = c.id
+        WHERE o.created_at >= DATE '2023-01-01' AND c.status IN ('active', 'trial')
+        GROUP BY 1, 2 ORDER BY 2, 4 DESC LIMIT 100
+    """,
+    "window": """
+        SELECT id, amount, row_number() OVER (PARTITION BY customer_id ORDER BY created_at) AS rn
+        , avg(amount) OVER (PARTITION BY customer_id) AS avg_amount
+        FROM orders WHERE amount > 10
+    """,
+}
+
+SAMPLE_VALUES = {
+    BVType.BIGINT: 1234567890123,
+    BVType.BOOL: True,
+    BVType.BYTES: b"\x00\x01binary",
+    BVType.DATE: datetime.date(2023, 4, 5),
+    BVType.DECIMAL: decimal.Decimal("12345.6789"),
+    BVType.FLOAT: 3.14159,
+    BVType.INTEGER: 42,
+    BVType.INTERVAL: datetime.timedelta(days=3, seconds=7),
+    BVType.JSON: {"a": [1, 2, 3], "b": "x"},
+    BVType.TEXT: "hello, world",
+    BVType.TIME: datetime.time(12, 34, 56, 789),
+    BVType.TIMESTAMP: datetime.datetime(2023, 4, 5, 12, 34, 56, 789),
+}
+
+
+def rewriter_benches() -> Dict[str, Callable]:
+    ret = {}
+    for name, sql in BI_QUERIES.items():
+        ret[f"rewrite_trino_{name}"] = lambda sql=sql: trino_rewriter.rewrite(sql)
+        ret[f"rewrite_pg_{name}"] = lambda sql=sql: pg_rewriter.rewrite(sql)
+    ret["rewrite_jdbc_columns"] = lambda: trino_rewriter.rewrite(
+        "SELECT * FROM system.jdbc.columns WHERE table_schem = 'main'"
+    )
+    return ret
+
+
+def dialect_benches() -> Dict[str, Callable]:
+    return {
+        "dialect_show_tables": lambda: trino_rewriter.rewrite(
+            "SHOW TABLES FROM main LIKE 'ord%'"
+        ),
+        "dialect_show_schemas": lambda: trino_rewriter.rewrite("SHOW SCHEMAS"),
+        "dialect_prepare": lambda: trino_rewriter.rewrite(
+            "PREPARE stmt1 FROM SELECT * FROM orders WHERE id = ?"
+        ),
+    }
+
+
+def converter_benches() -> Dict[str, Callable]:
+    ret = {}
+    for bvtype, value in SAMPLE_VALUES.items():
+        pgtype = BVTYPE_TO_PGTYPE[bvtype]
+        name = bvtype.name.lower()
+        ret[f"convert_text_{name}"] = lambda f=pgtype[1], v=value: f(v).encode("utf-8")
+        if len(pgtype) > 2 and pgtype[2]:
+            ret[f"convert_binary_{name}"] = lambda f=pgtype[2], v=value: f(v)
+    return ret
+
+
+def buffer_benches() -> Dict[str, Callable]:
+    def write_row():
+        buf = BVBuffer()
+        buf.write_int32(12)
+        buf.write_bytes(b"hello, world")
+        buf.write_int16(7)
+        buf.write_string("column_name")
+        return buf.get_value()
+
+    data = write_row() * 100
+
+    def read_rows():
+        buf = BVBuffer(io.BytesIO(data))
+        for _ in range(100):
+            n = buf.read_int32()
+            buf.read_bytes(n)
+            buf.read_int16()
+            buf.read_bytes(12)
+
+    return {"buffer_write_row": write_row, "buffer_read_100_rows": read_rows}
+
+
+class _NullHandler(BuenaVistaHandler):
+    def __init__(self):
+        # Skip socketserver's setup; handle_bind only needs the handler's methods
+        pass
+
+    def send_bind_complete(self):
+        pass
+
+
+def _bind_payload(values, formats):
+    buf = BVBuffer()
+    buf.write_string("")
+    buf.write_string("stmt")
+    buf.write_int16(len(formats))
+    for f in formats:
+        buf.write_int16(f)
+    buf.write_int16(len(values))
+    for v in values:
+        buf.write_int32(len(v))
+        buf.write_bytes(v)
+    buf.write_int16(0)
+    return buf.get_value()
+
+
+def bind_benches() -> Dict[str, Callable]:
+    handler = _NullHandler()
+    ctx = BVContext(session=None, rewriter=None, params={})
+    text_values = [str(i).encode() for i in range(10)]
+    ctx.add_statement("stmt", "SELECT 1", [25] * 10)
+    text = _bind_payload(text_values, [0])
+    binary_values = [struct.pack("!q", i) for i in range(10)]
+    binary = _bind_payload(binary_values, [1])
+
+    def bind_text():
+        ctx.stmts["stmt"] = ("SELECT 1", [25] * 10)
+        handler.handle_bind(ctx, text)
+
+    def bind_binary():
+        ctx.stmts["stmt"] = ("SELECT 1", [20] * 10)
+        handler.handle_bind(ctx, binary)
+
+    return {"bind_10_text_params": bind_text, "bind_10_binary_params": bind_binary}
+
+
+def record_batch_benches() -> Dict[str, Callable]:
+    n = 10_000
+    table = pa.table(
+        {
+            "id": pa.array(range(n), pa.int64()),
+            "name": pa.array([f"name_{i}" for i in range(n)]),
+            "value": pa.array([i * 1.5 for i in range(n)]),
+            "flag": pa.array([i % 2 == 0 for i in range(n)]),
+            "ts": pa.array(
+                [datetime.datetime(2020, 1, 1) + datetime.timedelta(seconds=i) for i in range(n)]
+            ),
+        }
+    )
+    batches = table.to_batches(max_chunksize=2048)
+
+    def iterate():
+        rbr = pa.RecordBatchReader.from_batches(table.schema, batches)
+        for _ in RecordBatchIterator(rbr):
+            pass
+
+    return {"record_batch_iterator_10k_rows": iterate}
+
+
+BENCHES = [
+    rewriter_benches,
+    dialect_benches,
+    converter_benches,
+    buffer_benches,
+    bind_benches,
+    record_batch_benches,
+]
+
+
+def measure(fn: Callable, repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    ms = [r * 1000 for r in runs]
+    best = min(runs)
+    return {
+        "ops": number * repeat,
+        "elapsed_s": sum(runs) * number,
+        "ops_per_sec": 1.0 / best if best else 0.0,
+        "mean_ms": sum(ms) / len(ms),
+        "p50_ms": percentile(ms, 0.50),
+        "p95_ms": percentile(ms, 0.95),
+        "p99_ms": percentile(ms, 0.99),
+        "max_ms": max(ms),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--filter", default=None, help="regex of benchmarks to run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--min-time", type=float, default=0.2, help="seconds per repeat"
+    )
+    parser.add_argument("--output", default="micro.json")
+    args = parser.parse_args()
+
+    # PREPARE falls back to a Command parse, which sqlglot warns about every time
+    logging.getLogger("sqlglot").setLevel(logging.ERROR)
+    pattern = re.compile(args.filter) if args.filter else None
+    results = {}
+    for group in BENCHES:
+        for name, fn in group().items():
+            if pattern and not pattern.search(name):
+                continue
+            results[name] = measure(fn, args.repeat, args.min_time)
+    print_results(results)
+    write_results(args.output, "micro", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Postgres wire protocol benchmarks against an in-process DuckDB-backed server.
+
+    python -m benchmarks.pg_wire --output pg_wire.json
+
+Starts `examples.duckdb_postgres.create` on a local port and drives it with psycopg.
+"""
+import argparse
+import threading
+import time
+
+import duckdb
+import psycopg
+
+from buenavista.examples.duckdb_postgres import create
+
+from .common import concurrent, print_results, setup_data, timed, write_results
+
+
+def start_server(db: duckdb.DuckDBPyConnection, port: int):
+    server = create(db, ("127.0.0.1", port))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    time.sleep(0.2)
+    return server
+
+
+def run(args) -> dict:
+    db = duckdb.connect()
+    setup_data(db, args.rows, args.wide_columns)
+    server = start_server(db, args.port)
+    dsn = f"postgresql://bench@127.0.0.1:{args.port}/memory"
+    results = {}
+
+    try:
+        with psycopg.connect(
+            dsn, autocommit=True, cursor_factory=psycopg.ClientCursor
+        ) as conn:
+            cur = conn.cursor()
+
+            def simple_point(i):
+                cur.execute(
+                    f"SELECT * FROM bench_points WHERE id = {i % args.rows}"
+                )
+                cur.fetchall()
+
+            results["simple_point_lookup"] = timed(
+                simple_point, args.iterations, warmup=args.warmup
+            )
+
+        with psycopg.connect(dsn, autocommit=True) as conn:
+            cur = conn.cursor()
+
+            def prepared_point(i):
+                cur.execute(
+                    "SELECT * FROM bench_points WHERE id = %s",
+                    (i % args.rows,),
+                    prepare=True,
+                )
+                cur.fetchall()
+
+            results["extended_prepared_lookup"] = timed(
+                prepared_point, args.iterations, warmup=args.warmup
+            )
+
+            scans = max(1, args.iterations // 100)
+            for binary in (False, True):
+                fmt = "binary" if binary else "text"
+                bcur = conn.cursor(binary=binary)
+
+                def large_scan(i):
+                    bcur.execute("SELECT id, value, ts, day, flag FROM bench_points")
+                    bcur.fetchall()
+
+                def wide_scan(i):
+                    bcur.execute("SELECT * FROM bench_wide")
+                    bcur.fetchall()
+
+                r = timed(large_scan, scans)
+                r["rows_per_sec"] = r["ops_per_sec"] * args.rows
+                results[f"large_scan_{fmt}"] = r
+                r = timed(wide_scan, scans)
+                r["cells_per_sec"] = r["ops_per_sec"] * 1000 * args.wide_columns
+                results[f"wide_scan_{fmt}"] = r
+
+        def make_worker(worker: int):
+            conn = psycopg.connect(dsn, autocommit=True)
+            cur = conn.cursor()
+
+            def op(i):
+                cur.execute(
+                    "SELECT * FROM bench_points WHERE id = %s",
+                    ((worker * args.iterations + i) % args.rows,),
+                )
+                cur.fetchall()
+
+            return op
+
+        for workers in args.concurrency:
+            results[f"concurrent_lookup_x{workers}"] = concurrent(
+                make_worker, workers, max(1, args.iterations // workers)
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+        db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=5499)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--wide-columns", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 4, 16]
+    )
+    parser.add_argument("--output", default="pg_wire.json")
+    args = parser.parse_args()
+
+    results = run(args)
+    print_results(results)
+    write_results(args.output, "pg_wire", vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Helpers for moving BV query results in and out of Arrow; requires pyarrow."""
+import json
+from typing import Any, Iterator, List, Tuple
+
+import pyarrow as pa
+
+from .core import BVType, QueryResult
+
+BVTYPE_TO_ARROW = {
+    BVType.BIGINT: pa.int64(),
+    BVType.BOOL: pa.bool_(),
+    BVType.BYTES: pa.binary(),
+    BVType.DATE: pa.date32(),
+    BVType.FLOAT: pa.float64(),
+    BVType.INTEGER: pa.int32(),
+    BVType.INTERVAL: pa.duration("us"),
+    BVType.TEXT: pa.string(),
+    BVType.TIME: pa.time64("us"),
+    BVType.TIMESTAMP: pa.timestamp("us"),
+    BVType.INTEGERARRAY: pa.list_(pa.int64()),
+    BVType.STRINGARRAY: pa.list_(pa.string()),
+    BVType.NULL: pa.null(),
+}
+
+
+def to_arrow_type(bvtype: BVType) -> pa.DataType:
+    # Decimals, JSON and anything we can't type travel as their text form
+    return BVTYPE_TO_ARROW.get(bvtype, pa.string())
+
+
+def to_arrow_table(columns: List[Tuple[str, BVType]], rows: List[dict]) -> pa.Table:
+    schema = pa.schema([(name, BVTYPE_TO_ARROW[t]) for name, t in columns])
+    return pa.Table.from_pylist(rows, schema=schema)
+
+
+def _as_text(v: Any) -> Any:
+    if v is None or isinstance(v, str):
+        return v
+    if isinstance(v, (dict, list)):
+        return json.dumps(v)
+    return str(v)
+
+
+def record_batches(
+    qr: QueryResult, batch_size: int = 10_000
+) -> Tuple[pa.Schema, Iterator[pa.RecordBatch]]:
+    """Returns the schema and record batches for the unread rows of a query result.
+
+    Results that are already columnar hand over their batches as they are; others are
+    read a row at a time and packed into batches of `batch_size` rows.
+    """
+    batches = qr.record_batches()
+    if batches is not None:
+        first = next(batches, None)
+        if first is not None:
+            return first.schema, _chain(first, batches)
+
+    columns = [qr.column(i) for i in range(qr.column_count())]
+    schema = pa.schema([(name, to_arrow_type(t)) for name, t in columns])
+    if batches is not None:
+        return schema, iter([])
+    return schema, _from_rows(qr, schema, batch_size)
+
+
+def _chain(first: pa.RecordBatch, rest: Iterator[pa.RecordBatch]):
+    yield first
+    yield from rest
+
+
+def _from_rows(
+    qr: QueryResult, schema: pa.Schema, batch_size: int
+) -> Iterator[pa.RecordBatch]:
+    text = [pa.types.is_string(f.type) for f in schema]
+    rows = qr.rows()
+    while True:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == batch_size:
+                break
+        if not chunk:
+            return
+        columns = []
+        for i, field in enumerate(schema):
+            values = [r[i] for r in chunk]
+            if text[i]:
+                values = [_as_text(v) for v in values]
+            columns.append(pa.array(values, field.type))
+        yield pa.RecordBatch.from_arrays(columns, schema=schema)
+        if len(chunk) < batch_size:
+            return
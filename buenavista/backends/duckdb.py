@@ -1,15 +1,28 @@
+import json
 import logging
+import os
 import re
-from typing import Dict, Iterator, List, Optional, Tuple
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+import duckdb
 import pyarrow as pa
 import sqlglot
 
+from buenavista.arrow import to_arrow_table
 from buenavista.core import BVType, Connection, QueryResult, Session
 
 
 logger = logging.getLogger(__name__)
 
+PARAMETERS = {
+    "server_version": "9.3.duckdb",
+    "client_encoding": "UTF8",
+    "DateStyle": "ISO",
+}
+
 
 def to_bvtype(t: pa.DataType) -> BVType:
     if pa.types.is_int64(t):
@@ -70,12 +83,29 @@ class RecordBatchIterator(Iterator[List[Optional[str]]]):
         self.i += 1
         return ret
 
+    def batches(self) -> Iterator[pa.RecordBatch]:
+        """Yields the rows not yet returned by `__next__`, a batch at a time."""
+        if self.rb is not None and self.i < self.rb.num_rows:
+            rb, self.i = self.rb.slice(self.i), self.rb.num_rows
+            yield rb
+        while True:
+            try:
+                self.rb = self.rbr.read_next_batch()
+            except StopIteration:
+                return
+            self.i = self.rb.num_rows
+            yield self.rb
+
 
 class DuckDBQueryResult(QueryResult):
     def __init__(
-        self, rbr: Optional[pa.RecordBatchReader] = None, status: Optional[str] = None
+        self,
+        rbr: Optional[pa.RecordBatchReader] = None,
+        status: Optional[str] = None,
+        profiler: Optional[Callable[[], Dict[str, Any]]] = None,
     ):
         super().__init__()
+        self.profiler = profiler
         if rbr:
             self.rbr = rbr
             self.rbi = RecordBatchIterator(self.rbr)
@@ -108,15 +138,137 @@ class DuckDBQueryResult(QueryResult):
         else:
             return iter([])
 
+    def record_batches(self) -> Optional[Iterator[pa.RecordBatch]]:
+        if self.rbi:
+            return self.rbi.batches()
+        return None
+
     def status(self) -> str:
         return self._status
 
+    def memory_usage(self) -> int:
+        if self.rbi and self.rbi.rb is not None:
+            return self.rbi.rb.nbytes
+        return 0
+
+    def profile(self) -> Dict[str, Any]:
+        return self.profiler() if self.profiler else {}
+
+
+_PREPARE_FROM = re.compile(r"PREPARE\s+(\w+)\s+FROM")
+
+
+class RewriteRules:
+    """Compatibility rewrites for the SQL clients send, applied before DuckDB sees it.
+
+    An exact rule replaces a whole statement. Substring rules replace every occurrence
+    of their text, and every one that matches applies. Each statement costs a dict
+    lookup and one pass of a regex alternating over all the substrings, however many
+    rules are registered.
+    """
+
+    def __init__(self):
+        self.exact: Dict[str, str] = {}
+        self.substrings: Dict[str, str] = {}
+        self.hits: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self._pattern: Optional[re.Pattern] = None
+
+    def add_exact(self, sql: str, replacement: str) -> "RewriteRules":
+        self.exact[sql] = replacement
+        self.hits.setdefault(sql, 0)
+        return self
+
+    def add_substring(self, text: str, replacement: str) -> "RewriteRules":
+        self.substrings[text] = replacement
+        self.hits.setdefault(text, 0)
+        self._pattern = None
+        return self
+
+    def _compile(self) -> Optional[re.Pattern]:
+        if self._pattern is None and self.substrings:
+            # Longest first, so a rule always wins over any rule that is a prefix of it
+            texts = sorted(self.substrings, key=len, reverse=True)
+            self._pattern = re.compile("|".join(re.escape(t) for t in texts))
+        return self._pattern
+
+    def apply(self, sql: str) -> str:
+        replacement = self.exact.get(sql)
+        if replacement is not None:
+            self._hit([sql])
+            return replacement
+        pattern = self._compile()
+        if pattern is None:
+            return sql
+        matched = []
+
+        def _replace(m: re.Match) -> str:
+            matched.append(m.group(0))
+            return self.substrings[m.group(0)]
+
+        sql = pattern.sub(_replace, sql)
+        if matched:
+            self._hit(set(matched))
+        return sql
+
+    def _hit(self, rules):
+        with self.lock:
+            for rule in rules:
+                self.hits[rule] += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.hits)
+
+
+REWRITE_RULES = (
+    RewriteRules()
+    .add_exact(
+        "SHOW search_path", "SELECT current_setting('search_path') as search_path"
+    )
+    .add_exact(
+        "SHOW TRANSACTION ISOLATION LEVEL",
+        "SELECT 'read committed' as transaction_isolation",
+    )
+    .add_exact("BEGIN READ ONLY", "BEGIN")
+    .add_exact(
+        "SELECT setting FROM pg_catalog.pg_settings WHERE name='max_index_keys'",
+        "SELECT 32 as setting",
+    )
+    .add_substring("::regclass", "")
+    .add_substring("::regtype", "")
+    .add_substring("::regproc", "")
+    .add_substring(
+        "pg_get_expr(ad.adbin, ad.adrelid, true)", "pg_get_expr(ad.adbin, ad.adrelid)"
+    )
+    .add_substring("pg_catalog.current_schemas", "current_schemas")
+    .add_substring("pg_catalog.generate_series", "generate_series")
+    # allow psql's \d to work by just displaying the owner's oid
+    .add_substring("pg_catalog.PG_GET_USERBYID", "")
+)
+
+
+def _mentions(sql: str, name: str) -> bool:
+    # A whole identifier, so that e.g. bv_stats doesn't register for bv_stats_daily
+    return re.search(rf"(?<!\w){re.escape(name)}(?!\w)", sql, re.I) is not None
+
 
 class DuckDBSession(Session):
-    def __init__(self, cursor):
+    # Shared by every session unless replaced; register more rules with add_exact and
+    # add_substring
+    rules = REWRITE_RULES
+
+    def __init__(
+        self, cursor, relations: Optional[dict] = None, profiling: bool = False
+    ):
         super().__init__()
         self._cursor = cursor
+        self.relations = relations or {}
         self.in_txn = False
+        self.profiling = profiling
+        if profiling:
+            # Collect the metrics without printing the query tree after every query
+            self._cursor.execute("PRAGMA enable_profiling='no_output'")
         self.refresh_config()
 
     def cursor(self):
@@ -125,6 +277,20 @@ class DuckDBSession(Session):
     def close(self):
         self._cursor.close()
 
+    def cancel(self):
+        self._cursor.interrupt()
+
+    def profile(self) -> Dict[str, Any]:
+        """The profiling metrics of the last query this session's cursor finished."""
+        info = json.loads(self._cursor.get_profiling_information(format="json"))
+        return {
+            "rows_scanned": info.get("cumulative_rows_scanned", 0),
+            "bytes_scanned": info.get("total_bytes_read", 0),
+            "cpu_time_ms": info.get("cpu_time", 0.0) * 1000,
+            "wall_time_ms": info.get("latency", 0.0) * 1000,
+            "peak_memory_bytes": info.get("system_peak_buffer_memory", 0),
+        }
+
     def refresh_config(self):
         self.config_params = set(
             [
@@ -140,7 +306,7 @@ class DuckDBSession(Session):
 
     def rewrite_sql(self, sql: str) -> str:
         """Some minimalist SQL rewrites, inspired by postlite, to make DBeaver less unhappy."""
-        if match := re.search(r"PREPARE\s+(\w+)\s+FROM", sql):
+        if match := _PREPARE_FROM.search(sql):
             stmt = match.group(1)
             target = f"PREPARE {stmt} FROM"
             replace = f"PREPARE {stmt} AS"
@@ -151,37 +317,7 @@ class DuckDBSession(Session):
                 return sql
             else:
                 return ""
-        elif sql == "SHOW search_path":
-            return "SELECT current_setting('search_path') as search_path"
-        elif sql == "SHOW TRANSACTION ISOLATION LEVEL":
-            return "SELECT 'read committed' as transaction_isolation"
-        elif sql == "BEGIN READ ONLY":
-            return "BEGIN"
-        elif (
-            sql
-            == "SELECT setting FROM pg_catalog.pg_settings WHERE name='max_index_keys'"
-        ):
-            return "SELECT 32 as setting"
-        elif "::regclass" in sql:
-            return sql.replace("::regclass", "")
-        elif "::regtype" in sql:
-            return sql.replace("::regtype", "")
-        elif "::regproc" in sql:
-            return sql.replace("::regproc", "")
-        elif "pg_get_expr(ad.adbin, ad.adrelid, true)" in sql:
-            return sql.replace(
-                "pg_get_expr(ad.adbin, ad.adrelid, true)",
-                "pg_get_expr(ad.adbin, ad.adrelid)",
-            )
-        elif "pg_catalog.current_schemas" in sql:
-            return sql.replace("pg_catalog.current_schemas", "current_schemas")
-        elif "pg_catalog.generate_series" in sql:
-            return sql.replace("pg_catalog.generate_series", "generate_series")
-        elif "pg_catalog.PG_GET_USERBYID" in sql:
-            # allow psql's \d to work
-            # just display the owner's oid
-            return sql.replace("pg_catalog.PG_GET_USERBYID", "")
-        return sql
+        return self.rules.apply(sql)
 
     def in_transaction(self) -> bool:
         return self.in_txn
@@ -212,13 +348,17 @@ class DuckDBSession(Session):
         logger.debug("Original SQL: %s", sql)
         sql = self.rewrite_sql(sql)
         logger.debug("Rewritten SQL: %s", sql)
+        for name, (columns, rows) in self.relations.items():
+            if _mentions(sql, name):
+                self._cursor.register(name, to_arrow_table(columns, rows()))
         if params:
             self._cursor.execute(sql, params)
         else:
             self._cursor.execute(sql)
 
+        profiler = self.profile if self.profiling else None
         if status:
-            return DuckDBQueryResult(status=status)
+            return DuckDBQueryResult(status=status, profiler=profiler)
 
         rb = None
         if self._cursor.description:
@@ -227,22 +367,197 @@ class DuckDBSession(Session):
                 status = "LOAD"
             elif not ("insert " in lsql or "update " in lsql or "delete " in lsql):
                 rb = self._cursor.fetch_record_batch()
-        return DuckDBQueryResult(rb, status)
+        return DuckDBQueryResult(rb, status, profiler)
 
 
 class DuckDBConnection(Connection):
-    def __init__(self, db):
+    def __init__(self, db, profiling: bool = False):
+        """`profiling` turns on DuckDB's query profiler in each session so that results
+        can report the rows scanned, CPU time and peak memory of their query."""
         super().__init__()
         self.db = db
+        self.profiling = profiling
 
     def parameters(self) -> Dict[str, str]:
-        return {
-            "server_version": "9.3.duckdb",
-            "client_encoding": "UTF8",
-            "DateStyle": "ISO",
-        }
+        return dict(PARAMETERS)
 
     def new_session(self) -> Session:
         cursor = self.db.cursor()
         cursor.execute("SET search_path='main'")
-        return DuckDBSession(cursor)
+        return DuckDBSession(cursor, self.relations, self.profiling)
+
+
+class DuckDBDatabase:
+    """A database file the manager has open, and the sessions using it."""
+
+    def __init__(self, name: str, db, conn: DuckDBConnection):
+        self.name = name
+        self.db = db
+        self.conn = conn
+        self.sessions = 0
+        self.last_used = time.monotonic()
+
+    def memory_usage(self) -> int:
+        cursor = self.db.cursor()
+        try:
+            return cursor.execute(
+                "SELECT coalesce(sum(memory_usage_bytes), 0) FROM duckdb_memory()"
+            ).fetchone()[0]
+        finally:
+            cursor.close()
+
+
+class DuckDBManager(Connection):
+    """Serves a directory of DuckDB files, one per tenant, from a single proxy.
+
+    Each session opens on the database its client asked for, `<name>.duckdb` under
+    `directory`, or on `default_database` if it didn't ask. A database is opened on its
+    first session and its handle is shared by all of them. Databases without sessions
+    are closed once idle for `idle_timeout` seconds, or least recently used first when
+    more than `max_open` are open or their memory use exceeds `memory_budget` bytes.
+    `config` is passed to `duckdb.connect` for each file, e.g. to set its memory_limit.
+    """
+
+    multi_database = True
+
+    _NAME = re.compile(r"^[A-Za-z0-9_\-]+$")
+
+    def __init__(
+        self,
+        directory: str,
+        default_database: Optional[str] = None,
+        max_open: Optional[int] = None,
+        memory_budget: Optional[int] = None,
+        idle_timeout: float = 600.0,
+        read_only: bool = False,
+        config: Optional[Dict[str, Any]] = None,
+        profiling: bool = False,
+    ):
+        super().__init__()
+        self.directory = directory
+        self.default_database = default_database
+        self.max_open = max_open
+        self.memory_budget = memory_budget
+        self.idle_timeout = idle_timeout
+        self.read_only = read_only
+        self.config = config or {}
+        self.profiling = profiling
+        self.databases: "OrderedDict[str, DuckDBDatabase]" = OrderedDict()
+        self.session_databases: Dict[Any, DuckDBDatabase] = {}
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self._reaper = threading.Thread(target=self._reap_forever, daemon=True)
+        self._reaper.start()
+
+    def path(self, name: str) -> str:
+        if not self._NAME.match(name):
+            raise ValueError(f"Invalid database name: {name}")
+        return os.path.join(self.directory, f"{name}.duckdb")
+
+    def _open(self, name: str) -> DuckDBDatabase:
+        path = self.path(name)
+        if not os.path.exists(path):
+            raise ValueError(f"Database {name} does not exist")
+        db = duckdb.connect(path, read_only=self.read_only, config=self.config)
+        conn = DuckDBConnection(db, self.profiling)
+        conn.relations = self.relations
+        self.opened += 1
+        return DuckDBDatabase(name, db, conn)
+
+    def _close(self, database: DuckDBDatabase):
+        logger.info("Closing DuckDB database %s", database.name)
+        del self.databases[database.name]
+        self.closed += 1
+        try:
+            database.db.close()
+        except Exception:
+            logger.exception("Error closing DuckDB database %s", database.name)
+
+    def _over_budget(self) -> bool:
+        if self.max_open is not None and len(self.databases) > self.max_open:
+            return True
+        if self.memory_budget is not None:
+            used = sum(d.memory_usage() for d in self.databases.values())
+            return used > self.memory_budget
+        return False
+
+    def _evict(self):
+        """Closes unused databases, least recently used first, until within limits."""
+        while self._over_budget():
+            unused = [d for d in self.databases.values() if d.sessions == 0]
+            if not unused:
+                break
+            self._close(unused[0])
+
+    def create_session(self, database: Optional[str] = None) -> Session:
+        name = database or self.default_database
+        if name is None:
+            raise ValueError("No database given and no default database set")
+        with self.lock:
+            db = self.databases.get(name)
+            if db is None:
+                db = self._open(name)
+                self.databases[name] = db
+            self.databases.move_to_end(name)
+            db.sessions += 1
+            db.last_used = time.monotonic()
+            self._evict()
+        try:
+            sess = db.conn.create_session()
+        except Exception:
+            with self.lock:
+                db.sessions -= 1
+            raise
+        with self.lock:
+            self._sessions[sess.id] = sess
+            self.session_databases[sess.id] = db
+        return sess
+
+    def close_session(self, session: Session):
+        if session is None:
+            return
+        with self.lock:
+            db = self.session_databases.pop(session.id, None)
+            self._sessions.pop(session.id, None)
+        if db is None:
+            return
+        db.conn.close_session(session)
+        with self.lock:
+            db.sessions -= 1
+            db.last_used = time.monotonic()
+
+    def reap(self) -> int:
+        """Closes databases that have had no sessions for `idle_timeout` seconds."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self.lock:
+            idle = [
+                d
+                for d in self.databases.values()
+                if d.sessions == 0 and d.last_used < cutoff
+            ]
+            for d in idle:
+                self._close(d)
+        return len(idle)
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(max(1.0, self.idle_timeout / 10))
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Error closing idle DuckDB databases")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "open": len(self.databases),
+                "opened": self.opened,
+                "closed": self.closed,
+                "databases": {
+                    name: {"sessions": d.sessions} for name, d in self.databases.items()
+                },
+            }
+
+    def parameters(self) -> Dict[str, str]:
+        return dict(PARAMETERS)
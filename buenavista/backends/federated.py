@@ -0,0 +1,463 @@
+import concurrent.futures
+import datetime
+import itertools
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import duckdb
+import pyarrow as pa
+import sqlglot
+from sqlglot import exp
+
+from buenavista.backends.duckdb import DuckDBConnection, DuckDBSession
+from buenavista.core import Connection, QueryResult, Session
+
+logger = logging.getLogger(__name__)
+
+DIALECT = "duckdb"
+
+_AGGREGATES = (exp.Sum, exp.Count, exp.Min, exp.Max, exp.Avg)
+# How a comparison reads with its operands swapped, e.g. `1 < x` as `x > 1`
+_FLIPPED = {
+    exp.EQ: exp.EQ,
+    exp.GT: exp.LT,
+    exp.GTE: exp.LTE,
+    exp.LT: exp.GT,
+    exp.LTE: exp.GTE,
+}
+
+
+class Partition:
+    """One DuckDB database holding a slice of a partitioned table.
+
+    `low` and `high` bound the values of the table's partition column in this slice,
+    inclusively, so that queries filtering on the column can skip it.
+    """
+
+    def __init__(self, db, low: Any = None, high: Any = None):
+        self.db = db
+        self.low = low
+        self.high = high
+
+    @classmethod
+    def open(cls, path: str, low: Any = None, high: Any = None) -> "Partition":
+        return cls(duckdb.connect(path, read_only=True), low, high)
+
+    def overlaps(self, low: Any, high: Any) -> bool:
+        """Whether any value in [low, high] (None meaning unbounded) can be in here."""
+        if low is not None and self.high is not None and low > self.high:
+            return False
+        if high is not None and self.low is not None and high < self.low:
+            return False
+        return True
+
+
+class PartitionedTable:
+    def __init__(self, name: str, column: Optional[str], partitions: List[Partition]):
+        self.name = name
+        self.column = column
+        self.partitions = partitions
+
+
+def _literal(e: exp.Expression, like: Any) -> Any:
+    """The Python value of a literal, converted to compare against `like`."""
+    if isinstance(e, exp.Cast):
+        e = e.this
+    if not isinstance(e, exp.Literal):
+        raise ValueError(f"Not a literal: {e.sql()}")
+    if isinstance(like, datetime.datetime):
+        return datetime.datetime.fromisoformat(e.this)
+    if isinstance(like, datetime.date):
+        return datetime.date.fromisoformat(e.this)
+    if isinstance(like, str):
+        if not e.is_string:
+            raise ValueError(f"Not a string: {e.sql()}")
+        return e.this
+    if isinstance(like, (int, float)):
+        # DuckDB casts a string compared to a number, so we do too
+        try:
+            return int(e.this)
+        except ValueError:
+            return float(e.this)
+    raise ValueError(f"Can't compare {e.sql()} to {like!r}")
+
+
+def _bounds(where: Optional[exp.Expression], table: PartitionedTable):
+    """The range of partition column values a WHERE clause allows, as (low, high)."""
+    low = high = None
+    if where is None or table.column is None:
+        return low, high
+    like = next(
+        (p.low if p.low is not None else p.high for p in table.partitions), None
+    )
+    conjuncts = [where.this]
+    if isinstance(where.this, exp.And):
+        conjuncts = list(where.this.flatten())
+    for c in conjuncts:
+        try:
+            if isinstance(c, exp.Between) and _is_column(c.this, table.column):
+                lo, hi = _literal(c.args["low"], like), _literal(c.args["high"], like)
+            elif isinstance(c, exp.In) and _is_column(c.this, table.column):
+                values = [_literal(v, like) for v in c.expressions]
+                lo, hi = min(values), max(values)
+            elif type(c) in _FLIPPED:
+                col, value, op = c.this, c.expression, type(c)
+                if not _is_column(col, table.column):
+                    col, value, op = value, col, _FLIPPED[op]
+                if not _is_column(col, table.column):
+                    continue
+                v = _literal(value, like)
+                lo = v if op in (exp.EQ, exp.GT, exp.GTE) else None
+                hi = v if op in (exp.EQ, exp.LT, exp.LTE) else None
+            else:
+                continue
+            if lo is not None:
+                low = lo if low is None else max(low, lo)
+            if hi is not None:
+                high = hi if high is None else min(high, hi)
+        except (ValueError, TypeError):
+            continue
+    return low, high
+
+
+def _is_column(e: exp.Expression, name: str) -> bool:
+    return isinstance(e, exp.Column) and e.name.lower() == name.lower()
+
+
+class _Plan:
+    """How to run a query over a partitioned table: a query for each partition, and a
+    query that combines their results, which are registered as `partials`."""
+
+    def __init__(
+        self, table: PartitionedTable, partial: str, final: str, partials: str
+    ):
+        self.table = table
+        self.partial = partial
+        self.final = final
+        self.partials = partials
+
+
+def _output_name(e: exp.Expression) -> str:
+    """The name DuckDB gives a select expression's column."""
+    if isinstance(e, (exp.Alias, exp.Column)):
+        return e.alias_or_name
+    if isinstance(e, exp.Count) and isinstance(e.this, exp.Star):
+        return "count_star()"
+    return e.sql(DIALECT, normalize_functions="lower")
+
+
+def _decompose_aggregates(
+    select: exp.Select, partials: str
+) -> Optional[Tuple[exp.Select, exp.Select]]:
+    """Splits an aggregate query into per-partition partial aggregates and the query
+    that merges them, or returns None if it can't be decomposed."""
+    group = select.args.get("group")
+    keys = list(group.expressions) if group else []
+    if any(isinstance(k, exp.Literal) for k in keys):
+        # GROUP BY 1 and friends refer to the select list; not worth handling
+        return None
+    key_names = {k.sql(DIALECT): f"_bv_g{i}" for i, k in enumerate(keys)}
+    partial_cols = [
+        exp.alias_(k.copy(), name) for k, name in zip(keys, key_names.values())
+    ]
+    counter = itertools.count()
+
+    def partial(e: exp.Expression) -> str:
+        name = f"_bv_a{next(counter)}"
+        partial_cols.append(exp.alias_(e, name))
+        return name
+
+    def merge(node: exp.Expression) -> exp.Expression:
+        name = key_names.get(node.sql(DIALECT))
+        if name is not None:
+            return exp.column(name)
+        if isinstance(node, exp.AggFunc):
+            if not isinstance(node, _AGGREGATES) or node.find(exp.Distinct):
+                raise ValueError("Not decomposable")
+            arg = node.this.copy() if node.this is not None else exp.Star()
+            if isinstance(node, exp.Avg):
+                s = partial(exp.Sum(this=arg))
+                c = partial(exp.Count(this=arg.copy()))
+                return exp.Div(
+                    this=exp.Sum(this=exp.column(s)),
+                    expression=exp.Sum(this=exp.column(c)),
+                )
+            col = exp.column(partial(node.copy()))
+            if isinstance(node, exp.Count):
+                total = exp.func("coalesce", exp.Sum(this=col), exp.Literal.number(0))
+                return exp.cast(total, "BIGINT")
+            if isinstance(node, exp.Sum):
+                return exp.Sum(this=col)
+            return type(node)(this=col)
+        if isinstance(node, exp.Column):
+            raise ValueError(f"Column {node.sql()} is neither grouped nor aggregated")
+        return node
+
+    final = select.copy()
+    try:
+        for arg in ("expressions", "having", "order"):
+            value = final.args.get(arg)
+            if value is None:
+                continue
+            if isinstance(value, list):
+                # Keep the output names of the original select list
+                merged = []
+                for e in value:
+                    name = _output_name(e)
+                    m = e.transform(merge, copy=True)
+                    if m.alias_or_name != name:
+                        m = exp.alias_(m.unalias(), name, quoted=True)
+                    merged.append(m)
+                final.set(arg, merged)
+            else:
+                final.set(arg, _merge_order_or_having(value, merge, select))
+    except ValueError:
+        return None
+    if next(counter) == 0 and not keys:
+        return None
+    final.set("where", None)
+    final.set("from_", exp.From(this=exp.to_table(partials)))
+    if keys:
+        final.set(
+            "group", exp.Group(expressions=[exp.column(n) for n in key_names.values()])
+        )
+    partial_select = select.copy()
+    for arg in ("having", "order", "limit", "offset"):
+        partial_select.set(arg, None)
+    partial_select.set("expressions", partial_cols)
+    if keys:
+        partial_select.set("group", exp.Group(expressions=[k.copy() for k in keys]))
+    return partial_select, final
+
+
+def _merge_order_or_having(
+    value: exp.Expression, merge, select: exp.Select
+) -> exp.Expression:
+    aliases = {e.alias for e in select.expressions if e.alias}
+
+    def _merge(node: exp.Expression) -> exp.Expression:
+        if isinstance(node, exp.Column) and not node.table and node.name in aliases:
+            # ORDER BY an output column
+            return node
+        return merge(node)
+
+    return value.transform(_merge, copy=True)
+
+
+class FederatedSession(Session):
+    """Runs queries on registered partitioned tables across their partitions, and
+    everything else on a local DuckDB session."""
+
+    def __init__(self, parent: "FederatedConnection", local: DuckDBSession):
+        super().__init__()
+        self.parent = parent
+        self.local = local
+        self._registered: List[str] = []
+
+    def cursor(self):
+        return self.local.cursor()
+
+    def close(self):
+        self._unregister()
+        self.parent.local.close_session(self.local)
+
+    def cancel(self):
+        self.local.cancel()
+
+    def in_transaction(self) -> bool:
+        return self.local.in_transaction()
+
+    def load_df_function(self, table: str):
+        return self.local.load_df_function(table)
+
+    def _unregister(self):
+        for name in self._registered:
+            try:
+                self.local.cursor().unregister(name)
+            except Exception:
+                logger.exception("Error unregistering %s", name)
+        self._registered = []
+
+    def execute_sql(self, sql: str, params=None) -> QueryResult:
+        # Results of the previous query have been read by now
+        self._unregister()
+        plan = None if params else self.parent.plan(sql)
+        if plan is None:
+            return self.local.execute_sql(sql, params)
+        table = self.parent.scatter(plan)
+        self.local.cursor().register(plan.partials, table)
+        self._registered.append(plan.partials)
+        return self.local.execute_sql(plan.final)
+
+
+class FederatedConnection(Connection):
+    """Fans queries over partitioned DuckDB tables out to one cursor per partition.
+
+    Register a table that is split across DuckDB files with
+    `register_partitioned_table`. A single-table SELECT on it runs on every partition
+    its WHERE clause doesn't rule out, in parallel on a pool of `max_workers` threads;
+    plain scans are concatenated and SUM/COUNT/MIN/MAX/AVG aggregates are merged from
+    per-partition partials, with ORDER BY and LIMIT applied to the combined result.
+    Other queries on a partitioned table gather its matching rows from every partition
+    and run locally, and queries that don't touch one run on the local `db`.
+    """
+
+    def __init__(self, db=None, max_workers: Optional[int] = None):
+        super().__init__()
+        self.local = DuckDBConnection(db if db is not None else duckdb.connect())
+        self.local.relations = self.relations
+        self.tables: Dict[str, PartitionedTable] = {}
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+        self._ids = itertools.count()
+        self.lock = threading.Lock()
+        self.scatters = 0
+        self.partitions_scanned = 0
+        self.partitions_pruned = 0
+
+    def register_partitioned_table(
+        self, name: str, column: Optional[str], partitions: List[Partition]
+    ):
+        """`column` is the column the table is partitioned on, if any, for pruning."""
+        self.tables[name.lower()] = PartitionedTable(name, column, partitions)
+
+    def new_session(self) -> Session:
+        return FederatedSession(self, self.local.create_session())
+
+    def parameters(self) -> Dict[str, str]:
+        return self.local.parameters()
+
+    def plan(self, sql: str) -> Optional[_Plan]:
+        try:
+            statements = sqlglot.parse(sql, read=DIALECT)
+        except Exception:
+            return None
+        if len(statements) != 1 or not isinstance(statements[0], exp.Select):
+            return None
+        select = statements[0]
+        tables = [
+            t for t in select.find_all(exp.Table) if t.name.lower() in self.tables
+        ]
+        if not tables:
+            return None
+        table = self.tables[tables[0].name.lower()]
+        partials = f"_bv_partials_{next(self._ids)}"
+        source = select.args.get("from_")
+        simple = (
+            len(tables) == 1
+            and source is not None
+            and source.this is tables[0]
+            and not select.args.get("joins")
+            and not select.args.get("with")
+            and not select.args.get("distinct")
+            and not select.find(exp.Window)
+            and len(list(select.find_all(exp.Select))) == 1
+        )
+        if simple and select.find(exp.AggFunc) is None and not select.args.get("group"):
+            return self._plan_scan(select, table, partials)
+        if simple:
+            decomposed = _decompose_aggregates(select, partials)
+            if decomposed is not None:
+                partial, final = decomposed
+                return _Plan(table, partial.sql(DIALECT), final.sql(DIALECT), partials)
+        if len({t.name.lower() for t in tables}) > 1:
+            # Only one table is gathered per query
+            return None
+        return self._plan_gather(select, table, tables, partials)
+
+    def _plan_scan(self, select: exp.Select, table: PartitionedTable, partials: str):
+        final = exp.select("*").from_(partials)
+        if order := select.args.get("order"):
+            names = {e.alias_or_name for e in select.expressions}
+            for o in order.expressions:
+                if not (isinstance(o.this, exp.Column) and o.this.name in names):
+                    # Ordering on something that isn't in the output
+                    refs = [select.args["from_"].this]
+                    return self._plan_gather(select, table, refs, partials)
+            final.set("order", order.copy())
+        limit, offset = select.args.get("limit"), select.args.get("offset")
+        partial = select.copy()
+        if offset is not None:
+            # Each partition has to return enough rows to skip over
+            partial.set("offset", None)
+            if limit is not None:
+                total = int(limit.expression.this) + int(offset.expression.this)
+                partial.set("limit", exp.Limit(expression=exp.Literal.number(total)))
+            final.set("offset", offset.copy())
+        if limit is not None:
+            final.set("limit", limit.copy())
+        return _Plan(table, partial.sql(DIALECT), final.sql(DIALECT), partials)
+
+    def _plan_gather(
+        self, select: exp.Select, table: PartitionedTable, refs, partials: str
+    ):
+        partial = exp.select("*").from_(exp.to_table(table.name))
+        where = select.args.get("where")
+        source = select.args.get("from_")
+        # The WHERE only filters the table's rows directly when it is all there is to
+        # select from, rather than sitting behind a CTE, derived table or join
+        direct = (
+            len(refs) == 1
+            and source is not None
+            and refs[0] is source.this
+            and not select.args.get("joins")
+            and not select.args.get("with")
+        )
+        if direct and where is not None:
+            if not where.find(exp.Subquery, exp.Select):
+                alias = refs[0].alias_or_name
+                cond = where.this.copy()
+                if alias != refs[0].name:
+                    for col in cond.find_all(exp.Column):
+                        if col.table == alias:
+                            col.set("table", None)
+                partial.set("where", exp.Where(this=cond))
+
+        final = select.copy()
+        for t in final.find_all(exp.Table):
+            if t.name.lower() == table.name.lower():
+                t.set("this", exp.to_identifier(partials))
+                t.set("db", None)
+                t.set("catalog", None)
+                if not t.alias:
+                    t.set("alias", exp.TableAlias(this=exp.to_identifier(table.name)))
+        return _Plan(table, partial.sql(DIALECT), final.sql(DIALECT), partials)
+
+    def _run_partial(self, partition: Partition, sql: str) -> pa.Table:
+        cursor = partition.db.cursor()
+        try:
+            cursor.execute(sql)
+            return cursor.fetch_record_batch().read_all()
+        finally:
+            cursor.close()
+
+    def scatter(self, plan: _Plan) -> pa.Table:
+        try:
+            where = sqlglot.parse_one(plan.partial, read=DIALECT).args.get("where")
+            low, high = _bounds(where, plan.table)
+            partitions = [p for p in plan.table.partitions if p.overlaps(low, high)]
+        except Exception:
+            # Scanning everything is slower, but still right
+            logger.exception("Error pruning the partitions of %s", plan.table.name)
+            partitions = plan.table.partitions
+        with self.lock:
+            self.scatters += 1
+            self.partitions_scanned += len(partitions)
+            self.partitions_pruned += len(plan.table.partitions) - len(partitions)
+        if not partitions:
+            # Nothing matches, but the result still needs the partial query's schema
+            partitions = plan.table.partitions[:1]
+            sql = f"SELECT * FROM ({plan.partial}) WHERE false"
+        else:
+            sql = plan.partial
+        futures = [self.pool.submit(self._run_partial, p, sql) for p in partitions]
+        tables = [f.result() for f in futures]
+        return pa.concat_tables(tables, promote_options="permissive")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "scatters": self.scatters,
+                "partitions_scanned": self.partitions_scanned,
+                "partitions_pruned": self.partitions_pruned,
+            }
@@ -1,5 +1,6 @@
 import io
 import re
+import time
 from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import pandas as pd
@@ -33,11 +34,13 @@ class PGQueryResult(QueryResult):
         fields: List[Tuple[str, BVType]],
         rows: List[List[Optional[Any]]],
         status: Optional[str] = None,
+        profile: Optional[Dict[str, Any]] = None,
     ):
         super().__init__()
         self.fields = fields
         self._iter = iter(rows)
         self._status = status
+        self._profile = profile or {}
 
     def has_results(self) -> bool:
         return bool(self.fields)
@@ -54,6 +57,9 @@ class PGQueryResult(QueryResult):
     def status(self):
         return self._status
 
+    def profile(self) -> Dict[str, Any]:
+        return self._profile
+
 
 class PGSession(Session):
     def __init__(self, parent, conn):
@@ -70,19 +76,25 @@ class PGSession(Session):
     def cursor(self):
         return self._cursor
 
+    def cancel(self):
+        self.conn.cancel()
+
     def execute_sql(self, sql: str, params=None) -> QueryResult:
+        start = time.perf_counter()
         if params:
             sql = re.sub(r"\$\d+", r"%s", sql)
             self._cursor.execute(sql, params)
         else:
             self._cursor.execute(sql)
         status = self._cursor.statusmessage
+        rows = self._cursor.fetchall() if self._cursor.description else []
+        # The server doesn't report its CPU time, but this covers the round trip
+        profile = {"wall_time_ms": (time.perf_counter() - start) * 1000}
         if self._cursor.description:
-            rows = self._cursor.fetchall()
-            res = self.to_query_result(self._cursor.description, rows, status)
-        else:
-            res = PGQueryResult([], [], status=status)
-        return res
+            return self.to_query_result(
+                self._cursor.description, rows, status, profile
+            )
+        return PGQueryResult([], [], status=status, profile=profile)
 
     def in_transaction(self) -> bool:
         return self.conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
@@ -96,13 +108,15 @@ class PGSession(Session):
         out.seek(0)
         return pd.read_csv(out)
 
-    def to_query_result(self, description, rows, status) -> QueryResult:
+    def to_query_result(
+        self, description, rows, status, profile: Optional[Dict[str, Any]] = None
+    ) -> QueryResult:
         fields = []
         for d in description:
             name, oid = d[0], d[1]
             f = (name, OID_TO_BVTYPE.get(oid, BVType.UNKNOWN))
             fields.append(f)
-        return PGQueryResult(fields, rows, status)
+        return PGQueryResult(fields, rows, status, profile)
 
 
 class PGConnection(Connection):
@@ -0,0 +1,205 @@
+import functools
+import logging
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import sqlglot
+from sqlglot import exp
+
+from buenavista.core import BVType, Connection, QueryResult, Session
+
+logger = logging.getLogger(__name__)
+
+READ, WRITE, TRANSACTION, SESSION = "read", "write", "transaction", "session"
+
+_TRANSACTION = re.compile(
+    r"^\s*(BEGIN|START\s+TRANSACTION|COMMIT|END|ROLLBACK|ABORT|SAVEPOINT|RELEASE)\b",
+    re.I,
+)
+_SESSION = re.compile(r"^\s*(SET|RESET|USE)\b", re.I)
+_EXPLAIN = re.compile(r"^\s*EXPLAIN\b(?!\s+ANALYZE)", re.I)
+
+_READS = (exp.Select, exp.SetOperation, exp.Values, exp.Show, exp.Describe)
+_WRITES = (exp.Insert, exp.Update, exp.Delete, exp.Merge, exp.Into)
+# Functions that change the database even when called from a SELECT
+_WRITE_FUNCTIONS = {"nextval", "setval"}
+
+
+def _is_read(statement: exp.Expression) -> bool:
+    if isinstance(statement, exp.Command):
+        rest = statement.expression.name if statement.expression else ""
+        return bool(_EXPLAIN.match(f"{statement.this} {rest}"))
+    if not isinstance(statement, _READS) or statement.find(*_WRITES):
+        return False
+    for func in statement.find_all(exp.Anonymous):
+        if str(func.this).lower() in _WRITE_FUNCTIONS:
+            return False
+    return True
+
+
+@functools.lru_cache(maxsize=4096)
+def classify(sql: str, dialect: Optional[str] = None) -> str:
+    """Classifies a statement as a READ, WRITE, TRANSACTION control or SESSION setting.
+
+    Anything we can't parse, or can't be sure leaves the database unchanged, is a WRITE.
+    """
+    if _TRANSACTION.match(sql):
+        return TRANSACTION
+    if _SESSION.match(sql):
+        return SESSION
+    try:
+        statements = [s for s in sqlglot.parse(sql, read=dialect) if s is not None]
+    except Exception:
+        return WRITE
+    if not statements:
+        return WRITE
+    control = (exp.Transaction, exp.Commit, exp.Rollback)
+    if any(isinstance(s, control) for s in statements):
+        return TRANSACTION
+    return READ if all(_is_read(s) for s in statements) else WRITE
+
+
+class RoutingSession(Session):
+    """A session on the primary that sends reads outside of transactions to a replica.
+
+    Replica sessions are opened the first time a read is routed to each replica, and
+    the session settings (SET/USE) sent so far are replayed on them.
+    """
+
+    def __init__(self, parent: "RoutingConnection", primary: Session):
+        super().__init__()
+        self.parent = parent
+        self.primary = primary
+        self.replicas: Dict[int, Session] = {}
+        self.settings: List[Tuple[str, Any]] = []
+        self._current: Optional[Session] = None
+        # The replica whose load this session's last statement counts toward
+        self._loaded: Optional[int] = None
+
+    def cursor(self):
+        return self.primary.cursor()
+
+    def close(self):
+        self._unload()
+        for index, sess in self.replicas.items():
+            try:
+                self.parent.replicas[index].close_session(sess)
+            except Exception:
+                logger.exception("Error closing replica %d session", index)
+        self.replicas.clear()
+        self.parent.primary.close_session(self.primary)
+
+    def cancel(self):
+        if self._current is not None:
+            self._current.cancel()
+
+    def in_transaction(self) -> bool:
+        return self.primary.in_transaction()
+
+    def load_df_function(self, table: str):
+        return self.primary.load_df_function(table)
+
+    def _unload(self):
+        if self._loaded is not None:
+            self.parent.release(self._loaded)
+            self._loaded = None
+
+    def _replica(self, index: int) -> Session:
+        sess = self.replicas.get(index)
+        if sess is None:
+            sess = self.parent.replicas[index].create_session()
+            for sql, params in self.settings:
+                sess.execute_sql(sql, params)
+            self.replicas[index] = sess
+        return sess
+
+    def execute_sql(self, sql: str, params=None) -> QueryResult:
+        # Whatever this session ran last has been read by now
+        self._unload()
+        kind = classify(sql, self.parent.dialect)
+        if kind == SESSION:
+            qr = self.primary.execute_sql(sql, params)
+            self.settings.append((sql, params))
+            for sess in self.replicas.values():
+                sess.execute_sql(sql, params)
+            return qr
+        if kind == READ and self.parent.replicas and not self.in_transaction():
+            index = self.parent.acquire()
+            self._loaded = index
+            self._current = self._replica(index)
+        else:
+            self.parent.count(kind)
+            self._current = self.primary
+        return self._current.execute_sql(sql, params)
+
+
+class RoutingConnection(Connection):
+    """Sends writes and transactions to a primary connection and reads to replicas.
+
+    Each read outside of a transaction goes to the replica with the fewest statements
+    in flight, e.g. a DuckDB file opened with `read_only=True` or a psycopg pool on a
+    streaming replica. `dialect` is the SQL dialect statements reach the backends in,
+    for sqlglot to classify them.
+    """
+
+    def __init__(
+        self,
+        primary: Connection,
+        replicas: List[Connection],
+        dialect: Optional[str] = None,
+    ):
+        super().__init__()
+        self.primary = primary
+        self.replicas = replicas
+        self.dialect = dialect
+        self.lock = threading.Lock()
+        self.load = [0] * len(replicas)
+        self.routed = {"primary": 0, "replicas": [0] * len(replicas)}
+        self.kinds = {READ: 0, WRITE: 0, TRANSACTION: 0}
+
+    def new_session(self) -> Session:
+        return RoutingSession(self, self.primary.create_session())
+
+    def acquire(self) -> int:
+        with self.lock:
+            # Ties go to the replica that has been sent the fewest reads
+            index = min(
+                range(len(self.replicas)),
+                key=lambda i: (self.load[i], self.routed["replicas"][i]),
+            )
+            self.load[index] += 1
+            self.routed["replicas"][index] += 1
+            self.kinds[READ] += 1
+            return index
+
+    def release(self, index: int):
+        with self.lock:
+            self.load[index] -= 1
+
+    def count(self, kind: str):
+        with self.lock:
+            self.routed["primary"] += 1
+            self.kinds[kind] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "primary": self.routed["primary"],
+                "replicas": list(self.routed["replicas"]),
+                "in_flight": list(self.load),
+                "statements": dict(self.kinds),
+            }
+
+    def register_relation(
+        self,
+        name: str,
+        columns: List[Tuple[str, BVType]],
+        rows: Callable[[], List[Dict[str, Any]]],
+    ):
+        super().register_relation(name, columns, rows)
+        for conn in [self.primary] + self.replicas:
+            conn.register_relation(name, columns, rows)
+
+    def parameters(self) -> Dict[str, str]:
+        return self.primary.parameters()
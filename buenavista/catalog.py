@@ -0,0 +1,204 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from .core import BVType, QueryResult
+
+# The catalog queries clients like DBeaver, psql, JDBC drivers and Metabase send
+INTROSPECTION_PATTERNS = (
+    r"\bpg_catalog\s*\.",
+    r"\binformation_schema\s*\.",
+    r"\bpg_(type|class|namespace|attribute|attrdef|index|proc|database|settings)\b",
+    r"\bpg_(constraint|description|am|extension|inherits|enum|range|tables)\b",
+)
+
+# Catalog queries whose answers depend on the session or the moment they are asked
+VOLATILE_PATTERNS = (
+    r"\bpg_stat_\w+",
+    r"\bcurrent_\w+",
+    r"\bsession_user\b",
+    r"\bnow\s*\(",
+    r"\bversion\s*\(",
+    r"\bpg_backend_pid\b",
+    r"\btxid_\w+",
+    r"\bnextval\b",
+)
+
+# Statements that may change what the catalog queries return
+DDL_PATTERNS = (
+    r"\b(CREATE|DROP|ALTER|ATTACH|DETACH|IMPORT|INSTALL|LOAD)\b",
+    r"\bCOMMENT\s+ON\b",
+)
+
+# Statements after which a session's view of the catalog isn't the shared one
+PERSONAL_PATTERNS = (
+    r"^\s*USE\b",
+    r"^\s*SET\s+(SESSION\s+)?(search_path|schema)\b",
+    r"^\s*CREATE\s+(OR\s+REPLACE\s+)?(LOCAL\s+|GLOBAL\s+)?TEMP(ORARY)?\b",
+)
+
+_QUERY = re.compile(r"^\s*\(?\s*(SELECT|WITH)\b", re.I)
+
+
+def _combine(patterns: Sequence[str]) -> "re.Pattern":
+    return re.compile("|".join(f"(?:{p})" for p in patterns), re.I)
+
+
+class CachedResult(QueryResult):
+    """A replay of a captured query result, held as an Arrow table."""
+
+    def __init__(self, columns: List[Tuple[str, BVType]], table, status: str):
+        super().__init__()
+        self.columns = columns
+        self.table = table
+        self._status = status
+
+    def has_results(self) -> bool:
+        return True
+
+    def column_count(self):
+        return len(self.columns)
+
+    def column(self, index: int) -> Tuple[str, BVType]:
+        return self.columns[index]
+
+    def rows(self) -> Iterator[List]:
+        for batch in self.table.to_batches():
+            columns = [c.to_pylist() for c in batch.columns]
+            for i in range(batch.num_rows):
+                yield [c[i] for c in columns]
+
+    def record_batches(self):
+        return iter(self.table.to_batches())
+
+    def status(self) -> str:
+        return self._status
+
+    def memory_usage(self) -> int:
+        return self.table.nbytes
+
+
+class CatalogCache:
+    """Answers repeated client introspection queries from results captured earlier.
+
+    A SELECT that matches one of the introspection patterns, and none of the volatile
+    ones, is run for real the first time it is seen for a user and database; its
+    result is stored as Arrow and replayed for the same SQL and parameters after that.
+    Any statement that looks like DDL clears the cache, as does the end of a
+    transaction that ran some, and entries expire after `ttl` seconds to bound how
+    stale DDL run elsewhere, e.g. by another worker process, can leave them.
+
+    Sessions with uncommitted DDL, or that have changed their search path or created
+    temporary objects, bypass it, and results read inside a transaction aren't kept.
+    Register more patterns with `register` and `exclude`. Requires pyarrow.
+    """
+
+    def __init__(
+        self,
+        ttl: Optional[float] = 300.0,
+        max_entries: int = 1024,
+        max_result_bytes: int = 1 << 20,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_result_bytes = max_result_bytes
+        self.patterns = list(INTROSPECTION_PATTERNS)
+        self.volatile = list(VOLATILE_PATTERNS)
+        self._include = _combine(self.patterns)
+        self._exclude = _combine(self.volatile)
+        self._ddl = _combine(DDL_PATTERNS)
+        self._personal = _combine(PERSONAL_PATTERNS)
+        self.entries: "OrderedDict[tuple, Tuple[float, CachedResult]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def register(self, pattern: str):
+        """Caches the results of queries that match the regex `pattern`."""
+        self.patterns.append(pattern)
+        self._include = _combine(self.patterns)
+
+    def exclude(self, pattern: str):
+        """Never caches queries that match the regex `pattern`."""
+        self.volatile.append(pattern)
+        self._exclude = _combine(self.volatile)
+
+    def cacheable(self, sql: str) -> bool:
+        return (
+            _QUERY.match(sql) is not None
+            and self._include.search(sql) is not None
+            and self._exclude.search(sql) is None
+            and self._ddl.search(sql) is None
+        )
+
+    def changes_catalog(self, sql: str) -> bool:
+        return self._ddl.search(sql) is not None
+
+    def personalizes(self, sql: str) -> bool:
+        return self._personal.match(sql) is not None
+
+    def key(self, sql: str, params, user: Optional[str], database: Optional[str]):
+        try:
+            return (user, database, sql, tuple(params) if params else ())
+        except TypeError:
+            return None
+
+    def get(self, key: tuple) -> Optional[CachedResult]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (
+                self.ttl is None or time.monotonic() - entry[0] < self.ttl
+            ):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                cached = entry[1]
+                return CachedResult(cached.columns, cached.table, cached.status())
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, qr: QueryResult, generation: int) -> QueryResult:
+        """Captures `qr`, returning a result to send in its place.
+
+        Nothing is stored if the catalog may have changed since `generation` was read,
+        before the query ran, or if the result is too big to keep around.
+        """
+        if not qr.has_results():
+            return qr
+        import pyarrow as pa
+
+        from .arrow import record_batches
+
+        columns = [qr.column(i) for i in range(qr.column_count())]
+        schema, batches = record_batches(qr)
+        table = pa.Table.from_batches(list(batches), schema=schema)
+        result = CachedResult(columns, table, qr.status())
+        if table.nbytes > self.max_result_bytes:
+            return result
+        with self.lock:
+            if generation == self.generation:
+                self.entries[key] = (time.monotonic(), result)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return CachedResult(columns, table, result.status())
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.invalidations += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
@@ -2,7 +2,7 @@ import enum
 import json
 import re
 import uuid
-from typing import Any, Dict, Iterator, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 
 class BVType(enum.Enum):
@@ -43,9 +43,28 @@ class QueryResult:
     def rows(self) -> Iterator[List]:
         raise NotImplementedError
 
+    def record_batches(self) -> Optional[Iterator[Any]]:
+        """The unread rows as Arrow RecordBatches, for results that hold them columnar.
+
+        Returns None if the result can only be read a row at a time via `rows()`.
+        """
+        return None
+
     def status(self) -> str:
         raise NotImplementedError
 
+    def memory_usage(self) -> int:
+        """An estimate of the bytes this result is holding in memory, if known."""
+        return 0
+
+    def profile(self) -> Dict[str, Any]:
+        """Execution statistics the backend recorded for this query, once it has finished.
+
+        Backends report whichever of rows_scanned, bytes_scanned, cpu_time_ms,
+        wall_time_ms and peak_memory_bytes they can measure.
+        """
+        return {}
+
 
 class Session:
     def __init__(self):
@@ -60,6 +79,10 @@ class Session:
     def execute_sql(self, sql: str, params=None) -> QueryResult:
         raise NotImplementedError
 
+    def cancel(self):
+        """Interrupts the statement this session is running, from another thread."""
+        raise NotImplementedError
+
     def in_transaction(self) -> bool:
         raise NotImplementedError
 
@@ -70,10 +93,19 @@ class Session:
 class Connection:
     """Translation layer from an upstream data source into the BV representation of a query result."""
 
+    # Whether create_session's `database` chooses between several databases
+    multi_database = False
+
     def __init__(self):
         self._sessions = {}
+        self.relations = {}
+
+    def create_session(self, database: Optional[str] = None) -> Session:
+        """Opens a session, on `database` for backends that serve more than one.
 
-    def create_session(self) -> Session:
+        `database` is the database the client asked for, e.g. in the Postgres startup
+        parameters or the Trino catalog header; single-database backends ignore it.
+        """
         sess = self.new_session()
         self._sessions[sess.id] = sess
         return sess
@@ -89,6 +121,19 @@ class Connection:
     def new_session(self) -> Session:
         raise NotImplementedError
 
+    def register_relation(
+        self,
+        name: str,
+        columns: List[Tuple[str, BVType]],
+        rows: Callable[[], List[Dict[str, Any]]],
+    ):
+        """Exposes rows computed in Python as a table that queries can reference by name.
+
+        Backends that support this evaluate `rows` each time a query mentions the table,
+        so the data never has to be rendered into the SQL text itself.
+        """
+        self.relations[name] = (columns, rows)
+
     def parameters(self) -> Dict[str, str]:
         return {}
 
@@ -4,8 +4,8 @@ import re
 import duckdb
 from fastapi import FastAPI
 
-from .. import bv_dialects, rewrite
-from ..backends.duckdb import DuckDBConnection
+from .. import bv_dialects, rewrite, workers
+from ..backends.duckdb import DuckDBConnection, DuckDBManager
 from ..http import main
 
 #### Rewriter setup/config
@@ -29,6 +29,11 @@ class DuckDBHTTPRewriter(rewrite.Rewriter):
 rewriter = DuckDBHTTPRewriter(bv_dialects.BVTrino(), bv_dialects.BVDuckDB())
 
 
+@rewriter.relation("bv_catalog.stat_statements")
+def stat_statements():
+    return "SELECT * FROM bv_stat_statements"
+
+
 @rewriter.relation("system.jdbc.tables")
 def jdbc_tables():
     return """
@@ -138,9 +143,54 @@ def jdbc_procedure_columns():
     """
 
 
+def serve_worker(worker, host: str, port: int, duckdb_file: str):
+    """Runs one worker of a multi-process server, with its own read-only DuckDB handle."""
+    import uvicorn
+
+    db = duckdb.connect(duckdb_file, read_only=True)
+    app = FastAPI()
+    main.quacko(app, DuckDBConnection(db, profiling=True), rewriter, worker=worker)
+    sockets = [
+        workers.reuseport_socket(host, port),
+        workers.reuseport_socket(host, worker.private_port),
+    ]
+    uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=sockets)
+
+
 if __name__ == "__main__":
     import uvicorn
 
+    bv_host = "127.0.0.1"
+    bv_port = 8080
+    if "BUENAVISTA_HOST" in os.environ:
+        bv_host = os.environ["BUENAVISTA_HOST"]
+    if "BUENAVISTA_PORT" in os.environ:
+        bv_port = int(os.environ["BUENAVISTA_PORT"])
+
+    num_workers = int(os.getenv("BUENAVISTA_WORKERS", "1"))
+    if num_workers > 1:
+        # Each worker opens the file itself, since DuckDB handles don't survive a fork
+        if not os.getenv("DUCKDB_FILE"):
+            raise SystemExit("BUENAVISTA_WORKERS needs a DUCKDB_FILE to share")
+        print(f"Serving {os.getenv('DUCKDB_FILE')} read-only from {num_workers} workers")
+        private_port_base = int(os.getenv("BUENAVISTA_PRIVATE_PORT", bv_port + 1))
+        workers.supervise(
+            num_workers,
+            lambda w: serve_worker(w, bv_host, bv_port, os.getenv("DUCKDB_FILE")),
+            bv_host,
+            private_port_base,
+        )
+        raise SystemExit(0)
+
+    if os.getenv("DUCKDB_DIR"):
+        # One database per tenant, chosen by the X-Trino-Catalog header
+        print("Serving the DuckDB databases in " + os.getenv("DUCKDB_DIR"))
+        app = FastAPI()
+        manager = DuckDBManager(os.getenv("DUCKDB_DIR"), profiling=True)
+        main.quacko(app, manager, rewriter)
+        uvicorn.run(app, host=bv_host, port=bv_port, log_level="info")
+        raise SystemExit(0)
+
     # Setup DuckDB file and FastAPI app with Presto API
     if os.getenv("DUCKDB_FILE"):
         print("Loading DuckDB db: " + os.getenv("DUCKDB_FILE"))
@@ -149,13 +199,6 @@ if __name__ == "__main__":
         print("Using in-memory DuckDB")
         db = duckdb.connect()
 
-    bv_host = "127.0.0.1"
-    bv_port = 8080
-    if "BUENAVISTA_HOST" in os.environ:
-        bv_host = os.environ["BUENAVISTA_HOST"]
-    if "BUENAVISTA_PORT" in os.environ:
-        bv_port = int(os.environ["BUENAVISTA_PORT"])
-
     app = FastAPI()
-    main.quacko(app, DuckDBConnection(db), rewriter)
+    main.quacko(app, DuckDBConnection(db, profiling=True), rewriter)
     uvicorn.run(app, host=bv_host, port=bv_port, log_level="info")
@@ -1,14 +1,28 @@
 import os
 import sys
-from typing import Tuple
+from typing import Optional, Tuple
 
 import duckdb
 
-from ..backends.duckdb import DuckDBConnection
-from .. import bv_dialects, postgres, rewrite
+from ..backends.duckdb import DuckDBConnection, DuckDBManager
+from .. import bv_dialects, catalog, postgres, rewrite, workers
 
 
 class DuckDBPostgresRewriter(rewrite.Rewriter):
+    # DuckDB runs most Postgres SQL as-is; these are what sqlglot translates for it
+    TRIGGERS = (
+        r"~",
+        r"->",
+        r"\$\$",
+        r"\bto_char\b",
+        r"\bgenerate_series\b",
+        r"\bjson_\w+",
+        r"\bposition\b",
+        r"\binterval\b",
+        r"\bfor\s+(update|share)\b",
+        r"\b(show|prepare)\b",
+    )
+
     def rewrite(self, sql: str) -> str:
         if sql.lower() == "select pg_catalog.version()":
             return "SELECT 'PostgreSQL 9.3' as version"
@@ -19,23 +33,45 @@ class DuckDBPostgresRewriter(rewrite.Rewriter):
 rewriter = DuckDBPostgresRewriter(bv_dialects.BVPostgres(), bv_dialects.BVDuckDB())
 
 
+@rewriter.relation("bv_catalog.stat_activity")
+def stat_activity():
+    return "SELECT * FROM bv_stat_activity"
+
+
+@rewriter.relation("bv_catalog.stat_statements")
+def stat_statements():
+    return "SELECT * FROM bv_stat_statements"
+
+
 def create(
-    db: duckdb.DuckDBPyConnection, host_addr: Tuple[str, int], auth: dict = None
+    db: duckdb.DuckDBPyConnection,
+    host_addr: Tuple[str, int],
+    auth: dict = None,
+    worker: Optional[workers.Worker] = None,
 ) -> postgres.BuenaVistaServer:
     server = postgres.BuenaVistaServer(
-        host_addr, DuckDBConnection(db), rewriter=rewriter, auth=auth
+        host_addr,
+        DuckDBConnection(db),
+        rewriter=rewriter,
+        auth=auth,
+        worker=worker,
+        catalog_cache=catalog.CatalogCache(),
     )
     return server
 
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Using in-memory DuckDB database")
-        db = duckdb.connect()
-    else:
-        print("Using DuckDB database at %s" % sys.argv[1])
-        db = duckdb.connect(sys.argv[1])
+def serve_worker(worker: workers.Worker, address: Tuple[str, int], duckdb_file: str):
+    """Runs one worker of a multi-process server, with its own read-only DuckDB handle."""
+    db = duckdb.connect(duckdb_file, read_only=True)
+    server = create(db, address, worker=worker)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        db.close()
 
+
+if __name__ == "__main__":
     bv_host = "0.0.0.0"
     bv_port = 5433
 
@@ -46,6 +82,39 @@ if __name__ == "__main__":
         bv_port = int(os.environ["BUENAVISTA_PORT"])
 
     address = (bv_host, bv_port)
+    num_workers = int(os.getenv("BUENAVISTA_WORKERS", "1"))
+    if num_workers > 1:
+        # Each worker opens the file itself, since DuckDB handles don't survive a fork
+        if len(sys.argv) < 2:
+            raise SystemExit("BUENAVISTA_WORKERS needs a DuckDB file to share")
+        print(f"Serving {sys.argv[1]} read-only from {num_workers} workers")
+        print(f"Listening on {bv_host}:{bv_port}")
+        private_port_base = int(os.getenv("BUENAVISTA_PRIVATE_PORT", bv_port + 1))
+        workers.supervise(
+            num_workers,
+            lambda w: serve_worker(w, address, sys.argv[1]),
+            bv_host,
+            private_port_base,
+        )
+        sys.exit(0)
+
+    if len(sys.argv) > 1 and os.path.isdir(sys.argv[1]):
+        # One database per tenant, chosen by the database the client connects to
+        print("Serving the DuckDB databases in %s" % sys.argv[1])
+        server = postgres.BuenaVistaServer(
+            address, DuckDBManager(sys.argv[1]), rewriter=rewriter
+        )
+        print(f"Listening on {bv_host}:{bv_port}")
+        server.serve_forever()
+        sys.exit(0)
+
+    if len(sys.argv) < 2:
+        print("Using in-memory DuckDB database")
+        db = duckdb.connect()
+    else:
+        print("Using DuckDB database at %s" % sys.argv[1])
+        db = duckdb.connect(sys.argv[1])
+
     server = create(db, address)
     ip, port = server.server_address
     print(f"Listening on {ip}:{port}")
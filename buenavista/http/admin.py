@@ -0,0 +1,15 @@
+from fastapi import FastAPI
+
+from ..postgres import BuenaVistaServer
+
+
+def admin(app: FastAPI, server: BuenaVistaServer):
+    """Adds JSON endpoints for inspecting a running Postgres proxy server."""
+
+    @app.get("/v1/bv/postgres/stat_activity")
+    async def stat_activity():
+        return server.stat_activity()
+
+    @app.get("/v1/bv/postgres/stat_statements")
+    async def stat_statements():
+        return server.statements.snapshot()
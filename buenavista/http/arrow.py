@@ -0,0 +1,122 @@
+from json.encoder import encode_basestring
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from ..core import BVType
+from . import type_mapping
+
+# JSON strings need these escaped; anything else below 0x20 is rare enough that we
+# hand the column to the per-value encoder instead
+_ESCAPES = [("\\", "\\\\"), ('"', '\\"'), ("\n", "\\n"), ("\r", "\\r"), ("\t", "\\t")]
+_NEEDS_ESCAPE = r'[\x00-\x1f"\\]'
+_CONTROL = r"[\x00-\x1f]"
+
+
+def _quote(arr: pa.Array) -> pa.Array:
+    arr = arr.cast(pa.string())
+    if pc.any(pc.match_substring_regex(arr, _NEEDS_ESCAPE)).as_py():
+        for target, replacement in _ESCAPES:
+            arr = pc.replace_substring(arr, target, replacement)
+        if pc.any(pc.match_substring_regex(arr, _CONTROL)).as_py():
+            return None
+    return pc.binary_join_element_wise('"', arr, '"', "")
+
+
+def _fallback(bvtype: BVType) -> Callable[[pa.Array], pa.Array]:
+    encode = type_mapping.json_encoder(bvtype)
+    return lambda arr: pa.array([encode(v) for v in arr.to_pylist()], pa.string())
+
+
+def _encode_column(arr: pa.Array, bvtype: BVType) -> pa.Array:
+    """Renders every value of a column as a JSON fragment, or "null"."""
+    t = arr.type
+    ret = None
+    if pa.types.is_integer(t) or pa.types.is_boolean(t):
+        ret = arr.cast(pa.string())
+    elif pa.types.is_string(t) or pa.types.is_large_string(t):
+        ret = _quote(arr)
+        if ret is None:
+            ret = _fallback(BVType.TEXT)(arr)
+    elif pa.types.is_date(t):
+        # Arrow formats dates the way str() does; floats, decimals, times and
+        # timestamps it formats differently, so those take the per-value encoders
+        ret = pc.binary_join_element_wise('"', arr.cast(pa.string()), '"', "")
+    if ret is None:
+        return _fallback(bvtype)(arr)
+    return pc.fill_null(ret, "null")
+
+
+def encode_batch(rb: pa.RecordBatch, bvtypes: List[BVType]) -> List[str]:
+    """Renders each row of a record batch as a JSON array, a column at a time."""
+    if rb.num_columns == 0:
+        return ["[]"] * rb.num_rows
+    cols = [_encode_column(rb.column(i), bvtypes[i]) for i in range(rb.num_columns)]
+    rows = pc.binary_join_element_wise("[", pc.binary_join_element_wise(*cols, ","), "]", "")
+    return rows.to_pylist()
+
+
+def encode_batches(
+    batches: Iterator[pa.RecordBatch], bvtypes: List[BVType]
+) -> Iterator[str]:
+    for rb in batches:
+        yield from encode_batch(rb, bvtypes)
+
+
+class RowCounter:
+    """Passes record batches through, counting their rows."""
+
+    def __init__(self, batches: Iterator[pa.RecordBatch]):
+        self.batches = batches
+        self.rows = 0
+
+    def __iter__(self):
+        for rb in self.batches:
+            self.rows += rb.num_rows
+            yield rb
+
+
+class _Sink:
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        ret = b"".join(self.chunks)
+        self.chunks.clear()
+        return ret
+
+
+def ipc_stream(
+    schema: pa.Schema,
+    batches: Iterable[pa.RecordBatch],
+    compression: Optional[str] = None,
+    on_close: Optional[Callable[[], None]] = None,
+) -> Iterator[bytes]:
+    """Yields an Arrow IPC stream of the batches, one chunk of bytes per batch.
+
+    `on_close` runs once the stream is exhausted or abandoned.
+    """
+    sink = _Sink()
+    try:
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        with pa.ipc.new_stream(sink, schema, options=options) as writer:
+            yield sink.take()
+            for rb in batches:
+                writer.write_batch(rb)
+                yield sink.take()
+        yield sink.take()
+    finally:
+        if on_close:
+            on_close()
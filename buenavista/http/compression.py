@@ -0,0 +1,181 @@
+import zlib
+from typing import Dict, List, Optional, Sequence
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is only offered to clients when the zstandard package is installed
+    zstandard = None
+
+COMPRESSIBLE_TYPES = ("application/json",)
+
+# Chunks at least this big are compressed on a worker thread, off the event loop
+_OFFLOAD_BYTES = 64 << 10
+
+
+class _Gzip:
+    def __init__(self, level: int):
+        # wbits=31 writes a gzip header and trailer instead of a zlib one
+        self.c = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        mode = zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH
+        return self.c.compress(data) + self.c.flush(mode)
+
+
+class _Zstd:
+    def __init__(self, level: int):
+        self.c = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        mode = zstandard.COMPRESSOBJ_FLUSH_FINISH
+        if not final:
+            mode = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self.c.compress(data) + self.c.flush(mode)
+
+
+def available_encodings() -> List[str]:
+    """The content codings we can produce, most preferred first."""
+    return ["zstd", "gzip"] if zstandard is not None else ["gzip"]
+
+
+def negotiate(accept_encoding: Optional[str], encodings: Sequence[str]) -> Optional[str]:
+    """Picks the coding to use for an Accept-Encoding header, or None for identity.
+
+    Ties between codings the client weights equally go to the order of `encodings`.
+    """
+    if not accept_encoding:
+        return None
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[coding.strip().lower()] = q
+    best, best_q = None, 0.0
+    for coding in encodings:
+        q = weights.get(coding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+class CompressionMiddleware:
+    """Compresses response bodies with gzip or zstd, as negotiated via Accept-Encoding.
+
+    Only bodies of the `media_types` are compressed, and only once they reach
+    `minimum_size` bytes, so small responses go out as they are. Streaming bodies are
+    compressed a chunk at a time, with each chunk flushed to the client as it is sent.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 16 << 10,
+        gzip_level: int = 1,
+        zstd_level: int = 3,
+        media_types: Sequence[str] = COMPRESSIBLE_TYPES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": gzip_level, "zstd": zstd_level}
+        self.media_types = tuple(media_types)
+        self.encodings = available_encodings()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        coding = negotiate(
+            Headers(scope=scope).get("accept-encoding"), self.encodings
+        )
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _Responder(self, coding, send)
+        await self.app(scope, receive, responder.send)
+
+    def compressor(self, coding: str):
+        if coding == "zstd":
+            return _Zstd(self.levels["zstd"])
+        return _Gzip(self.levels["gzip"])
+
+
+class _Responder:
+    def __init__(self, middleware: CompressionMiddleware, coding: str, send: Send):
+        self.middleware = middleware
+        self.coding = coding
+        self.send_ = send
+        self.start: Optional[Message] = None
+        self.pending: List[bytes] = []
+        self.pending_size = 0
+        # None until we know whether this response is compressed
+        self.compressor = None
+        self.passthrough = False
+
+    async def send(self, message: Message):
+        if message["type"] == "http.response.start":
+            self.start = message
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "").split(";")[0].strip()
+            self.passthrough = (
+                message["status"] not in (200, 201)
+                or "content-encoding" in headers
+                or media_type not in self.middleware.media_types
+            )
+            if self.passthrough:
+                await self.send_(message)
+            return
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send_(message)
+            return
+
+        body, more = message.get("body", b""), message.get("more_body", False)
+        if self.compressor is not None:
+            await self._send_compressed(body, more)
+            return
+        self.pending.append(body)
+        self.pending_size += len(body)
+        if not more and self.pending_size < self.middleware.minimum_size:
+            # Too small to be worth it
+            await self.send_(self.start)
+            await self.send_(
+                {"type": "http.response.body", "body": b"".join(self.pending)}
+            )
+        elif not more or self.pending_size >= self.middleware.minimum_size:
+            self.compressor = self.middleware.compressor(self.coding)
+            headers = MutableHeaders(raw=list(self.start["headers"]))
+            self.start["headers"] = headers.raw
+            headers["Content-Encoding"] = self.coding
+            headers.add_vary_header("Accept-Encoding")
+            data = b"".join(self.pending)
+            self.pending = []
+            if more:
+                del headers["Content-Length"]
+                await self.send_(self.start)
+                await self._send_compressed(data, more)
+            else:
+                compressed = await self._compress(data, final=True)
+                headers["Content-Length"] = str(len(compressed))
+                await self.send_(self.start)
+                await self.send_({"type": "http.response.body", "body": compressed})
+
+    async def _compress(self, data: bytes, final: bool) -> bytes:
+        if len(data) >= _OFFLOAD_BYTES:
+            return await anyio.to_thread.run_sync(self.compressor.compress, data, final)
+        return self.compressor.compress(data, final)
+
+    async def _send_compressed(self, data: bytes, more: bool):
+        compressed = await self._compress(data, final=not more)
+        await self.send_(
+            {"type": "http.response.body", "body": compressed, "more_body": more}
+        )
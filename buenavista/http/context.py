@@ -1,13 +1,18 @@
 import logging
-import queue
+import re
+import threading
+import time
 import uuid
-from collections import defaultdict
-from typing import Any, Dict, Optional
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
 
 from fastapi import Request
 
+from . import prepared
 from ..core import Connection, Session, QueryResult
 
+_USE = re.compile(r"\s*USE\s", re.I)
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,6 +27,12 @@ class Headers:
             f"x-trino-{name}", self.read.get(f"x-presto-{name}", default)
         )
 
+    def get_all(self, name: str) -> List[str]:
+        name = name.lower()
+        return self.read.getlist(f"x-trino-{name}") or self.read.getlist(
+            f"x-presto-{name}"
+        )
+
     def set(self, name: str, value: Any):
         name = name.lower()
         self.write[f"x-trino-{name}"] = value
@@ -33,42 +44,256 @@ class Headers:
         del self.write[f"x-presto-{name}"]
 
 
+class PoolExhausted(Exception):
+    pass
+
+
 class SessionPool:
+    """The sessions belonging to one user: idle ones, and ones parked in a transaction."""
+
     def __init__(self):
-        self.pool = queue.SimpleQueue()
-        self.txns = {}
+        # (session, time it was released) pairs; the most recently used is at the end
+        self.idle: Deque[Tuple[Session, float]] = deque()
+        self.txns: Dict[Any, Tuple[Session, float]] = {}
+        self.in_use = 0
+        self.created = 0
+        self.closed = 0
+        self.waits = 0
+
+    def size(self) -> int:
+        return len(self.idle) + len(self.txns) + self.in_use
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "idle": len(self.idle),
+            "in_use": self.in_use,
+            "transactions": len(self.txns),
+            "created": self.created,
+            "closed": self.closed,
+            "waits": self.waits,
+        }
+
+
+class SessionPools:
+    """Per-user session pools for a connection, with limits and eviction.
+
+    Each user keeps at most `max_per_user` sessions and the server at most `max_total`.
+    When a user is at a limit, `acquire` first closes another user's idle session if
+    that makes room, and otherwise waits up to `acquire_timeout` for a session to be
+    released. Idle sessions beyond `min_per_user` are closed after `idle_timeout`
+    seconds, and transactions nobody has touched in `txn_timeout` seconds are closed
+    (and so rolled back) by a background thread. For connections that serve several
+    databases, idle sessions are only reused for the database they were opened on.
+    """
+
+    def __init__(
+        self,
+        conn: Connection,
+        min_per_user: int = 0,
+        max_per_user: Optional[int] = None,
+        max_total: Optional[int] = None,
+        idle_timeout: float = 600.0,
+        txn_timeout: float = 3600.0,
+        acquire_timeout: float = 30.0,
+    ):
+        self.conn = conn
+        self.min_per_user = min_per_user
+        self.max_per_user = max_per_user
+        self.max_total = max_total
+        self.idle_timeout = idle_timeout
+        self.txn_timeout = txn_timeout
+        self.acquire_timeout = acquire_timeout
+        self.pools: Dict[str, SessionPool] = defaultdict(SessionPool)
+        # The catalog/schema we last switched each session to with USE
+        self.use_targets: Dict[Any, str] = {}
+        # The database each session is on, for connections that serve several
+        self.databases: Dict[Any, Optional[str]] = {}
+        # Marks new transaction ids, e.g. with the worker process that holds them
+        self.tag_txn_id: Optional[Callable[[str], str]] = None
+        self.cond = threading.Condition()
+        self._reaper = threading.Thread(target=self._reap_forever, daemon=True)
+        self._reaper.start()
+
+    def _total(self) -> int:
+        return sum(p.size() for p in self.pools.values())
+
+    def _close(self, pool: SessionPool, sess: Session):
+        pool.closed += 1
+        self.use_targets.pop(sess.id, None)
+        self.databases.pop(sess.id, None)
+        try:
+            self.conn.close_session(sess)
+        except Exception:
+            logger.exception("Error closing session %s", sess.id)
+
+    def _evict_idle(self, pools: List[SessionPool]) -> bool:
+        """Closes the oldest idle session in any of `pools`, if there is one."""
+        oldest = None
+        for pool in pools:
+            if pool.idle and (oldest is None or pool.idle[0][1] < oldest.idle[0][1]):
+                oldest = pool
+        if oldest is None:
+            return False
+        sess, _ = oldest.idle.popleft()
+        self._close(oldest, sess)
+        return True
+
+    def _has_room(self, pool: SessionPool) -> bool:
+        # Any idle sessions left in `pool` are on other databases than the one wanted
+        if self.max_per_user is not None and pool.size() >= self.max_per_user:
+            return self._evict_idle([pool])
+        if self.max_total is not None and self._total() >= self.max_total:
+            return self._evict_idle(list(self.pools.values()))
+        return True
 
-    def acquire(self, conn: Connection, txn_id: Optional[Any] = None) -> Session:
-        if txn_id in self.txns:
-            return self.txns[txn_id]
+    def _pop_idle(
+        self, pool: SessionPool, use_target: Optional[str], database: Optional[str]
+    ) -> Optional[Session]:
+        """Takes the most recently used idle session on `database`, preferring one
+        already on `use_target`."""
+        fallback = None
+        for i in range(len(pool.idle) - 1, -1, -1):
+            sess = pool.idle[i][0]
+            if self.databases.get(sess.id) != database:
+                # Sessions on different databases can't stand in for each other
+                continue
+            if use_target is None or self.use_targets.get(sess.id) == use_target:
+                del pool.idle[i]
+                return sess
+            if fallback is None:
+                fallback = i
+        if fallback is None:
+            return None
+        sess, _ = pool.idle[fallback]
+        del pool.idle[fallback]
+        return sess
+
+    def acquire(
+        self,
+        user: str,
+        txn_id: Optional[Any] = None,
+        use_target: Optional[str] = None,
+        database: Optional[str] = None,
+    ) -> Session:
+        deadline = time.monotonic() + self.acquire_timeout
+        if not self.conn.multi_database:
+            database = None
+        with self.cond:
+            pool = self.pools[user]
+            if txn_id in pool.txns:
+                sess, _ = pool.txns.pop(txn_id)
+                pool.in_use += 1
+                return sess
+            while True:
+                sess = self._pop_idle(pool, use_target, database)
+                if sess is not None:
+                    pool.in_use += 1
+                    return sess
+                if self._has_room(pool):
+                    pool.in_use += 1
+                    pool.created += 1
+                    break
+                pool.waits += 1
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.cond.wait(remaining):
+                    raise PoolExhausted(f"No session available for user {user}")
+        try:
+            sess = self.conn.create_session(database)
+        except Exception:
+            with self.cond:
+                pool.in_use -= 1
+                self.cond.notify_all()
+            raise
+        if database is not None:
+            with self.cond:
+                self.databases[sess.id] = database
+        return sess
+
+    def new_txn_id(self) -> str:
+        txn_id = str(uuid.uuid4())
+        return self.tag_txn_id(txn_id) if self.tag_txn_id else txn_id
+
+    def use_target(self, sess: Session) -> Optional[str]:
+        return self.use_targets.get(sess.id)
+
+    def set_use_target(self, sess: Session, use_target: Optional[str]):
+        if use_target is None:
+            self.use_targets.pop(sess.id, None)
         else:
+            self.use_targets[sess.id] = use_target
+
+    def release(self, user: str, sess: Session, txn_id: Optional[Any] = None):
+        with self.cond:
+            pool = self.pools[user]
+            pool.in_use -= 1
+            if txn_id:
+                pool.txns[txn_id] = (sess, time.monotonic())
+            else:
+                pool.idle.append((sess, time.monotonic()))
+            self.cond.notify_all()
+
+    def discard(self, user: str, sess: Session):
+        """Closes a checked-out session that shouldn't go back to the pool."""
+        with self.cond:
+            pool = self.pools[user]
+            pool.in_use -= 1
+            self._close(pool, sess)
+            self.cond.notify_all()
+
+    def reap(self) -> int:
+        """Closes expired idle sessions and abandoned transactions."""
+        now = time.monotonic()
+        closed = 0
+        with self.cond:
+            for pool in self.pools.values():
+                while (
+                    len(pool.idle) > self.min_per_user
+                    and now - pool.idle[0][1] > self.idle_timeout
+                ):
+                    sess, _ = pool.idle.popleft()
+                    self._close(pool, sess)
+                    closed += 1
+                for txn_id, (sess, last_used) in list(pool.txns.items()):
+                    if now - last_used > self.txn_timeout:
+                        logger.info("Closing abandoned transaction %s", txn_id)
+                        del pool.txns[txn_id]
+                        self._close(pool, sess)
+                        closed += 1
+            if closed:
+                self.cond.notify_all()
+        return closed
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(max(1.0, min(self.idle_timeout, self.txn_timeout) / 10))
             try:
-                sess = self.pool.get(block=False)
-            except queue.Empty:
-                sess = conn.create_session()
-            return sess
-
-    def release(self, sess: Session, txn_id: Optional[Any] = None):
-        if txn_id:
-            self.txns[txn_id] = sess
-        else:
-            self.pool.put(sess)
+                self.reap()
+            except Exception:
+                logger.exception("Error reaping session pools")
 
+    def stats(self) -> Dict[str, Any]:
+        with self.cond:
+            users = {name: pool.stats() for name, pool in self.pools.items()}
+        totals = defaultdict(int)
+        for u in users.values():
+            for k, v in u.items():
+                totals[k] += v
+        return {"total": dict(totals), "users": users}
 
-class Context:
-    POOLS = defaultdict(SessionPool)
 
-    def __init__(self, conn: Connection, req: Request):
+class Context:
+    def __init__(self, pools: SessionPools, req: Request):
         self.h = Headers(req)
         self.txn_id = self.h.get("Transaction-Id")
         if self.txn_id == "NONE":
             self.txn_id = None
-        self.pool = self.POOLS[self.h.get("User", "default")]
-        self._sess = self.pool.acquire(conn, self.txn_id)
+        self.pools = pools
+        self.user = self.h.get("User", "default")
 
         # Use a target catalog/schema, if specified
         use_target = None
-        if catalog := self.h.get("Catalog"):
+        self.database = self.h.get("Catalog")
+        if catalog := self.database:
             use_target = catalog
         if schema := self.h.get("Schema"):
             if schema == "default":
@@ -78,16 +303,29 @@ class Context:
                 use_target += f".{schema}"
             else:
                 use_target = schema
-        if use_target:
-            self._sess.execute_sql(f"USE {use_target}")
 
-    def execute_sql(self, sql: str) -> QueryResult:
+        self._sess = self.pools.acquire(
+            self.user, self.txn_id, use_target, self.database
+        )
+        if use_target and self.pools.use_target(self._sess) != use_target:
+            try:
+                self._sess.execute_sql(f"USE {use_target}")
+            except Exception:
+                self.pools.set_use_target(self._sess, None)
+                self.close()
+                raise
+            self.pools.set_use_target(self._sess, use_target)
+
+    def execute_sql(self, sql: str, params=None) -> QueryResult:
         logger.debug(f"TXN %s: %s", self.txn_id, sql)
-        qr = self._sess.execute_sql(sql)
+        if _USE.match(sql):
+            # The client is switching schemas itself, so we no longer know where it is
+            self.pools.set_use_target(self._sess, None)
+        qr = self._sess.execute_sql(sql, params)
         ends_in_txn = self._sess.in_transaction()
         logger.debug("FINISH IN TXN: %s", ends_in_txn)
         if not self.txn_id and ends_in_txn:
-            self.txn_id = str(uuid.uuid4())
+            self.txn_id = self.pools.new_txn_id()
             self.h.set("Started-Transaction-Id", self.txn_id)
             logger.debug("Set txn id to %s", self.txn_id)
         elif self.txn_id and not ends_in_txn:
@@ -97,8 +335,13 @@ class Context:
         return qr
 
     def close(self):
-        self.pool.release(self._sess, self.txn_id)
-        self._sess = None
+        if self._sess is not None:
+            self.pools.release(self.user, self._sess, self.txn_id)
+            self._sess = None
+
+    def prepared_statements(self) -> Dict[str, str]:
+        """The prepared statements the client sent, by name."""
+        return prepared.parse_header(self.h.get_all("Prepared-Statement"))
 
     def session(self) -> Session:
         return self._sess
@@ -0,0 +1,39 @@
+import json
+from typing import Callable, List, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from . import schemas
+
+
+def row_encoder(encoders: List[Callable]) -> Callable[[List], str]:
+    """Combines per-column JSON encoders into one that renders a row as a JSON array."""
+
+    def encode(row: List) -> str:
+        return "[" + ",".join([enc(v) for enc, v in zip(encoders, row)]) + "]"
+
+    return encode
+
+
+def render_columns(columns: Optional[List[schemas.Column]]) -> str:
+    return json.dumps(jsonable_encoder(columns), ensure_ascii=False)
+
+
+def encode_query_result(
+    result: schemas.QueryResult,
+    columns: Optional[str] = None,
+    rows: Optional[List[str]] = None,
+    data_encoding: Optional[str] = None,
+) -> bytes:
+    """Serializes a QueryResult whose columns and rows are already JSON fragments.
+
+    The rest of the model is small and goes through pydantic as usual; the payload is
+    spliced in without being walked again. With a `data_encoding`, `rows` are spooled
+    segment descriptions and `data` takes the form of Trino's spooling protocol.
+    """
+    head = result.model_dump_json(by_alias=True, exclude={"columns", "data"})
+    data = "null" if rows is None else "[" + ",".join(rows) + "]"
+    if data_encoding and rows is not None:
+        data = f'{{"encoding":{json.dumps(data_encoding)},"segments":{data}}}'
+    columns = columns or "null"
+    return f'{head[:-1]},"columns":{columns},"data":{data}}}'.encode("utf-8")
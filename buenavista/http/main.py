@@ -1,30 +1,90 @@
 import asyncio
 import concurrent.futures
 import functools
+import itertools
+import json
 import logging
+import os
+import re
 import time
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
 from fastapi import FastAPI, Request, Response
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    RedirectResponse,
+    StreamingResponse,
+)
 
-from . import context, schemas, type_mapping
-from ..core import Connection, Extension, Session, QueryResult
+from . import compression, context, encoding, prepared, queries, schemas, type_mapping
+from ..core import BVType, Connection, Extension, QueryResult
 from ..rewrite import Rewriter
+from ..stats import STAT_STATEMENTS_COLUMNS, StatementStatistics
+from ..workers import Worker
 
 logger = logging.getLogger(__name__)
 
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+SPOOLED_SEGMENTS_PER_PAGE = 4
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
 
 def quacko(
     app: FastAPI,
     conn: Connection,
     rewriter: Optional[Rewriter] = None,
     extensions: List[Extension] = [],
+    statements: Optional[StatementStatistics] = None,
+    page_rows: int = 10_000,
+    page_bytes: int = 1 << 20,
+    query_timeout: float = 300.0,
+    max_running: Optional[int] = None,
+    max_wait: float = 1.0,
+    spool=None,
+    pools: Optional[context.SessionPools] = None,
+    compress_min_bytes: Optional[int] = 16 << 10,
+    worker: Optional[Worker] = None,
 ):
-    pool = concurrent.futures.ThreadPoolExecutor()
+    """Serves the Trino HTTP protocol for the connection on the app.
+
+    Pass a `spool.Spool` as `spool` to let clients ask for large results as Parquet or
+    Arrow segment files via the X-Trino-Query-Data-Encoding header, and a
+    `context.SessionPools` as `pools` to bound the sessions each user can hold.
+
+    JSON responses of at least `compress_min_bytes` are gzip or zstd compressed for
+    clients that accept it; pass None to never compress them.
+
+    When the app is one of several `workers.supervise` processes sharing a port, pass
+    its `workers.Worker` as `worker`. nextUri links then point at the worker's private
+    port, and requests for another worker's queries or transactions are redirected
+    to it.
+    """
+    # Statements execute here; polling and paging run on the event loop's default executor
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_running)
+    active = queries.ActiveQueries(query_timeout)
+    running: Dict[str, concurrent.futures.Future] = {}
+    query_ids = itertools.count()
     start_time = time.time()
     extensions_lookup = {e.type(): e for e in extensions}
+    if statements is None:
+        statements = StatementStatistics()
+    if pools is None:
+        pools = context.SessionPools(conn)
+    if worker is not None:
+        pools.tag_txn_id = worker.tag
+    prepared_statements = prepared.PreparedStatements(
+        rewriter.rewrite if rewriter else None
+    )
+    if compress_min_bytes is not None:
+        app.add_middleware(
+            compression.CompressionMiddleware, minimum_size=compress_min_bytes
+        )
+    conn.register_relation(
+        "bv_stat_statements", STAT_STATEMENTS_COLUMNS, statements.snapshot
+    )
 
     @app.get("/v1/info")
     async def info():
@@ -37,88 +97,377 @@ def quacko(
             "uptime": f"{uptime_minutes:.2f} minutes",
         }
 
+    @app.get("/v1/bv/stat_statements")
+    async def stat_statements():
+        return statements.snapshot()
+
+    @app.get("/v1/bv/session_pools")
+    async def session_pools():
+        return pools.stats()
+
     @app.post("/v1/statement")
     async def statement(req: Request) -> Response:
+        if redirect := _redirect(req, context.Headers(req).get("Transaction-Id")):
+            return redirect
         # TODO: check user, do stuff with it
-        ctxt = context.Context(conn, req)
         raw_query = await req.body()
         query = raw_query.decode("utf-8")
         logger.info("HTTP Query: %s", query)
+        id = f"{start_time:.0f}_{round(time.time() * 1000)}_{next(query_ids):05d}"
+        if worker is not None:
+            id = worker.tag(id)
+        aq = queries.ActiveQuery(id)
+        result = _result(aq, queries.Page(queries.QUEUED), req, 0)
+        active.add(aq)
+        fut = pool.submit(aq.run, functools.partial(_execute, req, query))
+        running[id] = fut
+        fut.add_done_callback(lambda _: running.pop(id, None))
+        return _response(result)
+
+    @app.get("/v1/statement/executing/{id}/{token}")
+    async def executing(id: str, token: int, req: Request) -> Response:
+        query = active.get(id)
+        if query is None:
+            return _redirect(req, id) or Response(status_code=404)
+        if fut := running.get(id):
+            await asyncio.wait([asyncio.wrap_future(fut)], timeout=max_wait)
         loop = asyncio.get_running_loop()
         result = await loop.run_in_executor(
-            pool, functools.partial(_execute, ctxt, query)
+            None, functools.partial(_next_page, query, token, req)
         )
-        return JSONResponse(content=jsonable_encoder(result), headers=ctxt.headers())
+        if result is None:
+            return Response(status_code=410)
+        headers = query.ctx.headers() if query.ctx else None
+        return _response(result, headers)
+
+    @app.post("/v1/bv/arrow")
+    async def arrow_statement(req: Request, compression: Optional[str] = None):
+        """Runs a statement and streams its result back as an Arrow IPC stream.
 
-    def _execute(ctx: context.Context, query: str) -> schemas.BaseResult:
-        start = round(time.time() * 1000)
-        id = f"{start_time}_{start}"
+        `compression` may be "lz4" or "zstd" to compress the stream's buffers.
+        """
+        if compression not in (None, "lz4", "zstd"):
+            return JSONResponse(
+                {"error": f"Unsupported compression: {compression}"}, status_code=400
+            )
+        query = (await req.body()).decode("utf-8")
+        logger.info("HTTP Arrow Query: %s", query)
+        loop = asyncio.get_running_loop()
         try:
-            if req := Extension.check_json(query):
-                method = req.get("method")
+            ctx, stream = await loop.run_in_executor(
+                pool, functools.partial(_execute_arrow, req, query, compression)
+            )
+        except Exception as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        return StreamingResponse(
+            stream, media_type=ARROW_STREAM_MEDIA_TYPE, headers=ctx.headers()
+        )
+
+    @app.get("/v1/spooled/segments/{segment_id}")
+    async def spooled_segment(segment_id: str, req: Request) -> Response:
+        path = spool.path(segment_id) if spool else None
+        if path is None:
+            return Response(status_code=404)
+        size = os.path.getsize(path)
+        media_type = spool.media_type(segment_id)
+        try:
+            byte_range = parse_range(req.headers.get("range"), size)
+        except ValueError:
+            return Response(
+                status_code=416, headers={"Content-Range": f"bytes */{size}"}
+            )
+        if byte_range is None:
+            return FileResponse(path, media_type=media_type)
+        start, end = byte_range
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(
+            None, functools.partial(_read_range, path, start, end)
+        )
+        return Response(
+            content,
+            status_code=206,
+            media_type=media_type,
+            headers={
+                "Accept-Ranges": "bytes",
+                "Content-Range": f"bytes {start}-{end}/{size}",
+            },
+        )
+
+    @app.delete("/v1/spooled/segments/{segment_id}")
+    async def ack_spooled_segment(segment_id: str) -> Response:
+        if spool is None or not spool.remove(segment_id):
+            return Response(status_code=404)
+        return Response(status_code=204)
+
+    @app.delete("/v1/statement/executing/{id}/{token}")
+    async def cancel(id: str, token: int, req: Request) -> Response:
+        if redirect := _redirect(req, id):
+            return redirect
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, active.cancel, id)
+        return Response(status_code=204)
+
+    def _redirect(req: Request, id: Optional[str]) -> Optional[Response]:
+        """Sends a request for state another worker holds on to that worker."""
+        if worker is None or not worker.is_remote(id):
+            return None
+        url = req.url.replace(port=worker.private_port_of(worker.owner(id)))
+        return RedirectResponse(str(url), status_code=307)
+
+    def _run(
+        ctx: context.Context, query: str
+    ) -> Tuple[QueryResult, Callable[[int], None]]:
+        """Executes a statement, returning its result and a callback that records its stats."""
+        timer, rewrite_ms = time.perf_counter(), 0.0
+        raw_query, parsed = query, None
+        try:
+            if req_json := Extension.check_json(query):
+                method = req_json.get("method")
                 extension = extensions_lookup.get(method)
                 if not extension:
                     raise Exception("Unknown method: " + str(method))
                 else:
-                    qr = extension.apply(req.get("params"), ctx.session())
+                    qr = extension.apply(req_json.get("params"), ctx.session())
+            elif m := prepared.PREPARE.match(query):
+                name, body = m.group(1), m.group(2)
+                prepared_statements.get(ctx.user, name, body)
+                ctx.h.set("Added-Prepare", prepared.encode_header(name, body))
+                qr = prepared.StatusResult("PREPARE")
+            elif m := prepared.EXECUTE.match(query):
+                name = m.group(1)
+                body = ctx.prepared_statements().get(name)
+                if body is None:
+                    raise Exception(f"Prepared statement not found: {name}")
+                params = prepared.parse_params(m.group(2))
+                query = prepared_statements.get(ctx.user, name, body)
+                rewrite_ms = (time.perf_counter() - timer) * 1000
+                # Aggregate the stats of every execution under the statement itself
+                raw_query = body
+                qr = ctx.execute_sql(query, params or None)
+            elif m := prepared.DEALLOCATE.match(query):
+                prepared_statements.deallocate(ctx.user, m.group(1))
+                ctx.h.set("Deallocated-Prepare", m.group(1))
+                qr = prepared.StatusResult("DEALLOCATE")
             else:
                 if rewriter:
                     query = rewriter.rewrite(query)
+                    rewrite_ms = (time.perf_counter() - timer) * 1000
+                    parsed = rewriter.parsed(raw_query)
                 qr = ctx.execute_sql(query)
+        except Exception as e:
+            raise Exception(f"Received error '{e}' executing query {query}")
+        logger.debug(f"Query %s has %d columns in response", query, qr.column_count())
 
-            logger.debug(
-                f"Query %s has %d columns in response", query, qr.column_count()
+        def record(rows: int):
+            statements.record(
+                raw_query,
+                (time.perf_counter() - timer) * 1000,
+                rows=rows,
+                rewrite_ms=rewrite_ms,
+                statements=parsed,
             )
-            cols, data, update_type = _convert_query_result(qr)
 
-            return schemas.QueryResult(
-                id=id,
-                info_uri="http://127.0.0.1/info",
-                columns=cols,
-                data=data,
-                update_type=update_type,
-                stats=schemas.StatementStats(
-                    state="COMPLETE",
-                    elapsed_time_millis=(round(time.time() * 1000) - start),
-                ),
-            )
-        except Exception as e:
+        return qr, record
+
+    def _execute(req: Request, query: str, aq: queries.ActiveQuery):
+        ctx = context.Context(pools, req)
+        aq.attach(ctx)
+        qr, record = _run(ctx, query)
+        cols, encoders = _convert_columns(qr, type_mapping.json_encoder)
+        data_encoding = ctx.h.get("Query-Data-Encoding")
+        if spool is not None and data_encoding and qr.has_results():
+            counter, rows = _spool_rows(qr, data_encoding, req)
+            aq.data_encoding = data_encoding
+            aq.on_finish = lambda q: record(counter.rows)
+        else:
+            rows = _encode_rows(qr, cols, encoders)
+            aq.on_finish = lambda q: record(q.rows_sent)
+        aq.succeeded(qr, cols, rows)
+
+    def _spool_rows(qr: QueryResult, data_encoding: str, req: Request):
+        """Writes the result to spool segments, returning a row counter and an iterator
+        over a JSON description of each segment."""
+        from ..arrow import record_batches
+        from .arrow import RowCounter
+        from .spool import FORMATS
+
+        if data_encoding not in FORMATS:
+            raise Exception(f"Unsupported query data encoding: {data_encoding}")
+        schema, batches = record_batches(qr)
+        counter = RowCounter(batches)
+
+        def segments():
+            for seg in spool.segments(schema, counter, data_encoding):
+                uri = str(req.url_for("spooled_segment", segment_id=seg["id"]))
+                yield json.dumps(
+                    {
+                        "type": "spooled",
+                        "uri": uri,
+                        "ackUri": uri,
+                        "metadata": {
+                            "rowOffset": seg["row_offset"],
+                            "rowsCount": seg["rows"],
+                            "segmentSize": seg["size"],
+                        },
+                    }
+                )
+
+        return counter, segments()
+
+    def _execute_arrow(req: Request, query: str, compression: Optional[str]):
+        # Only the Arrow endpoint needs pyarrow, which comes with the duckdb extra
+        from ..arrow import record_batches
+        from .arrow import RowCounter, ipc_stream
+
+        ctx = context.Context(pools, req)
+        try:
+            qr, record = _run(ctx, query)
+            schema, batches = record_batches(qr)
+        except Exception:
+            ctx.close()
+            raise
+        counter = RowCounter(batches)
+
+        def finish():
+            try:
+                record(counter.rows)
+            finally:
+                ctx.close()
+
+        return ctx, ipc_stream(schema, counter, compression, finish)
+
+    def _next_page(query: queries.ActiveQuery, token: int, req: Request):
+        if query.data_encoding:
+            page = query.page(token, SPOOLED_SEGMENTS_PER_PAGE, page_bytes)
+        else:
+            page = query.page(token, page_rows, page_bytes)
+        if page is None:
+            return None
+        if page.done:
+            active.remove(query.id)
+        return _result(query, page, req, token + 1)
+
+    def _response(result, headers: Optional[Dict] = None) -> Response:
+        if isinstance(result, tuple):
+            content = encoding.encode_query_result(*result)
+            return Response(content, media_type="application/json", headers=headers)
+        return JSONResponse(content=jsonable_encoder(result), headers=headers)
+
+    def _result(
+        query: queries.ActiveQuery, page: queries.Page, req: Request, token: int
+    ):
+        stats = schemas.StatementStats(
+            state=page.state,
+            queued=page.state == queries.QUEUED,
+            scheduled=page.state != queries.QUEUED,
+            elapsed_time_millis=round((time.time() - query.start) * 1000),
+            **query.stats(),
+        )
+        if page.state in (queries.FAILED, queries.CANCELED):
+            canceled = page.state == queries.CANCELED
             return schemas.ErrorResult(
-                id=id,
+                id=query.id,
                 info_uri="http://127.0.0.1/info",
                 error=schemas.QueryError(
-                    message=f"Received error '{e}' executing query {query}",
+                    message="Query was canceled" if canceled else query.error,
                     error_code=-1,
+                    error_name="USER_CANCELED" if canceled else None,
                     retriable=False,
                 ),
-                stats=schemas.StatementStats(
-                    state="ERROR",
-                    elapsed_time_millis=(round(time.time() * 1000) - start),
-                ),
+                stats=stats,
             )
-        finally:
-            ctx.close()
+        next_uri = None
+        if not page.done:
+            next_uri = req.url_for("executing", id=query.id, token=str(token))
+            if worker is not None:
+                # Keep polling the process that has the query
+                next_uri = next_uri.replace(port=worker.private_port)
+            next_uri = str(next_uri)
+        result = schemas.QueryResult(
+            id=query.id,
+            info_uri="http://127.0.0.1/info",
+            next_uri=next_uri,
+            update_type=None,
+            stats=stats,
+        )
+        return result, query.columns, page.data, query.data_encoding
 
 
-def _convert_query_result(qr: QueryResult):
+def _convert_columns(
+    qr: QueryResult, converter: Callable = type_mapping.type_converter
+) -> Tuple[List[schemas.Column], List[Callable]]:
     # Special handling for DESCRIBE-style results for reasons
     if qr.column_count() == 6:
         if qr.column(0)[0] == "column_name" and qr.column(1)[0] == "column_type":
             logger.info("Performing DESCRIBE conversion on QueryResults")
-            cols = type_mapping.DESCRIBE_COLUMNS
-            data = []
-            for r in qr.rows():
-                data.append([r[0], r[1], "", ""])
-            return cols, data, None
+            text = converter(BVType.TEXT)
+            empty = text("")
+            return type_mapping.DESCRIBE_COLUMNS, [
+                text,
+                text,
+                lambda _: empty,
+                lambda _: empty,
+            ]
 
     cols, converters = [], []
     for i in range(qr.column_count()):
         name, bvtype = qr.column(i)
         ttype, cts = type_mapping.to_trino(bvtype)
         cols.append(schemas.Column(name=name, type=ttype, type_signature=cts))
-        converters.append(type_mapping.type_converter(bvtype))
+        converters.append(converter(bvtype))
+    return cols, converters
+
+
+def _encode_rows(
+    qr: QueryResult, cols: List[schemas.Column], encoders: List[Callable]
+) -> Optional[Iterator[str]]:
+    """Renders each row of the result as a JSON array, a batch at a time if possible."""
+    if not qr.has_results():
+        return None
+    batches = None
+    if cols is not type_mapping.DESCRIBE_COLUMNS:
+        batches = qr.record_batches()
+    if batches is None:
+        return map(encoding.row_encoder(encoders), qr.rows())
+    # Only results that hold Arrow data return batches, so pyarrow is installed here
+    from . import arrow
+
+    bvtypes = [qr.column(i)[1] for i in range(qr.column_count())]
+    return arrow.encode_batches(batches, bvtypes)
 
+
+def _read_range(path: str, start: int, end: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start + 1)
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parses a single-range `Range` header into an inclusive (start, end) byte range.
+
+    Returns None for a missing header or one we don't support, in which case the
+    whole file is served; raises ValueError for a range outside the file.
+    """
+    if not header:
+        return None
+    m = _RANGE.match(header.strip())
+    if not m or not (m.group(1) or m.group(2)):
+        return None
+    if not m.group(1):
+        # A suffix range: the last N bytes
+        start, end = max(0, size - int(m.group(2))), size - 1
+    else:
+        start = int(m.group(1))
+        end = min(int(m.group(2)), size - 1) if m.group(2) else size - 1
+    if start > end or start >= size:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, end
+
+
+def _convert_query_result(qr: QueryResult):
+    cols, converters = _convert_columns(qr)
     data = []
-    for r in qr.rows():
-        data.append([converters[i](v) for i, v in enumerate(r)])
+    if qr.has_results():
+        for r in qr.rows():
+            data.append([c(v) for c, v in zip(converters, r)])
     return cols, data, None
@@ -0,0 +1,126 @@
+import datetime
+import decimal
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote_plus, unquote_plus
+
+import sqlglot
+from sqlglot import exp
+
+from ..core import QueryResult
+
+PREPARE = re.compile(r"^\s*PREPARE\s+(\w+)\s+FROM\s+(.+?)\s*;?\s*$", re.I | re.S)
+EXECUTE = re.compile(r"^\s*EXECUTE\s+(\w+)(?:\s+USING\s+(.+?))?\s*;?\s*$", re.I | re.S)
+DEALLOCATE = re.compile(r"^\s*DEALLOCATE\s+PREPARE\s+(\w+)\s*;?\s*$", re.I)
+
+
+class StatusResult(QueryResult):
+    """The result of a statement the HTTP front end handles itself, with no rows."""
+
+    def __init__(self, status: str):
+        super().__init__()
+        self._status = status
+
+    def has_results(self) -> bool:
+        return False
+
+    def column_count(self):
+        return 0
+
+    def column(self, index: int):
+        raise IndexError("No column at index %d" % index)
+
+    def rows(self) -> Iterator[List]:
+        return iter([])
+
+    def status(self) -> str:
+        return self._status
+
+
+def parse_header(values: List[str]) -> Dict[str, str]:
+    """Parses X-Trino-Prepared-Statement values of url-encoded name=sql pairs."""
+    ret = {}
+    for value in values:
+        for part in value.split(","):
+            name, sep, sql = part.strip().partition("=")
+            if sep:
+                ret[unquote_plus(name)] = unquote_plus(sql)
+    return ret
+
+
+def encode_header(name: str, sql: str) -> str:
+    return f"{quote_plus(name)}={quote_plus(sql)}"
+
+
+_TEMPORAL = {
+    exp.DataType.Type.DATE: datetime.date.fromisoformat,
+    exp.DataType.Type.TIMESTAMP: datetime.datetime.fromisoformat,
+    exp.DataType.Type.TIME: datetime.time.fromisoformat,
+}
+
+
+def _param_value(e: exp.Expression) -> Any:
+    if isinstance(e, exp.Null):
+        return None
+    if isinstance(e, exp.Boolean):
+        return e.this
+    if isinstance(e, exp.Neg) and isinstance(e.this, exp.Literal):
+        return -_param_value(e.this)
+    if isinstance(e, exp.Literal):
+        if e.is_string:
+            return e.this
+        if re.fullmatch(r"-?\d+", e.this):
+            return int(e.this)
+        return decimal.Decimal(e.this)
+    if isinstance(e, exp.Cast) and isinstance(e.this, exp.Literal) and e.this.is_string:
+        convert = _TEMPORAL.get(e.to.this)
+        return convert(e.this.this) if convert else e.this.this
+    raise Exception(f"Unsupported parameter in EXECUTE ... USING: {e.sql()}")
+
+
+def parse_params(using: Optional[str]) -> List[Any]:
+    """Turns the literal list of an EXECUTE ... USING clause into Python values."""
+    if not using:
+        return []
+    select = sqlglot.parse_one(f"SELECT {using}", read="trino")
+    return [_param_value(e) for e in select.expressions]
+
+
+class PreparedStatements:
+    """An LRU cache of rewritten prepared statements, by user and statement name.
+
+    Trino clients hold on to the text of their prepared statements and send it with
+    each request, so the cache is only an optimization: an entry whose text no longer
+    matches the client's is rewritten again.
+    """
+
+    def __init__(self, rewrite: Optional[Callable[[str], str]], max_size: int = 1000):
+        self.rewrite = rewrite
+        self.max_size = max_size
+        self.cache: "OrderedDict[Tuple[str, str], Tuple[str, str]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user: str, name: str, sql: str) -> str:
+        key = (user, name)
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry and entry[0] == sql:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        rewritten = self.rewrite(sql) if self.rewrite else sql
+        with self.lock:
+            self.cache[key] = (sql, rewritten)
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_size:
+                self.cache.popitem(last=False)
+        return rewritten
+
+    def deallocate(self, user: str, name: str):
+        with self.lock:
+            self.cache.pop((user, name), None)
@@ -0,0 +1,276 @@
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from . import context, encoding, schemas
+from ..core import QueryResult
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, FINISHED, FAILED, CANCELED = (
+    "QUEUED",
+    "RUNNING",
+    "FINISHED",
+    "FAILED",
+    "CANCELED",
+)
+
+
+class Page:
+    """A response's worth of rows, each already rendered as a JSON array."""
+
+    def __init__(self, state: str, data: Optional[List[str]] = None):
+        self.state = state
+        self.data = data
+
+    @property
+    def done(self) -> bool:
+        return self.state in (FINISHED, FAILED, CANCELED)
+
+
+class ActiveQuery:
+    """A query submitted over HTTP, from the time it is queued until its last page is sent.
+
+    The query runs on an executor thread while the client polls for pages. Once it is
+    running it holds on to its context (and so its session) until the last page has
+    been sent, the client cancels it, or it sits idle long enough to be reaped.
+    """
+
+    def __init__(
+        self, id: str, on_finish: Optional[Callable[["ActiveQuery"], None]] = None
+    ):
+        self.id = id
+        self.on_finish = on_finish
+        self.state = QUEUED
+        self.ctx: Optional[context.Context] = None
+        self.qr: Optional[QueryResult] = None
+        self.columns: Optional[str] = None
+        # Set for spooled results, whose "rows" are descriptions of segment files
+        self.data_encoding: Optional[str] = None
+        self.error: Optional[str] = None
+        self.start = time.time()
+        self.last_access = time.monotonic()
+        self.rows_sent = 0
+        self.bytes_sent = 0
+        # CPU time spent rendering pages, on top of whatever the backend reports
+        self.cpu_ms = 0.0
+        self.peak_memory = 0
+        self.profile: Dict[str, Any] = {}
+        self.token = 0
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+        self._rows: Optional[Iterator[str]] = None
+        self._peeked: Optional[str] = None
+        self._last: Optional[Tuple[int, Page]] = None
+        self._closed = False
+
+    def run(self, execute: Callable[["ActiveQuery"], None]):
+        """Runs `execute(self)` on the calling thread unless the query was canceled first.
+
+        `execute` should call `attach` as soon as it has a context and `succeeded` with
+        the result; any exception it raises fails the query.
+        """
+        with self.lock:
+            if self.state != QUEUED:
+                return
+            self.state = RUNNING
+        error = None
+        try:
+            execute(self)
+        except Exception as e:
+            error = e
+        with self.lock:
+            if error is not None and self.state == RUNNING:
+                self.state, self.error = FAILED, str(error)
+            if self.state != RUNNING:
+                self._finish()
+            self.ready.set()
+
+    def attach(self, ctx: context.Context):
+        with self.lock:
+            self.ctx = ctx
+            if self.state == CANCELED:
+                raise Exception("Query was canceled")
+
+    def succeeded(
+        self,
+        qr: QueryResult,
+        columns: List[schemas.Column],
+        rows: Optional[Iterator[str]],
+    ):
+        """Records the result, with `rows` yielding each row already encoded as JSON."""
+        with self.lock:
+            if self.state == CANCELED:
+                raise Exception("Query was canceled")
+            self.qr = qr
+            self.columns = encoding.render_columns(columns)
+            self._rows = rows
+
+    def _next_row(self) -> Optional[str]:
+        if self._peeked is not None:
+            row, self._peeked = self._peeked, None
+            return row
+        if self._rows is None:
+            return None
+        return next(self._rows, None)
+
+    def _has_more(self) -> bool:
+        if self._peeked is None and self._rows is not None:
+            self._peeked = next(self._rows, None)
+        return self._peeked is not None
+
+    def page(self, token: int, max_rows: int, max_bytes: int) -> Optional[Page]:
+        """Returns the page for `token`.
+
+        A query that is still queued or running returns an empty page in that state.
+        Asking again for the most recent token returns the same page, so a client can
+        safely retry a request whose response it never saw; any other token is rejected
+        by returning None.
+        """
+        with self.lock:
+            self.last_access = time.monotonic()
+            if self._last and self._last[0] == token:
+                return self._last[1]
+            if token != self.token:
+                return None
+            if not self.ready.is_set() or self.state != RUNNING:
+                page = Page(self.state)
+            else:
+                data, size = [], 0
+                cpu = time.thread_time()
+                try:
+                    while len(data) < max_rows and size < max_bytes:
+                        row = self._next_row()
+                        if row is None:
+                            break
+                        size += len(row)
+                        data.append(row)
+                    self.peak_memory = max(self.peak_memory, self.qr.memory_usage())
+                    done = not self._has_more()
+                except Exception as e:
+                    self.state, self.error = FAILED, str(e)
+                    self._finish()
+                    page = Page(FAILED)
+                else:
+                    self.rows_sent += len(data)
+                    self.bytes_sent += size
+                    if done:
+                        self.state = FINISHED
+                        self._read_profile()
+                        self._finish()
+                    page = Page(FINISHED if done else RUNNING, data)
+                self.cpu_ms += (time.thread_time() - cpu) * 1000
+            self._last = (token, page)
+            self.token += 1
+            return page
+
+    def _read_profile(self):
+        # The backend's session is still ours, so its profile is for this query
+        try:
+            self.profile = self.qr.profile()
+        except Exception:
+            logger.exception("Error reading the profile of query %s", self.id)
+
+    def stats(self) -> Dict[str, int]:
+        """The StatementStats counters for the query so far.
+
+        Rows and bytes scanned come from the backend's profile when it has one, and
+        otherwise count what has been sent to the client.
+        """
+        profile = self.profile
+        peak_memory = max(self.peak_memory, profile.get("peak_memory_bytes", 0))
+        return {
+            "processed_rows": profile.get("rows_scanned") or self.rows_sent,
+            "processed_bytes": profile.get("bytes_scanned") or self.bytes_sent,
+            "cpu_time_millis": round(profile.get("cpu_time_ms", 0) + self.cpu_ms),
+            "wall_time_millis": round(profile.get("wall_time_ms", 0)),
+            "peak_memory_bytes": peak_memory,
+            "peak_total_memory_bytes": peak_memory,
+        }
+
+    def cancel(self):
+        """Cancels the query, interrupting the backend if it is still executing."""
+        with self.lock:
+            if self.state in (FINISHED, FAILED, CANCELED):
+                self._finish()
+                return
+            executing = self.state == RUNNING and not self.ready.is_set()
+            self.state = CANCELED
+            if not executing:
+                # Queued queries never start; ready ones can release their session now
+                self._finish()
+                self.ready.set()
+                return
+            ctx = self.ctx
+        if ctx is not None and ctx.session() is not None:
+            try:
+                ctx.session().cancel()
+            except Exception:
+                logger.exception("Error interrupting query %s", self.id)
+
+    def _finish(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._rows, self._peeked = None, None
+        try:
+            if self.on_finish and self.state == FINISHED:
+                self.on_finish(self)
+        finally:
+            if self.ctx is not None:
+                self.ctx.close()
+
+
+class ActiveQueries:
+    """Tracks the queries that are queued, running or still have pages to deliver.
+
+    A background thread cancels any query whose client has not polled it within
+    `timeout` seconds, interrupting its execution and releasing its session.
+    """
+
+    def __init__(self, timeout: float = 300.0):
+        self.timeout = timeout
+        self.queries: Dict[str, ActiveQuery] = {}
+        self.lock = threading.Lock()
+        self._reaper = threading.Thread(target=self._reap_forever, daemon=True)
+        self._reaper.start()
+
+    def add(self, query: ActiveQuery):
+        with self.lock:
+            self.queries[query.id] = query
+
+    def get(self, id: str) -> Optional[ActiveQuery]:
+        with self.lock:
+            return self.queries.get(id)
+
+    def remove(self, id: str) -> Optional[ActiveQuery]:
+        with self.lock:
+            return self.queries.pop(id, None)
+
+    def cancel(self, id: str) -> bool:
+        query = self.remove(id)
+        if query is None:
+            return False
+        query.cancel()
+        return True
+
+    def reap(self) -> int:
+        cutoff = time.monotonic() - self.timeout
+        with self.lock:
+            expired = [q.id for q in self.queries.values() if q.last_access < cutoff]
+        for id in expired:
+            logger.info("Reaping abandoned query %s", id)
+            self.cancel(id)
+        return len(expired)
+
+    def _reap_forever(self):
+        while True:
+            time.sleep(max(1.0, self.timeout / 10))
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Error reaping abandoned queries")
+
+    def __len__(self) -> int:
+        return len(self.queries)
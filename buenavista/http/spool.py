@@ -0,0 +1,121 @@
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrow", "application/vnd.apache.arrow.file"),
+}
+
+_SEGMENT_ID = re.compile(r"^[0-9a-f]{32}\.(parquet|arrow)$")
+
+
+class Spool:
+    """Writes large query results to segment files in a local directory.
+
+    Segments are written a record batch at a time, so memory use doesn't depend on the
+    size of the result. Each is served until it is acknowledged or `ttl` seconds pass,
+    whichever comes first; a background thread deletes the expired ones.
+    """
+
+    def __init__(
+        self, directory: str, ttl: float = 3600.0, segment_bytes: int = 16 << 20
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._cleaner = threading.Thread(target=self._clean_forever, daemon=True)
+        self._cleaner.start()
+
+    def _writer(self, path: str, schema: pa.Schema, format: str):
+        if format == "parquet":
+            return pq.ParquetWriter(path, schema)
+        return pa.ipc.new_file(path, schema)
+
+    def segments(
+        self, schema: pa.Schema, batches: Iterator[pa.RecordBatch], format: str
+    ) -> Iterator[Dict]:
+        """Writes the batches out as segments of roughly `segment_bytes` each.
+
+        Yields a description of each segment once its file is complete, so a segment is
+        never served half-written.
+        """
+        ext = FORMATS[format][0]
+        batches = iter(batches)
+        offset = 0
+        rb = next(batches, None)
+        while rb is not None:
+            id = uuid.uuid4().hex + ext
+            path = os.path.join(self.directory, id)
+            rows, size = 0, 0
+            with self._writer(path + ".tmp", schema, format) as writer:
+                while rb is not None and size < self.segment_bytes:
+                    if rb.num_rows > 1 and size + rb.nbytes > self.segment_bytes:
+                        # Split batches that would overflow the segment
+                        fit = (self.segment_bytes - size) * rb.num_rows // rb.nbytes
+                        head, rb = rb.slice(0, max(1, fit)), rb.slice(max(1, fit))
+                    else:
+                        head, rb = rb, None
+                    writer.write_batch(head)
+                    rows += head.num_rows
+                    size += head.nbytes
+                    if rb is None:
+                        rb = next(batches, None)
+            os.replace(path + ".tmp", path)
+            yield {
+                "id": id,
+                "row_offset": offset,
+                "rows": rows,
+                "size": os.path.getsize(path),
+            }
+            offset += rows
+
+    def path(self, id: str) -> Optional[str]:
+        if not _SEGMENT_ID.match(id):
+            return None
+        path = os.path.join(self.directory, id)
+        return path if os.path.exists(path) else None
+
+    def media_type(self, id: str) -> str:
+        return FORMATS[id.rsplit(".", 1)[1]][1]
+
+    def remove(self, id: str) -> bool:
+        path = self.path(id)
+        if path is None:
+            return False
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def cleanup(self) -> int:
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def _clean_forever(self):
+        while True:
+            time.sleep(max(1.0, self.ttl / 10))
+            try:
+                self.cleanup()
+            except Exception:
+                logger.exception("Error cleaning spool directory %s", self.directory)
+
@@ -1,4 +1,9 @@
-from typing import Callable, List, Tuple
+import json
+import math
+from json.encoder import encode_basestring
+from typing import Any, Callable, List, Tuple
+
+from fastapi.encoders import jsonable_encoder
 
 from ..core import BVType
 from .schemas import ClientTypeSignature, ClientTypeSignatureParameter, Column
@@ -47,10 +52,65 @@ TYPE_MAPPING = {
 
 def type_converter(bvtype: BVType) -> Callable:
     if bvtype in (BVType.DECIMAL, BVType.TIMESTAMP, BVType.TIME, BVType.DATE):
-        return lambda x: str(x) if x else None
+        return lambda x: str(x) if x is not None else None
     return lambda x: x
 
 
+def _encode_int(x: Any) -> str:
+    return "null" if x is None else str(int(x))
+
+
+def _encode_float(x: Any) -> str:
+    if x is None:
+        return "null"
+    if math.isfinite(x):
+        return repr(float(x))
+    # JSON has no NaN or Infinity, so like Trino we send them as strings
+    if math.isnan(x):
+        return '"NaN"'
+    return '"Infinity"' if x > 0 else '"-Infinity"'
+
+
+def _encode_bool(x: Any) -> str:
+    if x is None:
+        return "null"
+    return "true" if x else "false"
+
+
+def _encode_text(x: Any) -> str:
+    return "null" if x is None else encode_basestring(x)
+
+
+def _encode_quoted(x: Any) -> str:
+    # str() of decimals, dates and times never needs escaping
+    return "null" if x is None else f'"{x}"'
+
+
+def _encode_any(x: Any) -> str:
+    return json.dumps(jsonable_encoder(x), ensure_ascii=False)
+
+
+JSON_ENCODERS = {
+    BVType.BIGINT: _encode_int,
+    BVType.INTEGER: _encode_int,
+    BVType.FLOAT: _encode_float,
+    BVType.BOOL: _encode_bool,
+    BVType.TEXT: _encode_text,
+    BVType.DECIMAL: _encode_quoted,
+    BVType.DATE: _encode_quoted,
+    BVType.TIME: _encode_quoted,
+    BVType.TIMESTAMP: _encode_quoted,
+}
+
+
+def json_encoder(bvtype: BVType) -> Callable[[Any], str]:
+    """Returns a function that renders a value of the type as a JSON fragment.
+
+    The output matches `jsonable_encoder` applied to the `type_converter` value.
+    """
+    return JSON_ENCODERS.get(bvtype, _encode_any)
+
+
 def to_trino(bvtype: BVType) -> Tuple[str, ClientTypeSignature]:
     ret = TYPE_MAPPING.get(bvtype)
     if not ret:
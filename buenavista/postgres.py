@@ -9,10 +9,15 @@ import random
 import socket
 import socketserver
 import struct
-from typing import Dict, List, Optional
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
+from .catalog import CatalogCache
 from .core import BVType, Connection, Extension, Session, QueryResult
 from .rewrite import Rewriter
+from .stats import STAT_STATEMENTS_COLUMNS, StatementStatistics
+from .workers import Worker
 
 logger = logging.getLogger(__name__)
 
@@ -108,9 +113,8 @@ def _time_to_microseconds(t):
 
 
 def _micros_since_2000(dt):
-    micros = (
-        dt - datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
-    ).total_seconds() * 1000000
+    tz = datetime.timezone.utc if dt.tzinfo else None
+    micros = (dt - datetime.datetime(2000, 1, 1, tzinfo=tz)).total_seconds() * 1000000
     return int(micros)
 
 
@@ -204,11 +208,21 @@ class BVContext:
     """Manages the state of a single connection to the server."""
 
     def __init__(
-        self, session: Session, rewriter: Optional[Rewriter], params: Dict[str, str]
+        self,
+        session: Session,
+        rewriter: Optional[Rewriter],
+        params: Dict[str, str],
+        statements: Optional[StatementStatistics] = None,
+        catalog_cache: Optional[CatalogCache] = None,
     ):
         self.session = session
         self.rewriter = rewriter
         self.params = params
+        self.statements = statements
+        self.catalog_cache = catalog_cache
+        # Set once this session's catalog may differ from what other sessions see
+        self.catalog_personal = False
+        self.catalog_ddl_in_txn = False
         self.process_id = random.randint(0, 2**32 - 1)
         self.secret_key = random.randint(0, 2**32 - 1)
         self.stmts = {}
@@ -217,6 +231,17 @@ class BVContext:
         self.has_error = False
         self.authenticated = False
         self.salt = None
+        self.client_addr = None
+        self.backend_start = datetime.datetime.now()
+        self.state_change = self.backend_start
+        self.query = None
+        self.query_start = None
+        self.query_timer = None
+        self.rewrite_ms = 0.0
+        self.parsed = None
+        self.active = False
+        self.rows_sent = 0
+        self.bytes_sent = 0
 
     def get_hashed_password(self, auth: dict) -> str:
         user = self.params["user"]
@@ -235,12 +260,68 @@ class BVContext:
                 return TransactionStatus.IN_TRANSACTION
         return TransactionStatus.IDLE
 
+    def begin_query(self, sql: str):
+        self.query = sql
+        self.query_start = datetime.datetime.now()
+        self.query_timer = time.perf_counter()
+        self.rewrite_ms = 0.0
+        self.state_change = self.query_start
+        self.active = True
+
+    def end_query(self, rows: int = 0, failed: bool = False):
+        self.rows_sent += rows
+        self.active = False
+        self.state_change = datetime.datetime.now()
+        if self.statements is not None and not failed:
+            stmts = None
+            if self.parsed and self.parsed[0] == self.query:
+                stmts = self.parsed[1]
+            self.statements.record(
+                self.query,
+                (time.perf_counter() - self.query_timer) * 1000,
+                rows=rows,
+                rewrite_ms=self.rewrite_ms,
+                statements=stmts,
+            )
+
+    def state(self) -> str:
+        if self.active:
+            return "active"
+        status = self.transaction_status()
+        if status == TransactionStatus.IN_TRANSACTION:
+            return "idle in transaction"
+        elif status == TransactionStatus.IN_FAILED_TRANSACTION:
+            return "idle in transaction (aborted)"
+        return "idle"
+
+    def activity(self) -> dict:
+        """A pg_stat_activity-style snapshot of what this connection is doing."""
+        return {
+            "pid": self.process_id,
+            "usename": self.params.get("user"),
+            "datname": self.params.get("database"),
+            "application_name": self.params.get("application_name"),
+            "client_addr": self.client_addr,
+            "backend_start": self.backend_start,
+            "state": self.state(),
+            "state_change": self.state_change,
+            "query_start": self.query_start,
+            "query": self.query,
+            "rows_sent": self.rows_sent,
+            "bytes_sent": self.bytes_sent,
+            "prepared_statements": len(self.stmts),
+            "portals": len(self.portals),
+            "cached_portal_bytes": sum(
+                qr.memory_usage() for qr in list(self.result_cache.values())
+            ),
+        }
+
     def execute_sql(self, sql: str, params=None, result_fmt=None) -> QueryResult:
         logger.info("Input SQL: " + sql)
-        if self.rewriter:
-            sql = self.rewriter.rewrite(sql)
-            logger.info("Rewritten SQL: " + sql)
-        qr = self.session.execute_sql(sql, params)
+        if self.catalog_cache is not None:
+            qr = self._execute_cached(sql, params)
+        else:
+            qr = self._execute(sql, params)
         if qr.has_results():
             if result_fmt and len(result_fmt) != qr.column_count():
                 qr.result_format = [result_fmt[0]] * qr.column_count()
@@ -248,6 +329,45 @@ class BVContext:
                 qr.result_format = result_fmt
         return qr
 
+    def _execute(self, sql: str, params=None) -> QueryResult:
+        if self.rewriter:
+            rewrite_start = time.perf_counter()
+            original, sql = sql, self.rewriter.rewrite(sql)
+            self.rewrite_ms += (time.perf_counter() - rewrite_start) * 1000
+            self.parsed = (original, self.rewriter.parsed(original))
+            logger.info("Rewritten SQL: " + sql)
+        return self.session.execute_sql(sql, params)
+
+    def _execute_cached(self, sql: str, params=None) -> QueryResult:
+        cache, key = self.catalog_cache, None
+        ddl = cache.changes_catalog(sql)
+        if cache.personalizes(sql):
+            self.catalog_personal = True
+        elif (
+            not ddl
+            and not self.catalog_personal
+            and not self.catalog_ddl_in_txn
+            and cache.cacheable(sql)
+        ):
+            user, database = self.params.get("user"), self.params.get("database")
+            key = cache.key(sql, params, user, database)
+            if key is not None and (qr := cache.get(key)) is not None:
+                logger.info("Answered from the catalog cache")
+                return qr
+        generation = cache.generation
+        qr = self._execute(sql, params)
+        if ddl:
+            cache.invalidate()
+            # Others may cache the catalog as it was until the transaction commits
+            self.catalog_ddl_in_txn = self.session.in_transaction()
+        elif self.catalog_ddl_in_txn and not self.session.in_transaction():
+            cache.invalidate()
+            self.catalog_ddl_in_txn = False
+        # A transaction may see catalog changes no other session can see yet
+        if key is not None and not self.session.in_transaction():
+            qr = cache.put(key, qr, generation)
+        return qr
+
     def describe_portal(self, name: str) -> QueryResult:
         stmt, params, result_fmt = self.portals[name]
         sql, param_oids = self.stmts[stmt]
@@ -301,6 +421,21 @@ class BVContext:
             self.has_error = False
 
 
+class _CountingWriter:
+    """Wraps the handler's output stream to track the bytes sent on a connection."""
+
+    def __init__(self, wfile, ctx: BVContext):
+        self.wfile = wfile
+        self.ctx = ctx
+
+    def write(self, data: bytes) -> int:
+        self.ctx.bytes_sent += len(data)
+        return self.wfile.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.wfile, name)
+
+
 class BuenaVistaHandler(socketserver.StreamRequestHandler):
     def handle(self):
         # disable Nangle's
@@ -310,6 +445,8 @@ class BuenaVistaHandler(socketserver.StreamRequestHandler):
         try:
             ctx = self.handle_startup(self.server.conn)
             if ctx:
+                ctx.client_addr = self.client_address[0]
+                self.wfile = _CountingWriter(self.wfile, ctx)
                 self.server.ctxts[ctx.process_id] = ctx
             while ctx:
                 type_code = self.r.read_byte()
@@ -353,7 +490,8 @@ class BuenaVistaHandler(socketserver.StreamRequestHandler):
 
         if ctx:
             self.server.conn.close_session(ctx.session)
-            del self.server.ctxts[ctx.process_id]
+            # A cancel request may have already removed it
+            self.server.ctxts.pop(ctx.process_id, None)
             ctx = None
 
     def handle_startup(self, conn: Connection) -> BVContext:
@@ -369,16 +507,21 @@ class BuenaVistaHandler(socketserver.StreamRequestHandler):
             ]
             params = dict(zip(msg[::2], msg[1::2]))
             logger.info("Client connection params: %s", params)
-            ctx = BVContext(conn.create_session(), self.server.rewriter, params)
+            ctx = BVContext(
+                conn.create_session(params.get("database")),
+                self.server.rewriter,
+                params,
+                statements=self.server.statements,
+                catalog_cache=self.server.catalog_cache,
+            )
+            if self.server.worker is not None:
+                # Lets any worker route a cancel request for this connection to us
+                ctx.process_id = self.server.worker.random_id()
             self.send_auth_request(ctx)
             return ctx
         elif code == 80877102:  ## Cancel request
             process_id, secret_key = self.r.read_uint32(), self.r.read_uint32()
-            ctx = self.server.ctxts.get(process_id)
-            if ctx and ctx.secret_key == secret_key:
-                self.server.conn.close_session(ctx.session)
-                del self.server.ctxts[ctx.process_id]
-                ctx = None
+            self.server.cancel(process_id, secret_key)
             return None
         else:
             raise Exception(f"Unsupported startup message: {code}")
@@ -421,6 +564,7 @@ class BuenaVistaHandler(socketserver.StreamRequestHandler):
     def handle_query(self, ctx: BVContext, payload: bytes):
         logger.debug("Handle query")
         decoded = payload.decode("utf-8").rstrip("\x00")
+        ctx.begin_query(decoded)
         try:
             # JSON payloads signal that we should use extensions
             if req := Extension.check_json(decoded):
@@ -433,19 +577,26 @@ class BuenaVistaHandler(socketserver.StreamRequestHandler):
             else:
                 query_result = ctx.execute_sql(decoded)
         except Exception as e:
+            ctx.end_query(failed=True)
             self.send_error(e)
             self.send_ready_for_query(ctx)
             return
 
-        if not query_result:
-            raise Exception("No query result for query: " + decoded)
-        elif query_result.has_results():
-            self.send_row_description(query_result)
-            row_count = self.send_data_rows(query_result)
-            self.send_command_complete("SELECT %d\x00" % row_count)
-        else:
-            status = query_result.status()
-            self.send_command_complete(f"{status}\x00")
+        row_count = 0
+        try:
+            if not query_result:
+                raise Exception("No query result for query: " + decoded)
+            elif query_result.has_results():
+                self.send_row_description(query_result)
+                row_count = self.send_data_rows(query_result)
+                self.send_command_complete("SELECT %d\x00" % row_count)
+            else:
+                status = query_result.status()
+                self.send_command_complete(f"{status}\x00")
+        except Exception:
+            ctx.end_query(failed=True)
+            raise
+        ctx.end_query(row_count)
         self.send_ready_for_query(ctx)
 
     def handle_parse(self, ctx: BVContext, payload: bytes):
@@ -553,24 +704,33 @@ class BuenaVistaHandler(socketserver.StreamRequestHandler):
         portal = ba[:portal_idx].decode("utf-8")
         limit = struct.unpack("!i", ba[portal_idx + 1 : portal_idx + 5])[0]
         query_result = None
+        if portal in ctx.portals:
+            ctx.begin_query(ctx.stmts[ctx.portals[portal][0]][0])
         try:
             query_result = ctx.execute_portal(portal)
         except Exception as e:
+            ctx.end_query(failed=True)
             self.send_error(e, ctx)
             return
-        if query_result.has_results():
-            row_count = self.send_data_rows(query_result, limit)
-            if limit == 0 or row_count < limit:
-                self.send_command_complete("SELECT %d\x00" % row_count)
-            else:
-                # add result back to the cache, so they'll
-                # be picked up on text call
-                ctx.result_cache[portal] = query_result
-                self.send_portal_suspend()
+        row_count = 0
+        try:
+            if query_result.has_results():
+                row_count = self.send_data_rows(query_result, limit)
+                if limit == 0 or row_count < limit:
+                    self.send_command_complete("SELECT %d\x00" % row_count)
+                else:
+                    # add result back to the cache, so they'll
+                    # be picked up on text call
+                    ctx.result_cache[portal] = query_result
+                    self.send_portal_suspend()
 
-        else:
-            status = query_result.status()
-            self.send_command_complete(f"{status}\x00")
+            else:
+                status = query_result.status()
+                self.send_command_complete(f"{status}\x00")
+        except Exception:
+            ctx.end_query(failed=True)
+            raise
+        ctx.end_query(row_count)
 
     def handle_close(self, ctx: BVContext, payload: bytes):
         logger.debug("Handling close")
@@ -712,6 +872,25 @@ class BuenaVistaHandler(socketserver.StreamRequestHandler):
         self.wfile.write(out)
 
 
+STAT_ACTIVITY_COLUMNS = [
+    ("pid", BVType.BIGINT),
+    ("usename", BVType.TEXT),
+    ("datname", BVType.TEXT),
+    ("application_name", BVType.TEXT),
+    ("client_addr", BVType.TEXT),
+    ("backend_start", BVType.TIMESTAMP),
+    ("state", BVType.TEXT),
+    ("state_change", BVType.TIMESTAMP),
+    ("query_start", BVType.TIMESTAMP),
+    ("query", BVType.TEXT),
+    ("rows_sent", BVType.BIGINT),
+    ("bytes_sent", BVType.BIGINT),
+    ("prepared_statements", BVType.BIGINT),
+    ("portals", BVType.BIGINT),
+    ("cached_portal_bytes", BVType.BIGINT),
+]
+
+
 class BuenaVistaServer(socketserver.ThreadingTCPServer):
     """A Python socketserver for the Buena Vista Postgres proxy."""
 
@@ -725,14 +904,83 @@ class BuenaVistaServer(socketserver.ThreadingTCPServer):
         rewriter: Optional[Rewriter] = None,
         extensions: List[Extension] = [],
         auth: Optional[Dict[str, str]] = None,
+        worker: Optional[Worker] = None,
+        catalog_cache: Optional[CatalogCache] = None,
     ):
+        """Pass a `workers.Worker` as `worker` to share the port with the other
+        workers of a `workers.supervise` group; this one also listens on its private
+        port so the others can forward cancel requests for its connections.
+
+        A `catalog.CatalogCache` answers the catalog queries clients send as they
+        connect without running them each time."""
+        self.worker = worker
+        self.catalog_cache = catalog_cache
         super().__init__(server_address, BuenaVistaHandler)
         self.conn = conn
         self.rewriter = rewriter
         self.extensions = {e.type(): e for e in extensions}
         self.ctxts = {}
         self.auth = auth
+        self.statements = StatementStatistics()
+        conn.register_relation(
+            "bv_stat_activity", STAT_ACTIVITY_COLUMNS, self.stat_activity
+        )
+        conn.register_relation(
+            "bv_stat_statements", STAT_STATEMENTS_COLUMNS, self.statements.snapshot
+        )
+
+    def server_bind(self):
+        if self.worker is not None:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+    def serve_forever(self, poll_interval=0.5):
+        if self.worker is not None:
+            private = _PrivateListener(self.worker.private_address(), self)
+            threading.Thread(target=private.serve_forever, daemon=True).start()
+        super().serve_forever(poll_interval)
+
+    def cancel(self, process_id: int, secret_key: int):
+        if self.worker is not None:
+            owner = self.worker.owner_int(process_id)
+            if owner != self.worker.index:
+                address = self.worker.private_address(owner)
+                _forward_cancel(address, process_id, secret_key)
+                return
+        ctx = self.ctxts.get(process_id)
+        if ctx and ctx.secret_key == secret_key:
+            self.conn.close_session(ctx.session)
+            del self.ctxts[ctx.process_id]
+
+    def stat_activity(self) -> List[dict]:
+        """Returns a snapshot of the activity on every live connection."""
+        return [ctx.activity() for ctx in list(self.ctxts.values())]
 
     def verify_request(self, request, client_address) -> bool:
         """Ensure all requests come from localhost until auth is in place"""
         return client_address[0] == "127.0.0.1" or "BUENAVISTA_HOST" in os.environ
+
+
+class _PrivateListener(socketserver.ThreadingTCPServer):
+    """Serves a worker's private port on behalf of its BuenaVistaServer."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, parent: BuenaVistaServer):
+        self.parent = parent
+        super().__init__(server_address, BuenaVistaHandler)
+
+    def __getattr__(self, name):
+        return getattr(self.parent, name)
+
+    def verify_request(self, request, client_address) -> bool:
+        return self.parent.verify_request(request, client_address)
+
+
+def _forward_cancel(address: Tuple[str, int], process_id: int, secret_key: int):
+    try:
+        with socket.create_connection(address, timeout=5) as sock:
+            sock.sendall(struct.pack("!iiII", 16, 80877102, process_id, secret_key))
+    except OSError:
+        logger.exception("Error forwarding cancel request to %s:%d", *address)
@@ -1,27 +1,214 @@
-from typing import Any, Callable, Dict, TypeVar
+import logging
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Pattern, Sequence, TypeVar
 
 import sqlglot
 import sqlglot.expressions as exp
 
 DecoratedCallable = TypeVar("DecoratedCallable", bound=Callable[..., Any])
 
+logger = logging.getLogger(__name__)
+
+
+class MaterializedRelation:
+    """A relation whose result is stored as a table instead of inlined as a subquery.
+
+    The table is (re)built on the first use after it expires, `ttl` seconds after it
+    was built, or every `refresh` seconds by the rewriter's background refresher.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        source: Callable[[], str],
+        ttl: Optional[float],
+        refresh: Optional[float],
+    ):
+        self.name = name
+        self.source = source
+        self.ttl = ttl
+        self.refresh = refresh
+        self.table = "bv_mat_" + re.sub(r"\W", "_", name)
+        self.built_at: Optional[float] = None
+        self.builds = 0
+        self.lock = threading.Lock()
+
+    def expired(self, now: float) -> bool:
+        if self.built_at is None:
+            return True
+        return self.ttl is not None and now - self.built_at >= self.ttl
+
+    def due(self, now: float) -> bool:
+        if self.refresh is None:
+            return False
+        return self.built_at is None or now - self.built_at >= self.refresh
+
 
 class Rewriter:
+    # Regexes for the SQL that translating from the read to the write dialect changes.
+    # When set, queries that match none of them and name no registered relation are
+    # passed through without being parsed; None sends every query through sqlglot.
+    TRIGGERS: Optional[Sequence[str]] = None
+
     def __init__(self, read: sqlglot.Dialect, write: sqlglot.Dialect):
         self._relations = {}
+        self._materialized: Dict[str, MaterializedRelation] = {}
+        # Parsed SQL of the relations that aren't dynamic, copied into each query
+        self._expressions: Dict[str, exp.Expression] = {}
+        self._dynamic = set()
         self._read = read
         self._write = write
+        self._last = threading.local()
+        self.db = None
+        self._catalog: Optional[str] = None
+        self._schema: Optional[str] = None
+        self._refresher: Optional[threading.Thread] = None
+        self._trigger: Optional[Pattern] = None
+        self._counts = {"fast_path": 0, "rewritten": 0}
+        self._counts_lock = threading.Lock()
+
+    def parsed(self, sql: str) -> Optional[List[exp.Expression]]:
+        """The statements parsed from `sql` by this thread's most recent call to rewrite, if any."""
+        last = getattr(self._last, "parsed", None)
+        if last and last[0] == sql:
+            return last[1]
+        return None
+
+    def relation(
+        self,
+        name: str,
+        ttl: Optional[float] = None,
+        refresh: Optional[float] = None,
+        dynamic: bool = False,
+    ) -> Callable[[DecoratedCallable], DecoratedCallable]:
+        """Registers a function returning the SQL for the relation `name`.
+
+        The function is called and its SQL parsed once, on first use, unless it is
+        `dynamic`, in which case it is called for every query that references it.
+        With a `ttl` or `refresh` interval (in seconds) the relation is materialized
+        into the DuckDB database passed to `materialize_into`, and rewrites read that
+        table until it expires. Without one the SQL is inlined into every query.
+        """
 
-    def relation(self, name: str) -> Callable[[DecoratedCallable], DecoratedCallable]:
         def decorator(func: DecoratedCallable) -> DecoratedCallable:
             self._relations[name] = func
+            self._expressions.pop(name, None)
+            self._trigger = None
+            if dynamic:
+                self._dynamic.add(name)
+            else:
+                self._dynamic.discard(name)
+            if ttl is not None or refresh is not None:
+                self._materialized[name] = MaterializedRelation(
+                    name, func, ttl, refresh
+                )
             return func
 
         return decorator
 
+    def materialize_into(self, db, schema: str = "bv_materialized"):
+        """Stores materialized relations as tables in `schema` of a DuckDB connection.
+
+        The database must be writable and be the one queries are run against, so that
+        the rewritten queries can read the tables. Relations with a `refresh` interval
+        are rebuilt by a background thread from here on.
+        """
+        db.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+        self._catalog = db.execute("SELECT current_database()").fetchone()[0]
+        self._schema = schema
+        self.db = db
+        if self._refresher is None:
+            self._refresher = threading.Thread(
+                target=self._refresh_forever, daemon=True
+            )
+            self._refresher.start()
+
+    def refresh(self, name: Optional[str] = None):
+        """Rebuilds the table for one materialized relation, or for all of them."""
+        names = [name] if name else list(self._materialized)
+        for n in names:
+            mat = self._materialized[n]
+            with mat.lock:
+                self._build(mat)
+
+    def _build(self, mat: MaterializedRelation):
+        sql = self._write.generate(exp.maybe_parse(mat.source()))
+        target = f'"{self._catalog}"."{self._schema}"."{mat.table}"'
+        cursor = self.db.cursor()
+        try:
+            cursor.execute(f"CREATE OR REPLACE TABLE {target} AS {sql}")
+        finally:
+            cursor.close()
+        mat.built_at = time.monotonic()
+        mat.builds += 1
+
+    def _refresh_forever(self):
+        while True:
+            time.sleep(1.0)
+            now = time.monotonic()
+            for mat in list(self._materialized.values()):
+                if not mat.due(now):
+                    continue
+                try:
+                    with mat.lock:
+                        self._build(mat)
+                except Exception:
+                    logger.exception("Error refreshing relation %s", mat.name)
+
+    def _materialized_table(self, name: str) -> Optional[exp.Table]:
+        """The table holding a materialized relation, building it if it has expired."""
+        mat = self._materialized.get(name)
+        if mat is None or self.db is None:
+            return None
+        if mat.expired(time.monotonic()):
+            with mat.lock:
+                if mat.expired(time.monotonic()):
+                    try:
+                        self._build(mat)
+                    except Exception:
+                        # Fall back to inlining the relation
+                        logger.exception("Error materializing relation %s", name)
+                        return None
+        return exp.table_(mat.table, db=self._schema, catalog=self._catalog)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._counts_lock:
+            ret: Dict[str, Any] = dict(self._counts)
+        ret["materialized"] = {
+            name: {
+                "builds": mat.builds,
+                "age_s": None if mat.built_at is None else now - mat.built_at,
+            }
+            for name, mat in self._materialized.items()
+        }
+        return ret
+
+    def _count(self, key: str):
+        with self._counts_lock:
+            self._counts[key] += 1
+
+    def needs_rewrite(self, sql: str) -> bool:
+        """Whether `sql` might name a relation or use SQL the dialects disagree on."""
+        if self.TRIGGERS is None:
+            return True
+        if self._trigger is None:
+            # Relations are matched on the table part of their names
+            names = {n.rsplit(".", 1)[-1] for n in self._relations}
+            words = [rf"\b{re.escape(n)}\b" for n in sorted(names)]
+            self._trigger = re.compile("|".join(words + list(self.TRIGGERS)), re.I)
+        return self._trigger.search(sql) is not None
+
     def rewrite(self, sql: str) -> str:
+        if not self.needs_rewrite(sql):
+            self._count("fast_path")
+            return sql
+        self._count("rewritten")
         try:
             stmts = self._read.parse(sql)
+            self._last.parsed = (sql, stmts)
             ret = []
             for stmt in stmts:
                 ret.append(self.rewrite_one(stmt))
@@ -35,8 +222,11 @@ class Rewriter:
             if isinstance(node, exp.Table):
                 name = exp.table_name(node)
                 if name in self._relations:
-                    source = self._relations[name]
-                    subquery = exp.paren(exp.maybe_parse(source()))
+                    table = self._materialized_table(name)
+                    if table is not None:
+                        alias = node.alias or node.name
+                        return exp.alias_(table, alias, table=True)
+                    subquery = exp.paren(self._source(name))
                     if node.alias:
                         subquery = exp.alias_(subquery, node.alias)
                     subquery.comments = [f"source: {name}"]
@@ -45,6 +235,16 @@ class Rewriter:
 
         return expression.transform(_expand, copy=True)
 
+    def _source(self, name: str) -> exp.Expression:
+        """A fresh copy of the parsed SQL for the relation `name`."""
+        if name in self._dynamic:
+            return exp.maybe_parse(self._relations[name]())
+        parsed = self._expressions.get(name)
+        if parsed is None:
+            parsed = exp.maybe_parse(self._relations[name]())
+            self._expressions[name] = parsed
+        return parsed.copy()
+
 
 if __name__ == "__main__":
     rewriter = Rewriter(sqlglot.dialects.Presto(), sqlglot.dialects.DuckDB())
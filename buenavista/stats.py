@@ -0,0 +1,200 @@
+import collections
+import hashlib
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+import sqlglot.expressions as exp
+
+from .core import BVType
+
+
+def _is_constant(node: exp.Expression) -> bool:
+    if isinstance(node, (exp.Literal, exp.Boolean, exp.Null)):
+        return True
+    return isinstance(node, exp.Neg) and isinstance(node.this, exp.Literal)
+
+
+def normalize(expression: exp.Expression) -> exp.Expression:
+    """Replaces the constants in a parsed statement with placeholders."""
+
+    def _strip(node: exp.Expression):
+        if isinstance(node, exp.In) and node.expressions:
+            # IN lists of different lengths are still the same statement
+            node.set("expressions", [exp.Placeholder()])
+            return node
+        elif _is_constant(node):
+            return exp.Placeholder()
+        return node
+
+    return expression.transform(_strip, copy=True)
+
+
+def _digest(node: Any, h) -> None:
+    if not isinstance(node, exp.Expression):
+        h.update(repr(node).encode("utf-8"))
+        return
+    if _is_constant(node):
+        h.update(b"?")
+        return
+    h.update(type(node).__name__.encode("utf-8"))
+    for key, value in node.args.items():
+        if value is None or value is False or value == []:
+            continue
+        h.update(key.encode("utf-8"))
+        if isinstance(node, exp.In) and key == "expressions":
+            h.update(b"[?]")
+        elif isinstance(value, list):
+            for v in value:
+                _digest(v, h)
+        else:
+            _digest(value, h)
+
+
+def fingerprint(statements: List[exp.Expression]) -> str:
+    """A stable identifier for parsed statements that ignores their constant values.
+
+    The tree is hashed directly, so no SQL has to be generated on the hot path.
+    """
+    h = hashlib.md5()
+    for stmt in statements:
+        if stmt:
+            _digest(stmt, h)
+            h.update(b";")
+    return h.hexdigest()[:16]
+
+
+def text_fingerprint(sql: str) -> str:
+    """A fingerprint for statements that were never parsed, from their normalized text."""
+    return hashlib.md5(_collapse(sql).encode("utf-8")).hexdigest()[:16]
+
+
+# Quoted identifiers, which are kept, then string and numeric literals
+_LITERALS = re.compile(
+    r"(\"(?:[^\"]|\"\")*\")|'(?:[^']|'')*'|(?<![\w$.])\d+(?:\.\d+)?(?:e[+-]?\d+)?",
+    re.I,
+)
+_IN_LIST = re.compile(r"\bIN\s*\(\s*-?\?(?:\s*,\s*-?\?)*\s*\)", re.I)
+
+
+def _collapse(sql: str) -> str:
+    """Replaces the literals in unparsed SQL with ? and normalizes its whitespace."""
+    sql = _LITERALS.sub(lambda m: m.group(1) or "?", sql)
+    sql = _IN_LIST.sub("IN (?)", sql)
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def normalize_sql(statements: List[exp.Expression]) -> str:
+    # Rendered in the default dialect so every front end shows ? for placeholders
+    return ";\n".join(normalize(s).sql(comments=False) for s in statements if s)
+
+
+def _percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, int(round(pct * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+STAT_STATEMENTS_COLUMNS = [
+    ("fingerprint", BVType.TEXT),
+    ("query", BVType.TEXT),
+    ("calls", BVType.BIGINT),
+    ("total_time_ms", BVType.FLOAT),
+    ("mean_time_ms", BVType.FLOAT),
+    ("p95_time_ms", BVType.FLOAT),
+    ("p99_time_ms", BVType.FLOAT),
+    ("rows", BVType.BIGINT),
+    ("rewrite_time_ms", BVType.FLOAT),
+]
+
+
+class _Entry:
+    def __init__(self, query: str, max_samples: int):
+        self.query = query
+        self.calls = 0
+        self.usage = 0.0
+        self.total_time_ms = 0.0
+        self.rows = 0
+        self.rewrite_time_ms = 0.0
+        self.samples = collections.deque(maxlen=max_samples)
+
+
+class StatementStatistics:
+    """Bounded, pg_stat_statements-style aggregates keyed by statement fingerprint.
+
+    When the table is full, the least-used ~5% of entries are evicted in one batch,
+    where usage is a call count that decays at every eviction. Older entries that
+    stopped being called decay below a statement that just arrived, so the newest
+    entry is not the next victim.
+    """
+
+    USAGE_DECAY = 0.99
+    DEALLOC_PERCENT = 5
+
+    def __init__(self, max_statements: int = 5000, max_samples: int = 1000):
+        self.max_statements = max_statements
+        self.max_samples = max_samples
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        sql: str,
+        elapsed_ms: float,
+        rows: int = 0,
+        rewrite_ms: float = 0.0,
+        statements: Optional[List[exp.Expression]] = None,
+    ):
+        fp = fingerprint(statements) if statements else text_fingerprint(sql)
+        with self._lock:
+            entry = self._entries.get(fp)
+            if entry is None:
+                if len(self._entries) >= self.max_statements:
+                    self._dealloc()
+                if statements:
+                    query = normalize_sql(statements)
+                else:
+                    query = _collapse(sql)
+                entry = _Entry(query, self.max_samples)
+                self._entries[fp] = entry
+            entry.calls += 1
+            entry.usage += 1.0
+            entry.total_time_ms += elapsed_ms
+            entry.rows += rows
+            entry.rewrite_time_ms += rewrite_ms
+            entry.samples.append(elapsed_ms)
+
+    def _dealloc(self):
+        by_usage = sorted(self._entries.items(), key=lambda kv: kv[1].usage)
+        for _, e in by_usage:
+            e.usage *= self.USAGE_DECAY
+        count = max(1, len(by_usage) * self.DEALLOC_PERCENT // 100)
+        for fp, _ in by_usage[:count]:
+            del self._entries[fp]
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            items = [(fp, e, list(e.samples)) for fp, e in self._entries.items()]
+        ret = []
+        for fp, e, samples in items:
+            ret.append(
+                {
+                    "fingerprint": fp,
+                    "query": e.query,
+                    "calls": e.calls,
+                    "total_time_ms": e.total_time_ms,
+                    "mean_time_ms": e.total_time_ms / e.calls,
+                    "p95_time_ms": _percentile(samples, 0.95),
+                    "p99_time_ms": _percentile(samples, 0.99),
+                    "rows": e.rows,
+                    "rewrite_time_ms": e.rewrite_time_ms,
+                }
+            )
+        return sorted(ret, key=lambda r: r["total_time_ms"], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
@@ -0,0 +1,147 @@
+import logging
+import os
+import random
+import re
+import signal
+import socket
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_TAG = re.compile(r"_w(\d+)$")
+
+
+class Worker:
+    """One of `count` processes serving the same port, each accepting a share of the
+    connections via SO_REUSEPORT.
+
+    State that outlives a single request, like a query whose pages are still being
+    fetched or an open transaction, lives in the worker that created it. Every worker
+    also listens on a private port, `private_port_base + index`, and ids for such
+    state are tagged with the worker's index so requests for it can be sent there.
+    """
+
+    def __init__(self, index: int, count: int, host: str, private_port_base: int):
+        self.index = index
+        self.count = count
+        self.host = host
+        self.private_port_base = private_port_base
+
+    @property
+    def private_port(self) -> int:
+        return self.private_port_of(self.index)
+
+    def private_port_of(self, index: int) -> int:
+        return self.private_port_base + index
+
+    def private_address(self, index: Optional[int] = None) -> Tuple[str, int]:
+        if index is None:
+            index = self.index
+        # A wildcard listen address isn't one we can connect to
+        host = "127.0.0.1" if self.host in ("", "0.0.0.0") else self.host
+        return host, self.private_port_of(index)
+
+    def tag(self, id: str) -> str:
+        return f"{id}_w{self.index}"
+
+    def owner(self, id: Optional[str]) -> Optional[int]:
+        """The index of the worker that tagged `id`, if it was tagged by a worker."""
+        m = _TAG.search(id) if id else None
+        return int(m.group(1)) if m else None
+
+    def is_remote(self, id: Optional[str]) -> bool:
+        owner = self.owner(id)
+        return owner is not None and owner != self.index
+
+    def tag_int(self, value: int, bits: int = 32) -> int:
+        """Folds the worker's index into an integer id of at most `bits` bits."""
+        return (value % ((1 << bits) // self.count)) * self.count + self.index
+
+    def random_id(self, bits: int = 32) -> int:
+        return self.tag_int(random.randint(0, (1 << bits) - 1), bits)
+
+    def owner_int(self, value: int) -> int:
+        return value % self.count
+
+
+def reuseport_socket(host: str, port: int, backlog: int = 128) -> socket.socket:
+    """A listening TCP socket that other processes can bind to the same port."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def supervise(
+    count: int,
+    run: Callable[[Worker], None],
+    host: str,
+    private_port_base: int,
+    restart: bool = True,
+    restart_delay: float = 1.0,
+):
+    """Forks `count` workers that each call `run` with their `Worker`, until they exit.
+
+    Workers that die are restarted unless `restart` is False. SIGTERM and SIGINT stop
+    every worker. Nothing that isn't fork-safe, like a DuckDB database or a thread,
+    should be opened before calling this; each worker opens its own in `run`.
+    """
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(index: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            code = 0
+            try:
+                run(Worker(index, count, host, private_port_base))
+            except BaseException:
+                logger.exception("Worker %d failed", index)
+                code = 1
+            finally:
+                os._exit(code)
+        logger.info("Started worker %d as pid %d", index, pid)
+        children[pid] = index
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    previous = {
+        s: signal.signal(s, stop) for s in (signal.SIGTERM, signal.SIGINT)
+    }
+    try:
+        for index in range(count):
+            spawn(index)
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = children.pop(pid, None)
+            if index is None:
+                continue
+            if restart and not stopping:
+                logger.warning(
+                    "Worker %d (pid %d) exited with status %d, restarting",
+                    index,
+                    pid,
+                    os.waitstatus_to_exitcode(status),
+                )
+                time.sleep(restart_delay)
+                if not stopping:
+                    spawn(index)
+    finally:
+        for s, handler in previous.items():
+            signal.signal(s, handler)
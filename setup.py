@@ -34,5 +34,6 @@ setup(
     extras_require={
         "duckdb": ["duckdb", "pyarrow"],
         "postgres": ["psycopg", "psycopg-pool"],
+        "zstd": ["zstandard"],
     },
 )
@@ -0,0 +1,78 @@
+import duckdb
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from buenavista.backends.duckdb import DuckDBManager
+from buenavista.examples.duckdb_http import rewriter
+from buenavista.http import main
+
+
+@pytest.fixture
+def tenants(tmp_path):
+    for name in ("acme", "globex", "initech"):
+        db = duckdb.connect(str(tmp_path / f"{name}.duckdb"))
+        db.execute(f"CREATE TABLE customer AS SELECT '{name}' AS tenant")
+        db.close()
+    return str(tmp_path)
+
+
+def tenant(sess) -> str:
+    return list(sess.execute_sql("SELECT tenant FROM customer").rows())[0][0]
+
+
+def test_sessions_open_their_database(tenants):
+    manager = DuckDBManager(tenants, default_database="acme")
+    a, b = manager.create_session("globex"), manager.create_session()
+    assert (tenant(a), tenant(b)) == ("globex", "acme")
+    # Sessions on the same database share its handle
+    c = manager.create_session("globex")
+    assert manager.stats()["databases"]["globex"] == {"sessions": 2}
+    assert manager.stats()["opened"] == 2
+    for sess in (a, b, c):
+        manager.close_session(sess)
+    assert manager.stats()["databases"]["globex"] == {"sessions": 0}
+
+    with pytest.raises(ValueError):
+        manager.create_session("../acme")
+    with pytest.raises(ValueError):
+        manager.create_session("umbrella")
+
+
+def test_least_recently_used_databases_are_closed(tenants):
+    manager = DuckDBManager(tenants, max_open=2)
+    a = manager.create_session("acme")
+    manager.close_session(manager.create_session("globex"))
+    manager.close_session(manager.create_session("initech"))
+    # acme is still in use, so globex goes
+    assert list(manager.stats()["databases"]) == ["acme", "initech"]
+    manager.close_session(a)
+
+    manager.idle_timeout = 0
+    assert manager.reap() == 2
+    assert manager.stats()["open"] == 0
+
+
+def test_catalog_header_picks_database(tenants):
+    app = FastAPI()
+    main.quacko(app, DuckDBManager(tenants), rewriter)
+    client = TestClient(app)
+    for name in ("initech", "acme"):
+        headers = {"x-trino-user": "test", "x-trino-catalog": name}
+        body = client.post(
+            "/v1/statement", content="SELECT tenant FROM customer", headers=headers
+        ).json()
+        rows = []
+        while body.get("nextUri"):
+            body = client.get(body["nextUri"], headers=headers).json()
+            rows.extend(body.get("data") or [])
+        assert rows == [[name]]
+
+
+def test_memory_budget(tenants):
+    manager = DuckDBManager(tenants, memory_budget=1)
+    manager.close_session(manager.create_session("acme"))
+    sess = manager.create_session("globex")
+    # Over budget, so only the database in use stays open
+    assert list(manager.stats()["databases"]) == ["globex"]
+    manager.close_session(sess)
@@ -0,0 +1,126 @@
+import datetime
+
+import duckdb
+import pytest
+
+from buenavista.backends.duckdb import DuckDBConnection
+from buenavista.backends.federated import FederatedConnection, Partition
+
+MONTHS = (1, 2, 3)
+
+
+def events(month: int) -> str:
+    return (
+        f"SELECT DATE '2023-0{month}-01' + (i % 28)::INTEGER AS day, i AS v, "
+        f"'k' || (i % 3) AS k FROM range({month * 100}) t(i)"
+    )
+
+
+@pytest.fixture(scope="module")
+def federated():
+    partitions = []
+    for m in MONTHS:
+        db = duckdb.connect()
+        db.execute(f"CREATE TABLE events AS {events(m)}")
+        low, high = datetime.date(2023, m, 1), datetime.date(2023, m, 28)
+        partitions.append(Partition(db, low, high))
+    conn = FederatedConnection()
+    conn.register_partitioned_table("events", "day", partitions)
+    return conn
+
+
+@pytest.fixture(scope="module")
+def reference():
+    db = duckdb.connect()
+    db.execute(
+        "CREATE TABLE events AS " + " UNION ALL ".join(events(m) for m in MONTHS)
+    )
+    return DuckDBConnection(db)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT count(*), sum(v) AS s, min(v), max(v), avg(v) FROM events",
+        "SELECT k, count(*) AS n, avg(v) AS a FROM events GROUP BY k ORDER BY k",
+        "SELECT k, count(*) AS n FROM events WHERE day >= '2023-02-15' "
+        "GROUP BY k HAVING count(*) > 10 ORDER BY n DESC",
+        "SELECT * FROM events WHERE day = '2023-03-05' ORDER BY v LIMIT 3",
+        "SELECT v FROM events ORDER BY v DESC LIMIT 2 OFFSET 1",
+        "SELECT k, v FROM events WHERE day BETWEEN '2023-01-01' AND '2023-01-02' "
+        "ORDER BY v",
+        "SELECT count(DISTINCT k) AS n FROM events",
+        "SELECT median(v) AS m FROM events WHERE day < '2023-02-01'",
+        "SELECT e.k, count(*) AS n FROM events e JOIN (SELECT 'k1' AS k) x "
+        "ON e.k = x.k GROUP BY e.k",
+        "SELECT count(*) AS n FROM events WHERE day > '2024-01-01'",
+        "WITH x AS (SELECT * FROM events ORDER BY v LIMIT 5) "
+        "SELECT count(*) AS n FROM x WHERE v > 100",
+        "SELECT count(*) AS n FROM (SELECT v * 2 AS w FROM events) t WHERE w > 5",
+        "SELECT count(*) AS n FROM (SELECT * FROM events) t WHERE t.v > 100",
+    ],
+)
+def test_matches_single_database(federated, reference, sql):
+    sess, ref = federated.create_session(), reference.create_session()
+    try:
+        qr, expected = sess.execute_sql(sql), ref.execute_sql(sql)
+        assert [qr.column(i)[0] for i in range(qr.column_count())] == [
+            expected.column(i)[0] for i in range(expected.column_count())
+        ]
+        got, want = list(qr.rows()), list(expected.rows())
+        if "ORDER BY" not in sql:
+            got, want = sorted(got), sorted(want)
+        assert got == want
+    finally:
+        federated.close_session(sess)
+        reference.close_session(ref)
+
+
+def test_plans_push_work_to_partitions(federated):
+    plan = federated.plan("SELECT k, avg(v) AS a FROM events GROUP BY k")
+    assert "GROUP BY" in plan.partial and "COUNT(v)" in plan.partial
+    assert "SUM" in plan.final
+
+    # Ordering on a column that isn't selected gathers the rows instead
+    plan = federated.plan("SELECT k FROM events ORDER BY v LIMIT 1")
+    assert plan.partial == "SELECT * FROM events"
+
+    assert federated.plan("SELECT 1") is None
+
+
+def test_partition_pruning(federated):
+    sess = federated.create_session()
+    try:
+        before = federated.stats()
+        qr = sess.execute_sql(
+            "SELECT count(*) FROM events WHERE day >= '2023-03-01' AND v < 10"
+        )
+        assert list(qr.rows()) == [[10]]
+        after = federated.stats()
+        assert after["scatters"] == before["scatters"] + 1
+        assert after["partitions_scanned"] == before["partitions_scanned"] + 1
+        assert after["partitions_pruned"] == before["partitions_pruned"] + 2
+    finally:
+        federated.close_session(sess)
+
+
+def test_pruning_with_mismatched_literals():
+    partitions = []
+    for low in (0, 100):
+        db = duckdb.connect()
+        db.execute(
+            f"CREATE TABLE items AS SELECT i AS id FROM range({low}, {low + 100}) t(i)"
+        )
+        partitions.append(Partition(db, low, low + 99))
+    conn = FederatedConnection()
+    conn.register_partitioned_table("items", "id", partitions)
+    sess = conn.create_session()
+    try:
+        qr = sess.execute_sql("SELECT count(*) FROM items WHERE id = '105'")
+        assert list(qr.rows()) == [[1]]
+        assert conn.stats()["partitions_pruned"] == 1
+        qr = sess.execute_sql("SELECT count(*) FROM items WHERE id < 5.5")
+        assert list(qr.rows()) == [[6]]
+        assert conn.stats()["partitions_pruned"] == 2
+    finally:
+        conn.close_session(sess)
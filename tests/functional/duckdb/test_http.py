@@ -1,12 +1,14 @@
 import pytest
 
 import duckdb
+import pyarrow as pa
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
 from buenavista.backends.duckdb import DuckDBConnection
 from buenavista.examples.duckdb_http import rewriter
 from buenavista.http import main
+from buenavista.workers import Worker
 
 
 @pytest.fixture(scope="session")
@@ -17,7 +19,7 @@ def db():
 @pytest.fixture(scope="session")
 def client(db):
     app = FastAPI()
-    main.quacko(app, DuckDBConnection(db), rewriter)
+    main.quacko(app, DuckDBConnection(db, profiling=True), rewriter)
     return TestClient(app)
 
 
@@ -33,3 +35,275 @@ def test_select(client):
         headers={"Content-Type": "application/json", "x-trino-user": "test"},
     )
     assert response.status_code == 200
+
+
+def run_statement(client, sql, headers={"x-trino-user": "test"}):
+    """Submits a statement and follows nextUri, returning the final body and all rows."""
+    body = client.post("/v1/statement", content=sql, headers=headers).json()
+    rows, pages, columns = [], 1, None
+    while body.get("nextUri"):
+        response = client.get(body["nextUri"], headers=headers)
+        assert response.status_code == 200
+        body = response.json()
+        if body.get("columns"):
+            columns = body["columns"]
+        rows.extend(body.get("data") or [])
+        pages += 1
+    body["columns"] = columns
+    return body, rows, pages
+
+
+def test_select_data(client):
+    response = client.post(
+        "/v1/statement", content="SELECT 1 AS a", headers={"x-trino-user": "test"}
+    )
+    assert response.status_code == 200
+    assert response.json()["stats"]["state"] == "QUEUED"
+    body, rows, _ = run_statement(client, "SELECT 1 AS a")
+    assert body["columns"][0]["name"] == "a"
+    assert body["stats"]["state"] == "FINISHED"
+    assert rows == [[1]]
+
+
+def test_select_error(client):
+    body, _, _ = run_statement(client, "SELECT * FROM no_such_table")
+    assert body["stats"]["state"] == "FAILED"
+    assert "no_such_table" in body["error"]["message"]
+
+
+def test_statement_stats(client):
+    body, rows, _ = run_statement(
+        client, "SELECT sum(i) AS total FROM range(100000) t(i)"
+    )
+    assert rows == [["4999950000"]]
+    stats = body["stats"]
+    assert stats["processedRows"] == 100000
+    assert stats["processedBytes"] > 0
+    assert stats["peakMemoryBytes"] >= 0
+
+
+def test_compressed_pages(client):
+    headers = {"x-trino-user": "test", "Accept-Encoding": "gzip"}
+    body = client.post(
+        "/v1/statement", content="SELECT i FROM range(10000) t(i)", headers=headers
+    ).json()
+    encodings, rows = set(), []
+    while body.get("nextUri"):
+        response = client.get(body["nextUri"], headers=headers)
+        encodings.add(response.headers.get("content-encoding"))
+        body = response.json()
+        rows.extend(body.get("data") or [])
+    assert len(rows) == 10000
+    assert encodings == {"gzip"}
+    # Small responses aren't worth compressing
+    response = client.post("/v1/statement", content="SELECT 1", headers=headers)
+    assert "content-encoding" not in response.headers
+
+
+def test_stat_statements(client):
+    run_statement(client, "SELECT 42")
+    response = client.get("/v1/bv/stat_statements")
+    assert response.status_code == 200
+    assert any(s["query"] == "SELECT ?" for s in response.json())
+
+
+@pytest.fixture(scope="session")
+def paged_client(db):
+    app = FastAPI()
+    main.quacko(app, DuckDBConnection(db), rewriter, page_rows=10)
+    return TestClient(app)
+
+
+def test_paged_results(paged_client):
+    body, rows, pages = run_statement(
+        paged_client, "SELECT * FROM range(25) t(i)", {"x-trino-user": "paged"}
+    )
+    # One queued response, then three pages of at most ten rows
+    assert pages == 4
+    assert rows == [[i] for i in range(25)]
+    assert body["stats"]["state"] == "FINISHED"
+
+
+def test_paged_results_retry_and_cancel(paged_client):
+    headers = {"x-trino-user": "paged"}
+    body = paged_client.post(
+        "/v1/statement", content="SELECT * FROM range(50) t(i)", headers=headers
+    ).json()
+    first = paged_client.get(body["nextUri"], headers=headers).json()
+    assert first["data"] == [[i] for i in range(10)]
+    # Retrying the same token returns the same page rather than skipping ahead
+    retry = paged_client.get(body["nextUri"], headers=headers).json()
+    assert retry["data"] == first["data"]
+    assert paged_client.delete(first["nextUri"]).status_code == 204
+    assert paged_client.get(first["nextUri"], headers=headers).status_code == 404
+
+
+def test_cancel_running_query(paged_client):
+    headers = {"x-trino-user": "cancel"}
+    body = paged_client.post(
+        "/v1/statement",
+        content="SELECT count(*) FROM range(10000000000) a(i)",
+        headers=headers,
+    ).json()
+    poll = paged_client.get(body["nextUri"], headers=headers).json()
+    assert poll["stats"]["state"] == "RUNNING"
+    assert paged_client.delete(poll["nextUri"]).status_code == 204
+    # The interrupted session goes back to the pool and can run the next statement
+    _, rows, _ = run_statement(paged_client, "SELECT 1", headers)
+    assert rows == [[1]]
+
+
+@pytest.mark.parametrize("compression", [None, "lz4", "zstd"])
+def test_arrow_stream(client, compression):
+    params = {"compression": compression} if compression else {}
+    response = client.post(
+        "/v1/bv/arrow",
+        content="SELECT i, 'row ' || i AS name FROM range(50000) t(i)",
+        params=params,
+        headers={"x-trino-user": "arrow"},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == main.ARROW_STREAM_MEDIA_TYPE
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column_names == ["i", "name"]
+    assert table.num_rows == 50000
+    assert table.column("name")[7].as_py() == "row 7"
+
+
+def test_arrow_stream_errors(client):
+    response = client.post("/v1/bv/arrow", content="SELECT * FROM no_such_table")
+    assert response.status_code == 400
+    assert "no_such_table" in response.json()["error"]
+    response = client.post("/v1/bv/arrow?compression=snappy", content="SELECT 1")
+    assert response.status_code == 400
+
+
+@pytest.fixture(scope="session")
+def spool_client(db, tmp_path_factory):
+    from buenavista.http.spool import Spool
+
+    app = FastAPI()
+    spool = Spool(str(tmp_path_factory.mktemp("spool")), segment_bytes=64 * 1024)
+    main.quacko(app, DuckDBConnection(db), rewriter, spool=spool)
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("data_encoding", ["parquet", "arrow"])
+def test_spooled_segments(spool_client, data_encoding):
+    import io
+
+    import pyarrow.parquet as pq
+
+    headers = {"x-trino-user": "spool", "x-trino-query-data-encoding": data_encoding}
+    body = spool_client.post(
+        "/v1/statement", content="SELECT i FROM range(100000) t(i)", headers=headers
+    ).json()
+    segments = []
+    while body.get("nextUri"):
+        body = spool_client.get(body["nextUri"], headers=headers).json()
+        if body.get("data"):
+            assert body["data"]["encoding"] == data_encoding
+            segments.extend(body["data"]["segments"])
+    assert body["stats"]["state"] == "FINISHED"
+    assert len(segments) > 1
+
+    total = 0
+    for seg in segments:
+        response = spool_client.get(seg["uri"])
+        assert response.status_code == 200
+        assert len(response.content) == seg["metadata"]["segmentSize"]
+        if data_encoding == "parquet":
+            table = pq.read_table(io.BytesIO(response.content))
+        else:
+            table = pa.ipc.open_file(response.content).read_all()
+        assert table.column("i")[0].as_py() == seg["metadata"]["rowOffset"]
+        total += table.num_rows
+
+        # Ranged reads of the same segment stitch back together
+        first = spool_client.get(seg["uri"], headers={"Range": "bytes=0-99"})
+        assert first.status_code == 206
+        rest = spool_client.get(seg["uri"], headers={"Range": "bytes=100-"})
+        assert first.content + rest.content == response.content
+
+        assert spool_client.delete(seg["uri"]).status_code == 204
+        assert spool_client.get(seg["uri"]).status_code == 404
+    assert total == 100000
+
+
+def test_spooled_segment_bad_requests(spool_client):
+    assert spool_client.get("/v1/spooled/segments/..%2Fetc%2Fpasswd").status_code == 404
+    assert spool_client.get("/v1/spooled/segments/" + "0" * 32 + ".arrow").status_code == 404
+
+
+def test_session_pool_stats(client):
+    run_statement(client, "SELECT 1", {"x-trino-user": "pool_stats"})
+    stats = client.get("/v1/bv/session_pools").json()
+    assert stats["users"]["pool_stats"]["idle"] == 1
+    assert stats["users"]["pool_stats"]["in_use"] == 0
+
+
+def test_prepared_statements(client):
+    from urllib.parse import quote_plus
+
+    headers = {"x-trino-user": "prepared"}
+    body, _, _ = run_statement(
+        client, "PREPARE q1 FROM SELECT i, ? AS label FROM range(10) t(i) WHERE i > ?", headers
+    )
+    assert body["stats"]["state"] == "FINISHED"
+
+    # Trino clients echo the statement back on every request that uses it
+    sql = "SELECT i, ? AS label FROM range(10) t(i) WHERE i > ?"
+    headers["x-trino-prepared-statement"] = f"q1={quote_plus(sql)}"
+    _, rows, _ = run_statement(client, "EXECUTE q1 USING 'big', 7", headers)
+    assert rows == [[8, "big"], [9, "big"]]
+    _, rows, _ = run_statement(client, "EXECUTE q1 USING NULL, -1", headers)
+    assert len(rows) == 10 and rows[0] == [0, None]
+    body, _, _ = run_statement(client, "EXECUTE q1 USING 'x', 1 + 1", headers)
+    assert "Unsupported parameter" in body["error"]["message"]
+
+    body, _, _ = run_statement(client, "EXECUTE missing USING 1", headers)
+    assert "Prepared statement not found" in body["error"]["message"]
+
+
+def test_prepare_headers(client):
+    headers = {"x-trino-user": "prepared"}
+    body = client.post(
+        "/v1/statement", content="PREPARE q2 FROM SELECT 1", headers=headers
+    ).json()
+    response = client.get(body["nextUri"], headers=headers)
+    assert response.headers["x-trino-added-prepare"] == "q2=SELECT+1"
+    body = client.post(
+        "/v1/statement", content="DEALLOCATE PREPARE q2", headers=headers
+    ).json()
+    response = client.get(body["nextUri"], headers=headers)
+    assert response.headers["x-trino-deallocated-prepare"] == "q2"
+
+
+@pytest.fixture(scope="session")
+def worker_client(db):
+    app = FastAPI()
+    worker = Worker(0, 2, "127.0.0.1", 9500)
+    main.quacko(app, DuckDBConnection(db), rewriter, worker=worker)
+    return TestClient(app, follow_redirects=False)
+
+
+def test_worker_routing(worker_client):
+    headers = {"x-trino-user": "test"}
+    body = worker_client.post("/v1/statement", content="SELECT 1", headers=headers)
+    next_uri = body.json()["nextUri"]
+    assert ":9500/" in next_uri and next_uri.split("/")[-2].endswith("_w0")
+
+    # Queries and transactions held by the other worker are sent to its private port
+    response = worker_client.get("/v1/statement/executing/123_w1/1", headers=headers)
+    assert response.status_code == 307
+    assert response.headers["location"].startswith("http://testserver:9501/")
+    response = worker_client.post(
+        "/v1/statement",
+        content="COMMIT",
+        headers={"x-trino-user": "test", "x-trino-transaction-id": "abc_w1"},
+    )
+    assert response.status_code == 307
+
+    body = worker_client.post("/v1/statement", content="BEGIN", headers=headers)
+    response = worker_client.get(body.json()["nextUri"], headers=headers)
+    assert response.headers["x-trino-started-transaction-id"].endswith("_w0")
@@ -0,0 +1,48 @@
+import duckdb
+import sqlglot
+
+from buenavista.rewrite import Rewriter
+
+
+def make_rewriter():
+    rewriter = Rewriter(sqlglot.dialects.Trino(), sqlglot.dialects.DuckDB())
+    calls = []
+
+    @rewriter.relation("system.jdbc.expensive", ttl=60)
+    def expensive():
+        calls.append(1)
+        return "SELECT i AS a FROM range(3) t(i)"
+
+    return rewriter, calls
+
+
+def test_materialized_relation_is_built_once():
+    rewriter, calls = make_rewriter()
+    db = duckdb.connect()
+    rewriter.materialize_into(db)
+
+    sql = rewriter.rewrite("SELECT e.a FROM system.jdbc.expensive e ORDER BY e.a")
+    assert "bv_materialized.bv_mat_system_jdbc_expensive AS e" in sql
+    assert db.execute(sql).fetchall() == [(0,), (1,), (2,)]
+    rewriter.rewrite("SELECT count(*) FROM system.jdbc.expensive")
+    assert len(calls) == 1
+    assert rewriter.stats()["materialized"]["system.jdbc.expensive"]["builds"] == 1
+
+
+def test_materialized_relation_expires():
+    rewriter, calls = make_rewriter()
+    db = duckdb.connect()
+    rewriter.materialize_into(db)
+    mat = rewriter._materialized["system.jdbc.expensive"]
+
+    rewriter.rewrite("SELECT * FROM system.jdbc.expensive")
+    mat.built_at -= 61
+    sql = rewriter.rewrite("SELECT count(*) FROM system.jdbc.expensive")
+    assert db.execute(sql).fetchall() == [(3,)]
+    assert len(calls) == 2
+
+
+def test_inlined_without_database():
+    rewriter, calls = make_rewriter()
+    sql = rewriter.rewrite("SELECT * FROM system.jdbc.expensive")
+    assert "source: system.jdbc.expensive" in sql
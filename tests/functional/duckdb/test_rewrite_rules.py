@@ -0,0 +1,60 @@
+import duckdb
+
+from buenavista.backends.duckdb import DuckDBConnection, RewriteRules
+from buenavista.core import BVType
+
+
+def test_rules_apply_together():
+    rules = (
+        RewriteRules()
+        .add_exact("BEGIN READ ONLY", "BEGIN")
+        .add_substring("::regclass", "")
+        .add_substring("pg_catalog.generate_series", "generate_series")
+        .add_substring("pg_catalog.generate_series_int", "range")
+    )
+    assert rules.apply("BEGIN READ ONLY") == "BEGIN"
+    assert (
+        rules.apply("SELECT 'a'::regclass, * FROM pg_catalog.generate_series(1, 2)")
+        == "SELECT 'a', * FROM generate_series(1, 2)"
+    )
+    # The longest matching rule wins
+    assert rules.apply("SELECT pg_catalog.generate_series_int(1)") == "SELECT range(1)"
+    assert rules.apply("SELECT 1") == "SELECT 1"
+    assert rules.stats() == {
+        "BEGIN READ ONLY": 1,
+        "::regclass": 1,
+        "pg_catalog.generate_series": 1,
+        "pg_catalog.generate_series_int": 1,
+    }
+
+
+def test_session_rules():
+    conn = DuckDBConnection(duckdb.connect())
+    sess = conn.create_session()
+    try:
+        qr = sess.execute_sql("SELECT count(*) FROM pg_catalog.generate_series(1, 3)")
+        assert list(qr.rows()) == [[3]]
+
+        sess.rules = RewriteRules().add_exact("SELECT version()", "SELECT 'bv'")
+        assert list(sess.execute_sql("SELECT version()").rows()) == [["bv"]]
+    finally:
+        conn.close_session(sess)
+
+
+def test_relations_register_by_name():
+    conn = DuckDBConnection(duckdb.connect())
+    calls = []
+
+    def rows():
+        calls.append(1)
+        return [{"i": 1}]
+
+    conn.register_relation("t", [("i", BVType.INTEGER)], rows)
+    sess = conn.create_session()
+    try:
+        sess.execute_sql("SELECT 'total' AS tt")
+        assert calls == []
+        assert list(sess.execute_sql("SELECT i FROM T").rows()) == [[1]]
+        assert calls == [1]
+    finally:
+        conn.close_session(sess)
@@ -0,0 +1,90 @@
+import duckdb
+import pytest
+
+from buenavista.backends.duckdb import DuckDBConnection
+from buenavista.backends.routing import (
+    READ,
+    SESSION,
+    TRANSACTION,
+    WRITE,
+    RoutingConnection,
+    classify,
+)
+
+
+@pytest.mark.parametrize(
+    "sql,kind",
+    [
+        ("SELECT * FROM t", READ),
+        ("WITH x AS (SELECT 1) SELECT * FROM x", READ),
+        ("(SELECT 1) UNION (SELECT 2)", READ),
+        ("EXPLAIN SELECT 1", READ),
+        ("EXPLAIN ANALYZE SELECT 1", WRITE),
+        ("INSERT INTO t VALUES (1)", WRITE),
+        ("SELECT * INTO u FROM t", WRITE),
+        ("SELECT nextval('seq')", WRITE),
+        ("CREATE TABLE u (i INTEGER)", WRITE),
+        ("SELECT 1; DELETE FROM t", WRITE),
+        ("not sql at all ((", WRITE),
+        ("BEGIN", TRANSACTION),
+        ("start transaction", TRANSACTION),
+        ("COMMIT", TRANSACTION),
+        ("SET search_path = 'main'", SESSION),
+    ],
+)
+def test_classify(sql, kind):
+    assert classify(sql, "duckdb") == kind
+
+
+def make_db(name: str):
+    db = duckdb.connect()
+    db.execute(f"CREATE TABLE t AS SELECT '{name}' AS source")
+    return db
+
+
+@pytest.fixture
+def routing():
+    conn = RoutingConnection(
+        DuckDBConnection(make_db("primary")),
+        [DuckDBConnection(make_db("r0")), DuckDBConnection(make_db("r1"))],
+        dialect="duckdb",
+    )
+    return conn
+
+
+def source(sess) -> str:
+    return list(sess.execute_sql("SELECT source FROM t").rows())[0][0]
+
+
+def test_reads_go_to_least_loaded_replica(routing):
+    a, b = routing.create_session(), routing.create_session()
+    # a's result is still open, so b's read goes to the other replica
+    assert {source(a), source(b)} == {"r0", "r1"}
+    assert routing.stats()["in_flight"] == [1, 1]
+    assert source(a) in ("r0", "r1")
+    routing.close_session(a)
+    routing.close_session(b)
+    assert routing.stats()["in_flight"] == [0, 0]
+    assert routing.stats()["replicas"] == [2, 1]
+
+
+def test_writes_and_transactions_stay_on_primary(routing):
+    sess = routing.create_session()
+    sess.execute_sql("INSERT INTO t VALUES ('written')")
+    sess.execute_sql("BEGIN")
+    assert sess.in_transaction()
+    assert source(sess) == "primary"
+    sess.execute_sql("COMMIT")
+    assert source(sess) in ("r0", "r1")
+    stats = routing.stats()
+    assert stats["primary"] == 4
+    assert stats["statements"] == {READ: 2, WRITE: 1, TRANSACTION: 2}
+    routing.close_session(sess)
+
+
+def test_session_settings_reach_replicas(routing):
+    sess = routing.create_session()
+    sess.execute_sql("SET threads = 1")
+    rows = list(sess.execute_sql("SELECT current_setting('threads')").rows())
+    assert rows == [[1]]
+    routing.close_session(sess)
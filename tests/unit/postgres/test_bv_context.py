@@ -79,3 +79,25 @@ def test_bv_context_sync(bv_context):
     bv_context.mark_error()
     bv_context.sync()
     assert bv_context.has_error is False
+
+
+def test_bv_context_state(bv_context, mock_session):
+    assert bv_context.state() == "idle"
+
+    bv_context.begin_query("SELECT 1")
+    assert bv_context.state() == "active"
+    assert bv_context.query == "SELECT 1"
+
+    bv_context.end_query(rows=3)
+    assert bv_context.rows_sent == 3
+    mock_session.in_transaction.return_value = True
+    assert bv_context.state() == "idle in transaction"
+
+
+def test_bv_context_activity(bv_context):
+    bv_context.add_statement("stmt1", "SELECT 1", [])
+    activity = bv_context.activity()
+    assert activity["pid"] == bv_context.process_id
+    assert activity["state"] == "idle"
+    assert activity["prepared_statements"] == 1
+    assert activity["cached_portal_bytes"] == 0
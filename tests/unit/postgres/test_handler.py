@@ -52,3 +52,12 @@ def test_handle_parse(mock_handler):
 
 
 # Add more test cases for other methods in the BuenaVistaHandler class
+
+
+def test_handle_query_send_failure_not_recorded(mock_handler):
+    ctx = MagicMock(spec=BVContext)
+    ctx.execute_sql.return_value = SimpleQueryResult("col1", 1, BVType.INTEGER)
+    mock_handler.send_data_rows = MagicMock(side_effect=BrokenPipeError())
+    with pytest.raises(BrokenPipeError):
+        mock_handler.handle_query(ctx, b"SELECT 1;\x00")
+    ctx.end_query.assert_called_once_with(failed=True)
@@ -0,0 +1,49 @@
+import decimal
+
+import pyarrow as pa
+
+from buenavista.arrow import record_batches
+from buenavista.core import BVType, QueryResult
+
+
+class RowsQueryResult(QueryResult):
+    def __init__(self, columns, rows):
+        super().__init__()
+        self.columns = columns
+        self._rows = rows
+
+    def has_results(self):
+        return True
+
+    def column_count(self):
+        return len(self.columns)
+
+    def column(self, index):
+        return self.columns[index]
+
+    def rows(self):
+        return iter(self._rows)
+
+    def status(self):
+        return "SELECT"
+
+
+def test_record_batches_from_rows():
+    qr = RowsQueryResult(
+        [("id", BVType.BIGINT), ("price", BVType.DECIMAL), ("tags", BVType.JSON)],
+        [[i, decimal.Decimal(f"{i}.50"), {"i": i}] for i in range(5)],
+    )
+    schema, batches = record_batches(qr, batch_size=2)
+    batches = list(batches)
+    assert [rb.num_rows for rb in batches] == [2, 2, 1]
+    assert schema.field("id").type == pa.int64()
+    table = pa.Table.from_batches(batches, schema)
+    assert table.column("price").to_pylist()[1] == "1.50"
+    assert table.column("tags").to_pylist()[4] == '{"i": 4}'
+
+
+def test_record_batches_empty():
+    qr = RowsQueryResult([("id", BVType.BIGINT)], [])
+    schema, batches = record_batches(qr)
+    assert schema.names == ["id"]
+    assert list(batches) == []
@@ -0,0 +1,113 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from buenavista.catalog import CatalogCache
+from buenavista.core import BVType, Session, SimpleQueryResult
+from buenavista.postgres import BVContext
+
+TYPES = "SELECT oid, typname FROM pg_catalog.pg_type"
+
+
+@pytest.fixture
+def session():
+    session = MagicMock(spec=Session)
+    session.in_transaction.return_value = False
+    session.execute_sql.side_effect = lambda sql, params=None: SimpleQueryResult(
+        "typname", "int4", BVType.TEXT
+    )
+    return session
+
+
+@pytest.fixture
+def cache():
+    return CatalogCache()
+
+
+def make_context(session, cache, database="memory"):
+    params = {"user": "postgres", "database": database}
+    return BVContext(session=session, rewriter=None, params=params, catalog_cache=cache)
+
+
+def test_cacheable(cache):
+    assert cache.cacheable(TYPES)
+    assert cache.cacheable("select * from information_schema.tables")
+    assert not cache.cacheable("SELECT * FROM t")
+    assert not cache.cacheable("SELECT current_schema(), * FROM pg_catalog.pg_class")
+    assert not cache.cacheable("SELECT * FROM pg_catalog.pg_stat_activity")
+
+    cache.register(r"\bduckdb_tables\s*\(")
+    assert cache.cacheable("SELECT * FROM duckdb_tables()")
+    cache.exclude(r"\bpg_class\b")
+    assert not cache.cacheable("SELECT * FROM pg_catalog.pg_class")
+
+
+def test_replays_introspection_queries(session, cache):
+    first, second = make_context(session, cache), make_context(session, cache)
+    assert list(first.execute_sql(TYPES).rows()) == [["int4"]]
+    qr = second.execute_sql(TYPES, result_fmt=[1])
+    assert list(qr.rows()) == [["int4"]]
+    assert qr.column(0) == ("typname", BVType.TEXT)
+    assert qr.result_format == [1]
+    assert session.execute_sql.call_count == 1
+
+    # Other databases have their own catalogs
+    make_context(session, cache, database="other").execute_sql(TYPES)
+    assert session.execute_sql.call_count == 2
+    assert cache.stats()["hits"] == 1
+
+
+def test_ddl_invalidates(session, cache):
+    ctx = make_context(session, cache)
+    ctx.execute_sql(TYPES)
+    ctx.execute_sql("CREATE TABLE t (i INTEGER)")
+    ctx.execute_sql(TYPES)
+    assert session.execute_sql.call_count == 3
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_ddl_in_transaction(session, cache):
+    ctx, other = make_context(session, cache), make_context(session, cache)
+    session.in_transaction.return_value = True
+    ctx.execute_sql("CREATE TABLE t (i INTEGER)")
+    ctx.execute_sql(TYPES)
+    ctx.execute_sql(TYPES)
+    assert session.execute_sql.call_count == 3
+
+    session.in_transaction.return_value = False
+    other.execute_sql(TYPES)
+    ctx.execute_sql("COMMIT")
+    other.execute_sql(TYPES)
+    assert session.execute_sql.call_count == 6
+    assert cache.stats()["invalidations"] == 2
+
+
+def test_search_path_bypasses(session, cache):
+    ctx = make_context(session, cache)
+    ctx.execute_sql("SET search_path = 'other'")
+    ctx.execute_sql(TYPES)
+    ctx.execute_sql(TYPES)
+    assert session.execute_sql.call_count == 3
+
+
+def test_temp_objects_bypass(session, cache):
+    ctx, other = make_context(session, cache), make_context(session, cache)
+    other.execute_sql(TYPES)
+    ctx.execute_sql("CREATE TEMP TABLE t (i INTEGER)")
+    other.execute_sql(TYPES)
+    ctx.execute_sql(TYPES)
+    ctx.execute_sql(TYPES)
+    assert session.execute_sql.call_count == 5
+    assert cache.stats()["hits"] == 0
+    assert cache.personalizes("create or replace temporary view v AS SELECT 1")
+
+
+def test_results_in_transaction_not_kept(session, cache):
+    ctx = make_context(session, cache)
+    session.in_transaction.return_value = True
+    ctx.execute_sql(TYPES)
+    assert cache.stats()["entries"] == 0
+
+    session.in_transaction.return_value = False
+    ctx.execute_sql(TYPES)
+    assert cache.stats()["entries"] == 1
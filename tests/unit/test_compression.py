@@ -0,0 +1,67 @@
+import gzip
+import json
+
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from fastapi.testclient import TestClient
+
+from buenavista.http.compression import CompressionMiddleware, negotiate
+
+
+def test_negotiate():
+    assert negotiate(None, ["gzip"]) is None
+    assert negotiate("gzip, deflate", ["zstd", "gzip"]) == "gzip"
+    assert negotiate("gzip, zstd", ["zstd", "gzip"]) == "zstd"
+    assert negotiate("gzip;q=1.0, zstd;q=0.5", ["zstd", "gzip"]) == "gzip"
+    assert negotiate("gzip;q=0", ["gzip"]) is None
+    assert negotiate("*", ["zstd", "gzip"]) == "zstd"
+    assert negotiate("br", ["gzip"]) is None
+
+
+def make_client() -> TestClient:
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    big = [{"id": i, "name": f"name_{i}"} for i in range(1000)]
+
+    @app.get("/small")
+    def small():
+        return JSONResponse({"ok": True})
+
+    @app.get("/big")
+    def big_json():
+        return JSONResponse(big)
+
+    @app.get("/text")
+    def text():
+        return PlainTextResponse("x" * 10_000)
+
+    @app.get("/stream")
+    def stream():
+        chunks = (json.dumps(big[i : i + 100]).encode() for i in range(0, 1000, 100))
+        return StreamingResponse(chunks, media_type="application/json")
+
+    return TestClient(app)
+
+
+def test_compresses_large_json_only():
+    client = make_client()
+    headers = {"Accept-Encoding": "gzip"}
+    response = client.get("/big", headers=headers)
+    assert response.headers["content-encoding"] == "gzip"
+    assert "accept-encoding" in response.headers["vary"].lower()
+    assert int(response.headers["content-length"]) < len(response.content)
+    assert len(response.json()) == 1000
+
+    assert "content-encoding" not in client.get("/small", headers=headers).headers
+    assert "content-encoding" not in client.get("/text", headers=headers).headers
+    identity = client.get("/big", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in identity.headers
+
+
+def test_compresses_streams():
+    client = make_client()
+    with client.stream("GET", "/stream", headers={"Accept-Encoding": "gzip"}) as r:
+        assert r.headers["content-encoding"] == "gzip"
+        raw = b"".join(r.iter_raw())
+    chunks = gzip.decompress(raw).decode()
+    assert chunks.count("name_999") == 1
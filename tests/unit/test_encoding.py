@@ -0,0 +1,115 @@
+import datetime
+import decimal
+import json
+
+import pyarrow as pa
+from fastapi.encoders import jsonable_encoder
+
+from buenavista.core import BVType
+from buenavista.http import arrow, encoding, schemas, type_mapping
+
+SAMPLES = {
+    BVType.BIGINT: [0, -12345678901234, None],
+    BVType.INTEGER: [0, 42, None],
+    BVType.FLOAT: [0.0, 1.5, -2.25e-10, None],
+    BVType.BOOL: [True, False, None],
+    BVType.TEXT: ["", "plain", 'quote " and \\ slash', "tab\tnewline\n", "ünïcödé", None],
+    BVType.DECIMAL: [decimal.Decimal("0"), decimal.Decimal("-12.3400"), None],
+    BVType.DATE: [datetime.date(2023, 1, 2), None],
+    BVType.TIME: [datetime.time(0, 0), datetime.time(12, 34, 56, 789), None],
+    BVType.TIMESTAMP: [datetime.datetime(2023, 1, 2, 3, 4, 5, 6), None],
+    BVType.JSON: ['{"a": 1}', None],
+}
+
+
+def test_json_encoders_match_generic_path():
+    for bvtype, values in SAMPLES.items():
+        convert = type_mapping.type_converter(bvtype)
+        encode = type_mapping.json_encoder(bvtype)
+        for v in values:
+            expected = json.dumps(jsonable_encoder(convert(v)), ensure_ascii=False)
+            assert encode(v) == expected, (bvtype, v)
+
+
+def test_non_finite_floats_are_valid_json():
+    encode = type_mapping.json_encoder(BVType.FLOAT)
+    values = [float("nan"), float("inf"), float("-inf")]
+
+    def strict(token):
+        raise ValueError(f"{token} is not JSON")
+
+    assert [json.loads(encode(v), parse_constant=strict) for v in values] == [
+        "NaN",
+        "Infinity",
+        "-Infinity",
+    ]
+
+
+def test_encode_query_result():
+    cols = [schemas.Column(name="a", type="bigint"), schemas.Column(name="b", type="varchar")]
+    encode_row = encoding.row_encoder(
+        [type_mapping.json_encoder(BVType.BIGINT), type_mapping.json_encoder(BVType.TEXT)]
+    )
+    result = schemas.QueryResult(
+        id="q1",
+        info_uri="http://127.0.0.1/info",
+        stats=schemas.StatementStats(state="FINISHED", elapsed_time_millis=3),
+    )
+    body = encoding.encode_query_result(
+        result,
+        encoding.render_columns(cols),
+        [encode_row([1, "x"]), encode_row([None, 'y"'])],
+    )
+    expected = jsonable_encoder(
+        result.model_copy(update={"columns": cols, "data": [[1, "x"], [None, 'y"']]})
+    )
+    assert json.loads(body) == expected
+
+
+def test_arrow_encode_batch_matches_row_encoders():
+    rb = pa.record_batch(
+        {
+            "i": pa.array([1, None, -3], pa.int64()),
+            "f": pa.array([1.5, float("nan"), float("-inf")]),
+            "b": pa.array([True, False, None]),
+            "s": pa.array(['say "hi"\n', None, "back\\slash\ttab"]),
+            "c": pa.array(["bell\x07", "ünï", ""]),
+            "d": pa.array([decimal.Decimal("-12.34"), None, decimal.Decimal("0.50")]),
+            "dt": pa.array([datetime.date(2023, 1, 2), None, datetime.date(1999, 12, 31)]),
+            "l": pa.array([[1, 2], None, []]),
+            "w": pa.array([1.0, -0.0, 1e16]),
+            "t": pa.array(
+                [datetime.time(12), datetime.time(1, 2, 3, 4), None], pa.time64("us")
+            ),
+            "ts": pa.array(
+                [
+                    datetime.datetime(2020, 1, 1, 1, 2, 3),
+                    datetime.datetime(2020, 1, 1, 1, 2, 3, 500),
+                    None,
+                ],
+                pa.timestamp("us"),
+            ),
+            "tz": pa.array(
+                [datetime.datetime(2020, 1, 1, 1, 2, 3), None, None],
+                pa.timestamp("us", tz="UTC"),
+            ),
+        }
+    )
+    bvtypes = [
+        BVType.BIGINT,
+        BVType.FLOAT,
+        BVType.BOOL,
+        BVType.TEXT,
+        BVType.TEXT,
+        BVType.DECIMAL,
+        BVType.DATE,
+        BVType.INTEGERARRAY,
+        BVType.FLOAT,
+        BVType.TIME,
+        BVType.TIMESTAMP,
+        BVType.TIMESTAMP,
+    ]
+    encoders = [type_mapping.json_encoder(t) for t in bvtypes]
+    expected = [encoding.row_encoder(encoders)(r) for r in zip(*rb.to_pydict().values())]
+    actual = arrow.encode_batch(rb, bvtypes)
+    assert actual == expected
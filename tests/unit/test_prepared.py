@@ -0,0 +1,56 @@
+import datetime
+import decimal
+
+from buenavista.http import prepared
+
+
+def test_statement_patterns():
+    m = prepared.PREPARE.match("PREPARE q1 FROM\n  SELECT * FROM t WHERE a = ?;")
+    assert m.groups() == ("q1", "SELECT * FROM t WHERE a = ?")
+    assert prepared.EXECUTE.match("execute q1").groups() == ("q1", None)
+    assert prepared.EXECUTE.match("EXECUTE q1 USING 1, 'a'").groups() == ("q1", "1, 'a'")
+    assert prepared.DEALLOCATE.match("DEALLOCATE PREPARE q1").group(1) == "q1"
+    assert prepared.EXECUTE.match("SELECT 1") is None
+
+
+def test_parse_header():
+    header = prepared.encode_header("q1", "SELECT a, b FROM t WHERE c = ?")
+    assert prepared.parse_header([header, "q2=SELECT+2"]) == {
+        "q1": "SELECT a, b FROM t WHERE c = ?",
+        "q2": "SELECT 2",
+    }
+
+
+def test_parse_params():
+    params = prepared.parse_params(
+        "1, -2.50, 'it''s', true, NULL, DATE '2023-01-02', TIMESTAMP '2023-01-02 03:04:05'"
+    )
+    assert params == [
+        1,
+        decimal.Decimal("-2.50"),
+        "it's",
+        True,
+        None,
+        datetime.date(2023, 1, 2),
+        datetime.datetime(2023, 1, 2, 3, 4, 5),
+    ]
+    assert prepared.parse_params(None) == []
+
+
+def test_cache_rewrites_once_per_text():
+    calls = []
+
+    def rewrite(sql):
+        calls.append(sql)
+        return sql.lower()
+
+    cache = prepared.PreparedStatements(rewrite, max_size=2)
+    assert cache.get("u", "q1", "SELECT 1") == "select 1"
+    assert cache.get("u", "q1", "SELECT 1") == "select 1"
+    assert calls == ["SELECT 1"]
+    # A client that re-prepares q1 with new text gets the new statement
+    assert cache.get("u", "q1", "SELECT 2") == "select 2"
+    cache.get("u", "q2", "SELECT 3")
+    cache.get("v", "q1", "SELECT 4")
+    assert ("u", "q1") not in cache.cache
+    assert (cache.hits, cache.misses) == (1, 4)
@@ -0,0 +1,150 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+
+from buenavista.core import BVType, QueryResult
+from buenavista.http.queries import (
+    CANCELED,
+    FAILED,
+    FINISHED,
+    QUEUED,
+    ActiveQueries,
+    ActiveQuery,
+)
+
+
+class RangeQueryResult(QueryResult):
+    def __init__(self, n: int):
+        super().__init__()
+        self.n = n
+
+    def has_results(self):
+        return True
+
+    def column_count(self):
+        return 1
+
+    def column(self, index):
+        return ("i", BVType.BIGINT)
+
+    def rows(self):
+        return iter([[i] for i in range(self.n)])
+
+    def status(self):
+        return "SELECT"
+
+
+def make_query(n: int, on_finish=None) -> ActiveQuery:
+    def execute(q):
+        q.attach(MagicMock())
+        qr = RangeQueryResult(n)
+        q.succeeded(qr, [], map(json.dumps, qr.rows()))
+
+    q = ActiveQuery("q", on_finish)
+    q.run(execute)
+    return q
+
+
+def rows(page):
+    return [json.loads(r) for r in page.data], page.done
+
+
+def test_page_by_rows_and_bytes():
+    q = make_query(10)
+    assert rows(q.page(0, 4, 1 << 20)) == ([[0], [1], [2], [3]], False)
+    # Each encoded row is three bytes, so this page stops after the second
+    assert rows(q.page(1, 100, 6)) == ([[4], [5]], False)
+    page = q.page(2, 100, 1 << 20)
+    assert rows(page) == ([[6], [7], [8], [9]], True)
+    assert page.state == FINISHED
+    q.ctx.close.assert_called_once()
+
+
+def test_page_retry_and_bad_token():
+    q = make_query(10)
+    first = q.page(0, 5, 1 << 20)
+    assert q.page(0, 5, 1 << 20) is first
+    assert q.page(5, 5, 1 << 20) is None
+
+
+def test_exact_page_boundary_finishes():
+    finished = []
+    q = make_query(5, finished.append)
+    assert rows(q.page(0, 5, 1 << 20)) == ([[i] for i in range(5)], True)
+    assert finished == [q]
+
+
+def test_queued_and_failed():
+    q = ActiveQuery("q")
+    assert q.page(0, 10, 1 << 20).state == QUEUED
+
+    def fail(q):
+        q.attach(MagicMock())
+        raise Exception("boom")
+
+    q.run(fail)
+    page = q.page(1, 10, 1 << 20)
+    assert page.state == FAILED and page.done
+    assert q.error == "boom"
+    q.ctx.close.assert_called_once()
+
+
+def test_cancel_queued_never_runs():
+    q = ActiveQuery("q")
+    q.cancel()
+    q.run(lambda q: pytest.fail("canceled query ran"))
+    assert q.page(0, 10, 1 << 20).state == CANCELED
+
+
+def test_cancel_running_interrupts_session():
+    ctx = MagicMock()
+
+    def execute(q):
+        q.attach(ctx)
+        q.cancel()
+        ctx.session().cancel.assert_called_once()
+        # The interrupted backend call raises; the session is only released after
+        ctx.close.assert_not_called()
+        raise Exception("interrupted")
+
+    q = ActiveQuery("q")
+    q.run(execute)
+    assert q.state == CANCELED
+    ctx.close.assert_called_once()
+
+
+def test_reap_abandoned():
+    active = ActiveQueries(timeout=60)
+    q = make_query(100)
+    active.add(q)
+    q.page(0, 10, 1 << 20)
+    assert active.reap() == 0
+    q.last_access -= 120
+    assert active.reap() == 1
+    assert len(active) == 0
+    q.ctx.close.assert_called_once()
+
+
+def test_stats_from_backend_profile():
+    class ProfiledResult(RangeQueryResult):
+        def profile(self):
+            return {"rows_scanned": 1000, "cpu_time_ms": 12.4, "peak_memory_bytes": 4096}
+
+    def execute(q):
+        q.attach(MagicMock())
+        qr = ProfiledResult(3)
+        q.succeeded(qr, [], map(json.dumps, qr.rows()))
+
+    q = ActiveQuery("q")
+    q.run(execute)
+    q.page(0, 2, 1 << 20)
+    # The profile is only read once the query finishes
+    assert q.stats()["processed_rows"] == 2
+    assert q.stats()["processed_bytes"] == 6
+    q.page(1, 2, 1 << 20)
+    stats = q.stats()
+    assert stats["processed_rows"] == 1000
+    assert stats["processed_bytes"] == 9
+    assert stats["cpu_time_millis"] >= 12
+    assert stats["peak_memory_bytes"] == 4096
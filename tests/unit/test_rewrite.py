@@ -42,3 +42,57 @@ def test_rewrite_with_exception(rewriter):
     faulty_sql = "SELECT * FRO test_relation"  # Typo in SQL
     rewritten_sql = rewriter.rewrite(faulty_sql)
     assert rewritten_sql == faulty_sql
+
+
+
+def test_relation_parsed_once(rewriter):
+    calls = []
+
+    @rewriter.relation("static_relation")
+    def static():
+        calls.append(1)
+        return "SELECT 1 AS a"
+
+    first = rewriter.rewrite("SELECT a FROM static_relation")
+    second = rewriter.rewrite("SELECT a FROM static_relation AS s")
+    assert first == "SELECT a FROM (SELECT 1 AS a) /* source: static_relation */"
+    assert second == "SELECT a FROM (SELECT 1 AS a) AS s /* source: static_relation */"
+    assert len(calls) == 1
+
+
+def test_dynamic_relation(rewriter):
+    values = iter(["1", "2"])
+
+    @rewriter.relation("dynamic_relation", dynamic=True)
+    def dynamic():
+        return f"SELECT {next(values)} AS a"
+
+    assert "SELECT 1 AS a" in rewriter.rewrite("SELECT a FROM dynamic_relation")
+    assert "SELECT 2 AS a" in rewriter.rewrite("SELECT a FROM dynamic_relation")
+
+
+def test_fast_path_skips_parsing():
+    class FastRewriter(Rewriter):
+        TRIGGERS = (r"\bnow\b",)
+
+    rewriter = FastRewriter(read=sqlglot.Dialect(), write=sqlglot.Dialect())
+
+    @rewriter.relation("bv_catalog.stat_activity")
+    def stat_activity():
+        return "SELECT 1 AS pid"
+
+    # Left exactly as written, where parsing would have reformatted it
+    assert rewriter.rewrite("select  a from t") == "select  a from t"
+    assert rewriter.parsed("select  a from t") is None
+    assert rewriter.rewrite("select now()") == "SELECT NOW()"
+    assert "source: bv_catalog.stat_activity" in rewriter.rewrite(
+        "select * from bv_catalog.stat_activity"
+    )
+    stats = rewriter.stats()
+    assert stats["fast_path"] == 1
+    assert stats["rewritten"] == 2
+
+
+def test_fast_path_off_by_default(rewriter):
+    assert rewriter.rewrite("select  a from t") == "SELECT a FROM t"
+    assert rewriter.stats()["fast_path"] == 0
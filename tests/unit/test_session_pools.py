@@ -0,0 +1,169 @@
+import threading
+
+import pytest
+
+from buenavista.core import Connection, Session
+from starlette.requests import Request
+
+from buenavista.http.context import Context, PoolExhausted, SessionPools
+
+
+class FakeSession(Session):
+    def __init__(self):
+        super().__init__()
+        self.closed = False
+        self.executed = []
+
+    def close(self):
+        self.closed = True
+
+    def execute_sql(self, sql: str, params=None):
+        self.executed.append(sql)
+
+    def in_transaction(self) -> bool:
+        return False
+
+
+class FakeConnection(Connection):
+    def new_session(self) -> Session:
+        return FakeSession()
+
+
+class FakeManager(FakeConnection):
+    multi_database = True
+
+
+def make_pools(**kwargs) -> SessionPools:
+    return SessionPools(FakeConnection(), **kwargs)
+
+
+def test_reuses_idle_sessions():
+    pools = make_pools()
+    sess = pools.acquire("alice")
+    pools.release("alice", sess)
+    assert pools.acquire("alice") is sess
+    assert pools.stats()["users"]["alice"]["created"] == 1
+
+
+def test_max_per_user_waits_for_release():
+    pools = make_pools(max_per_user=1, acquire_timeout=5)
+    sess = pools.acquire("alice")
+    # Other users are unaffected by alice's limit
+    pools.acquire("bob")
+    threading.Timer(0.05, pools.release, ("alice", sess)).start()
+    assert pools.acquire("alice") is sess
+    assert pools.stats()["users"]["alice"]["waits"] == 1
+
+
+def test_max_per_user_times_out():
+    pools = make_pools(max_per_user=1, acquire_timeout=0.05)
+    pools.acquire("alice")
+    with pytest.raises(PoolExhausted):
+        pools.acquire("alice")
+
+
+def test_max_total_evicts_other_users_idle_sessions():
+    pools = make_pools(max_total=2, acquire_timeout=0.05)
+    a = pools.acquire("alice")
+    b = pools.acquire("bob")
+    pools.release("alice", a)
+    c = pools.acquire("carol")
+    assert a.closed and not b.closed and not c.closed
+    assert pools.stats()["total"]["closed"] == 1
+    with pytest.raises(PoolExhausted):
+        pools.acquire("dave")
+
+
+def test_transactions_stick_to_their_session():
+    pools = make_pools()
+    sess = pools.acquire("alice")
+    pools.release("alice", sess, "txn1")
+    assert pools.acquire("alice") is not sess
+    assert pools.acquire("alice", "txn1") is sess
+
+
+def test_reap_idle_and_abandoned_transactions():
+    pools = make_pools(min_per_user=1, idle_timeout=60, txn_timeout=60)
+    s1, s2, s3 = (pools.acquire("alice") for _ in range(3))
+    pools.release("alice", s1)
+    pools.release("alice", s2)
+    pools.release("alice", s3, "txn1")
+    assert pools.reap() == 0
+    pool = pools.pools["alice"]
+    pool.idle = type(pool.idle)((s, t - 120) for s, t in pool.idle)
+    pool.txns = {k: (s, t - 120) for k, (s, t) in pool.txns.items()}
+    assert pools.reap() == 2
+    # The oldest idle session goes; min_per_user keeps the other
+    assert s1.closed and not s2.closed and s3.closed
+    assert pools.stats()["users"]["alice"] == {
+        "idle": 1,
+        "in_use": 0,
+        "transactions": 0,
+        "created": 3,
+        "closed": 2,
+        "waits": 0,
+    }
+
+
+def request(**headers) -> Request:
+    raw = [(f"x-trino-{k}".encode(), v.encode()) for k, v in headers.items()]
+    return Request({"type": "http", "headers": raw})
+
+
+def test_use_only_when_schema_changes():
+    pools = make_pools()
+    ctx = Context(pools, request(user="alice", catalog="memory", schema="default"))
+    sess = ctx.session()
+    ctx.close()
+    ctx = Context(pools, request(user="alice", catalog="memory", schema="default"))
+    assert ctx.session() is sess
+    ctx.execute_sql("SELECT 1")
+    ctx.close()
+    assert sess.executed == ["USE memory.main", "SELECT 1"]
+
+    # A USE from the client means we have to issue ours again next time
+    ctx = Context(pools, request(user="alice", catalog="memory", schema="default"))
+    ctx.execute_sql("use other")
+    ctx.close()
+    Context(pools, request(user="alice", catalog="memory", schema="default")).close()
+    assert sess.executed[-1] == "USE memory.main"
+
+    ctx = Context(pools, request(user="alice", catalog="memory", schema="default"))
+    ctx.execute_sql("\n Use\tother")
+    ctx.close()
+    Context(pools, request(user="alice", catalog="memory", schema="default")).close()
+    assert sess.executed[-1] == "USE memory.main"
+
+
+def test_acquire_prefers_session_on_target():
+    pools = make_pools()
+    a = Context(pools, request(user="alice", schema="a"))
+    b = Context(pools, request(user="alice", schema="b"))
+    sess_a, sess_b = a.session(), b.session()
+    a.close()
+    b.close()
+    # sess_b is the most recently used, but sess_a is already on schema a
+    ctx = Context(pools, request(user="alice", schema="a"))
+    assert ctx.session() is sess_a
+    assert sess_a.executed == ["USE a"]
+
+
+def test_single_database_connections_share_sessions_across_catalogs():
+    pools = make_pools()
+    sess = pools.acquire("alice", database="a")
+    pools.release("alice", sess)
+    assert pools.acquire("alice", database="b") is sess
+
+
+def test_databases_share_the_per_user_limit():
+    pools = SessionPools(FakeManager(), max_per_user=1, acquire_timeout=0.05)
+    a = pools.acquire("alice", database="a")
+    with pytest.raises(PoolExhausted):
+        pools.acquire("alice", database="b")
+    pools.release("alice", a)
+    # The idle session on a can't serve b, so it is closed to make room
+    b = pools.acquire("alice", database="b")
+    assert b is not a and a.closed
+    pools.release("alice", b)
+    assert pools.acquire("alice", database="b") is b
+    assert list(pools.stats()["users"]) == ["alice"]
@@ -0,0 +1,40 @@
+import os
+import time
+
+import pyarrow as pa
+import pytest
+
+from buenavista.http.main import parse_range
+from buenavista.http.spool import Spool
+
+
+def test_segments_split_batches(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=8 * 1000)
+    rb = pa.record_batch({"i": pa.array(range(5000), pa.int64())})
+    segments = list(spool.segments(rb.schema, [rb], "arrow"))
+    assert [s["rows"] for s in segments] == [1000] * 5
+    assert [s["row_offset"] for s in segments] == list(range(0, 5000, 1000))
+    assert all(spool.path(s["id"]) for s in segments)
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
+
+
+def test_cleanup_expired(tmp_path):
+    spool = Spool(str(tmp_path), ttl=60)
+    rb = pa.record_batch({"i": pa.array([1, 2, 3])})
+    (seg,) = spool.segments(rb.schema, [rb], "parquet")
+    assert spool.cleanup() == 0
+    old = time.time() - 120
+    os.utime(spool.path(seg["id"]), (old, old))
+    assert spool.cleanup() == 1
+    assert spool.path(seg["id"]) is None
+
+
+def test_parse_range():
+    assert parse_range(None, 100) is None
+    assert parse_range("bytes=0-9", 100) == (0, 9)
+    assert parse_range("bytes=90-", 100) == (90, 99)
+    assert parse_range("bytes=-10", 100) == (90, 99)
+    assert parse_range("bytes=50-500", 100) == (50, 99)
+    assert parse_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(ValueError):
+        parse_range("bytes=100-", 100)
@@ -0,0 +1,88 @@
+import sqlglot
+
+from buenavista.stats import (
+    StatementStatistics,
+    fingerprint,
+    normalize_sql,
+    text_fingerprint,
+)
+
+
+def _parse(sql):
+    return sqlglot.parse(sql)
+
+
+def test_normalize_sql():
+    assert (
+        normalize_sql(
+            _parse(
+                "SELECT a FROM t WHERE b = 'x' AND c IN (1, 2, 3) AND d = -1 "
+                "AND e = TRUE AND f IS NULL LIMIT 10"
+            )
+        )
+        == "SELECT a FROM t WHERE b = ? AND c IN (?) AND d = ? AND e = ? AND f IS ? LIMIT ?"
+    )
+
+
+def test_fingerprint_ignores_constants():
+    assert fingerprint(_parse("SELECT * FROM t WHERE id = 1")) == fingerprint(
+        _parse("select *   from t where id = -42")
+    )
+    assert fingerprint(_parse("SELECT * FROM t WHERE x = TRUE")) == fingerprint(
+        _parse("SELECT * FROM t WHERE x = NULL")
+    )
+    assert fingerprint(_parse("SELECT * FROM t WHERE id IN (1)")) == fingerprint(
+        _parse("SELECT * FROM t WHERE id IN (1, 2, 3)")
+    )
+    assert fingerprint(_parse("SELECT * FROM t WHERE id = 1")) != fingerprint(
+        _parse("SELECT * FROM u WHERE id = 1")
+    )
+
+
+def test_text_fingerprint():
+    assert text_fingerprint("NOT  SQL AT ALL (") == text_fingerprint("NOT SQL AT ALL (")
+
+
+def test_statement_statistics_record():
+    stats = StatementStatistics()
+    stats.record("SELECT 1", 10.0, rows=1, rewrite_ms=1.0, statements=_parse("SELECT 1"))
+    stats.record("SELECT 2", 30.0, rows=1, rewrite_ms=1.0, statements=_parse("SELECT 2"))
+    [entry] = stats.snapshot()
+    assert entry["query"] == "SELECT ?"
+    assert entry["calls"] == 2
+    assert entry["total_time_ms"] == 40.0
+    assert entry["mean_time_ms"] == 20.0
+    assert entry["p99_time_ms"] == 30.0
+    assert entry["rows"] == 2
+    assert entry["rewrite_time_ms"] == 2.0
+
+
+def test_statement_statistics_record_unparsed():
+    stats = StatementStatistics()
+    stats.record("SELECT   1", 1.0)
+    stats.record("SELECT 2", 1.0)
+    [entry] = stats.snapshot()
+    assert entry["query"] == "SELECT ?"
+    assert entry["calls"] == 2
+
+
+def test_text_fingerprint_ignores_literals():
+    assert text_fingerprint(
+        "SELECT \"col 1\", t1.x FROM t1 WHERE a = 'it''s' AND b IN (1, 2.5, -3)"
+    ) == text_fingerprint("SELECT \"col 1\", t1.x FROM t1 WHERE a = 'x' AND b IN (4)")
+    assert text_fingerprint('SELECT "col 1"') != text_fingerprint('SELECT "col 2"')
+    assert text_fingerprint("SELECT $1") != text_fingerprint("SELECT $2")
+
+
+def test_statement_statistics_evicts_least_used():
+    stats = StatementStatistics(max_statements=20)
+    for _ in range(5):
+        stats.record("SELECT hot FROM t", 1.0)
+    for i in range(100):
+        stats.record(f"SELECT c{i} FROM t", 1.0)
+        # a newly arrived statement survives long enough to build up stats
+        stats.record("SELECT late FROM t", 1.0)
+    queries = {e["query"]: e["calls"] for e in stats.snapshot()}
+    assert len(queries) <= 20
+    assert queries["SELECT hot FROM t"] == 5
+    assert queries["SELECT late FROM t"] == 100
@@ -0,0 +1,29 @@
+import os
+
+from buenavista.workers import Worker, supervise
+
+
+def test_tags_route_to_owner():
+    w0, w2 = Worker(0, 3, "0.0.0.0", 9000), Worker(2, 3, "0.0.0.0", 9000)
+    id = w2.tag("20230101_00001")
+    assert w0.owner(id) == 2
+    assert w0.is_remote(id)
+    assert not w2.is_remote(id)
+    assert not w0.is_remote("some-untagged-uuid")
+    assert w0.private_address(2) == ("127.0.0.1", 9002)
+
+    for value in (0, 12345, 2**32 - 1):
+        pid = w2.tag_int(value)
+        assert 0 <= pid < 2**32
+        assert w0.owner_int(pid) == 2
+    assert w0.owner_int(w2.random_id()) == 2
+
+
+def test_supervise_runs_each_worker(tmp_path):
+    def run(worker):
+        with open(tmp_path / f"w{worker.index}", "w") as f:
+            f.write(f"{worker.index}/{worker.count} {worker.private_port}")
+
+    supervise(3, run, "127.0.0.1", 9100, restart=False)
+    assert sorted(os.listdir(tmp_path)) == ["w0", "w1", "w2"]
+    assert (tmp_path / "w1").read_text() == "1/3 9101"